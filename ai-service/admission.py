@@ -0,0 +1,184 @@
+"""准入控制：按提供商的并发限制 + 有界优先级队列，按用户/租户的令牌桶限流
+
+- 每个LLM提供商最多 N 个并发上游调用，超出的请求进入有界优先级队列（交互式流式请求优先于批量任务）
+- 按最近的平均服务时长估算排队等待，超过超时时间或队列已满时直接拒绝（503 + Retry-After），
+  避免请求堆积到 LLM_TIMEOUT_SECONDS 后才返回兜底回复
+- 按用户/租户的令牌桶限流，超限返回 429 + Retry-After
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_QUEUE_WAIT, ADMISSION_SHED, RATE_LIMITED
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_BATCH = 2
+PRIORITY_NAMES = {"interactive": PRIORITY_INTERACTIVE, "default": PRIORITY_DEFAULT, "batch": PRIORITY_BATCH}
+
+
+class AdmissionRejected(Exception):
+    """请求被准入控制拒绝"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class ProviderLimiter:
+    """单个提供商的并发限制与有界优先级队列"""
+
+    def __init__(self, provider: str, max_concurrency: int, max_queue: int, max_wait_seconds: float, initial_service_seconds: float = 1.0):
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.avg_service_seconds = initial_service_seconds
+        self.active = 0
+        self.waiting = 0
+        self._heap: List[list] = []
+        self._seq = itertools.count()
+
+    def _waiting_ahead(self, priority: int) -> int:
+        return sum(1 for p, _, future in self._heap if p <= priority and not future.done())
+
+    def estimate_wait(self, priority: int) -> float:
+        """估算排队等待：前方等待数 / 并发数 × 平均服务时长"""
+        ahead = self._waiting_ahead(priority)
+        if self.active < self.max_concurrency and ahead == 0:
+            return 0.0
+        return (ahead + 1) / self.max_concurrency * self.avg_service_seconds
+
+    def check(self, priority: int = PRIORITY_DEFAULT):
+        """不占用名额的预检：队列已满或预计等待超时则拒绝"""
+        if self.waiting >= self.max_queue and self.active >= self.max_concurrency:
+            ADMISSION_SHED.labels(provider=self.provider, reason="queue_full").inc()
+            raise AdmissionRejected(503, "AI服务繁忙，请稍后重试", self.estimate_wait(priority))
+        estimated = self.estimate_wait(priority)
+        if estimated > self.max_wait_seconds:
+            ADMISSION_SHED.labels(provider=self.provider, reason="wait_exceeds_timeout").inc()
+            raise AdmissionRejected(503, "AI服务繁忙，预计等待超时，请稍后重试", estimated)
+
+    async def acquire(self, priority: int = PRIORITY_DEFAULT):
+        self.check(priority)
+        if self.active < self.max_concurrency and self.waiting == 0:
+            self.active += 1
+            ADMISSION_IN_FLIGHT.labels(provider=self.provider).set(self.active)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, [priority, next(self._seq), future])
+        self.waiting += 1
+        ADMISSION_QUEUE_DEPTH.labels(provider=self.provider).set(self.waiting)
+        started = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 名额已移交但调用方已取消：归还名额
+                self._hand_over()
+            else:
+                future.cancel()
+            raise
+        finally:
+            self.waiting -= 1
+            ADMISSION_QUEUE_DEPTH.labels(provider=self.provider).set(self.waiting)
+            ADMISSION_QUEUE_WAIT.labels(provider=self.provider, priority=str(priority)).observe(time.perf_counter() - started)
+
+    def _hand_over(self):
+        """释放名额：优先移交给队列中优先级最高的等待者"""
+        while self._heap:
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+        ADMISSION_IN_FLIGHT.labels(provider=self.provider).set(self.active)
+
+    def release(self, service_seconds: Optional[float] = None):
+        if service_seconds is not None:
+            # 指数加权平均，用于估算排队等待
+            self.avg_service_seconds = 0.8 * self.avg_service_seconds + 0.2 * service_seconds
+        self._hand_over()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_DEFAULT):
+        await self.acquire(priority)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
+
+    def stats(self) -> Dict:
+        return {
+            "provider": self.provider,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "avg_service_seconds": round(self.avg_service_seconds, 4),
+        }
+
+
+class AdmissionController:
+    """按提供商懒创建并发限制器，配置来自环境变量"""
+
+    def __init__(self, default_timeout: float):
+        self.default_timeout = default_timeout
+        self._limiters: Dict[str, ProviderLimiter] = {}
+
+    def limiter(self, provider: str) -> ProviderLimiter:
+        limiter = self._limiters.get(provider)
+        if limiter is None:
+            suffix = provider.upper()
+            limiter = ProviderLimiter(
+                provider,
+                max_concurrency=int(os.getenv(f"LLM_MAX_CONCURRENCY_{suffix}", os.getenv("LLM_MAX_CONCURRENCY", "8"))),
+                max_queue=int(os.getenv(f"LLM_MAX_QUEUE_{suffix}", os.getenv("LLM_MAX_QUEUE", "64"))),
+                max_wait_seconds=float(os.getenv("LLM_MAX_QUEUE_WAIT_SECONDS", str(self.default_timeout))),
+            )
+            self._limiters[provider] = limiter
+        return limiter
+
+    def stats(self) -> List[Dict]:
+        return [limiter.stats() for limiter in self._limiters.values()]
+
+
+class TokenBucketLimiter:
+    """按键（用户/租户）的令牌桶限流；仅保留最近活跃的 max_keys 个桶"""
+
+    def __init__(self, scope: str, rate_per_minute: float, burst: int, max_keys: int = 10000):
+        self.scope = scope
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def check(self, key: str):
+        """消耗一个令牌，令牌不足时抛出 429"""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [float(self.burst), now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1.0:
+            RATE_LIMITED.labels(scope=self.scope).inc()
+            raise AdmissionRejected(429, "请求过于频繁，请稍后重试", (1.0 - bucket[0]) / self.rate)
+        bucket[0] -= 1.0
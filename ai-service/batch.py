@@ -0,0 +1,162 @@
+"""批量补全：有界并发执行、按完成顺序产出结果，以及进程内的异步批量任务
+
+- run_bounded：最多 concurrency 个条目同时执行，结果按完成顺序产出；调用方提前退出时取消未完成的条目
+- BatchJobStore：异步任务（提交后立即返回 job_id，后台执行），结束的任务保留 ttl 秒后清理
+任务保存在进程内存中，多进程部署时需将同一任务的查询路由到同一进程。
+"""
+import asyncio
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from metrics import BATCH_ITEM_LATENCY, BATCH_ITEMS
+
+
+def _percentile_ms(sorted_seconds: List[float], p: float) -> float:
+    if not sorted_seconds:
+        return 0.0
+    k = min(len(sorted_seconds) - 1, max(0, round((len(sorted_seconds) - 1) * p / 100.0)))
+    return round(sorted_seconds[k] * 1000, 1)
+
+
+def summarize(results: Sequence[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    """汇总：成功/失败数、失败原因分布、条目延迟分位数、吞吐量"""
+    latencies = sorted(r["latency_ms"] / 1000.0 for r in results)
+    errors: Dict[str, int] = {}
+    for r in results:
+        if r["status"] != "ok":
+            errors[r.get("error_type", "error")] = errors.get(r.get("error_type", "error"), 0) + 1
+    return {
+        "type": "summary",
+        "total": len(results),
+        "succeeded": sum(1 for r in results if r["status"] == "ok"),
+        "failed": sum(errors.values()),
+        "errors": errors,
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "items_per_second": round(len(results) / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": {"p50": _percentile_ms(latencies, 50), "p95": _percentile_ms(latencies, 95), "max": _percentile_ms(latencies, 100)},
+    }
+
+
+async def run_bounded(
+    count: int,
+    handler: Callable[[int], Awaitable[Dict[str, Any]]],
+    concurrency: int,
+) -> AsyncIterator[Dict[str, Any]]:
+    """以有界并发执行 handler(0..count-1)，按完成顺序产出结果（附 index 与 latency_ms）"""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_one(index: int) -> Dict[str, Any]:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                result = await handler(index)
+                result.setdefault("status", "ok")
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                result = {"status": "error", "error_type": "timeout", "error": "条目执行超时"}
+            except Exception as e:
+                result = {"status": "error", "error_type": type(e).__name__, "error": str(e)}
+            elapsed = time.perf_counter() - started
+            BATCH_ITEMS.labels(outcome=result["status"]).inc()
+            BATCH_ITEM_LATENCY.observe(elapsed)
+            return {"type": "result", "index": index, **result, "latency_ms": round(elapsed * 1000, 1)}
+
+    tasks = [asyncio.create_task(run_one(i)) for i in range(count)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+class BatchJob:
+    def __init__(self, total: int):
+        self.id = uuid.uuid4().hex
+        self.total = total
+        self.status = "queued"
+        self.results: List[Dict[str, Any]] = []
+        self.summary: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def info(self, include_results: bool = False, offset: int = 0) -> Dict[str, Any]:
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "completed": len(self.results),
+            "failed": sum(1 for r in self.results if r["status"] != "ok"),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "summary": self.summary,
+            "error": self.error,
+        }
+        if include_results:
+            data["results"] = self.results[offset:]
+        return data
+
+
+class BatchJobStore:
+    """进程内批量任务：提交后在后台执行，结果逐条追加，可查询进度或取消"""
+
+    def __init__(self, max_jobs: int = 100, ttl_seconds: float = 3600.0):
+        self.max_jobs = max_jobs
+        self.ttl_seconds = ttl_seconds
+        self._jobs: Dict[str, BatchJob] = {}
+
+    def _evict(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > self.ttl_seconds:
+                del self._jobs[job_id]
+
+    def submit(self, total: int, results: Callable[[], AsyncIterator[Dict[str, Any]]]) -> BatchJob:
+        """创建任务并在后台消费 results()；任务数已达上限时抛出 RuntimeError"""
+        self._evict()
+        if len(self._jobs) >= self.max_jobs:
+            raise RuntimeError("批量任务数已达上限，请稍后重试")
+        job = BatchJob(total)
+        self._jobs[job.id] = job
+
+        async def run():
+            job.status = "running"
+            started = time.perf_counter()
+            try:
+                async for result in results():
+                    job.results.append(result)
+                job.status = "completed"
+            except asyncio.CancelledError:
+                job.status = "cancelled"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                job.summary = summarize(job.results, time.perf_counter() - started)
+                job.finished_at = time.time()
+
+        def finalize(_task):
+            # 任务在开始执行前被取消时 run() 不会运行
+            if job.finished_at is None:
+                job.status = "cancelled"
+                job.summary = summarize(job.results, 0.0)
+                job.finished_at = time.time()
+
+        job.task = asyncio.create_task(run())
+        job.task.add_done_callback(finalize)
+        return job
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        self._evict()
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[BatchJob]:
+        job = self._jobs.get(job_id)
+        if job is not None and job.task is not None and not job.task.done():
+            job.task.cancel()
+        return job
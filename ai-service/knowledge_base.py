@@ -0,0 +1,597 @@
+"""知识库：向量索引 + 文档存储
+
+- 文档ID稳定自增，不再依赖 document_store 的下标
+- 向量通过 faiss.IndexIDMap 按标签（label）存储，更新/删除时旧向量立即打墓碑
+- 墓碑比例超过阈值时在后台线程重建索引，仅在交换索引时短暂持锁，不阻塞检索
+- FAISS 检索在元数据锁之外进行：检索持索引读锁（可并发），向索引写入向量持写锁（独占）
+- 按集合（命名空间）隔离，每个集合独立索引；冷集合在全局内存预算下按LRU落盘卸载，访问时懒加载
+- 可选分片（shards>1）：向量按文档ID取模分到 N 个索引，检索时在共享线程池中并行搜索各分片后合并 top-k；
+  线程池大小与每次 FAISS 调用的 OpenMP 线程数由 configure_search_threads() 控制，避免线程超订
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_search_pool: Optional[ThreadPoolExecutor] = None
+_search_pool_lock = threading.Lock()
+_search_threads = os.cpu_count() or 1
+
+
+def configure_search_threads(search_threads: Optional[int] = None, omp_threads: Optional[int] = None):
+    """设置分片检索线程池大小（所有集合共享）与每次 FAISS 调用内部的 OpenMP 线程数
+
+    分片并行时并发度来自线程池，通常将 omp_threads 设为 1，使总线程数不超过 search_threads。
+    """
+    global _search_pool, _search_threads
+    if omp_threads:
+        faiss.omp_set_num_threads(omp_threads)
+    if search_threads:
+        with _search_pool_lock:
+            _search_threads = search_threads
+            if _search_pool is not None:
+                _search_pool.shutdown(wait=False)
+                _search_pool = None
+
+
+def _get_search_pool() -> ThreadPoolExecutor:
+    global _search_pool
+    with _search_pool_lock:
+        if _search_pool is None:
+            _search_pool = ThreadPoolExecutor(max_workers=_search_threads, thread_name_prefix="kb-search")
+        return _search_pool
+
+
+class ReadWriteLock:
+    """读写锁：读者共享、写者独占；有写者等待时新读者让行，避免写入饥饿"""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+def merge_topk(parts: List[Tuple[np.ndarray, np.ndarray]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """合并各分片的 (scores, labels)：每个查询按分数降序保留前 k 个"""
+    scores = np.concatenate([part[0] for part in parts], axis=1)
+    labels = np.concatenate([part[1] for part in parts], axis=1)
+    if scores.shape[1] > k:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, top, axis=1)
+        labels = np.take_along_axis(labels, top, axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(labels, order, axis=1)
+
+
+class KnowledgeBase:
+    """支持稳定ID、墓碑删除与后台压缩的知识库"""
+
+    def __init__(self, dim: int = 384, compaction_threshold: float = 0.25, compaction_min_tombstones: int = 16, shards: int = 1):
+        self.dim = dim
+        self.compaction_threshold = compaction_threshold
+        self.compaction_min_tombstones = compaction_min_tombstones
+        self.shards = max(1, shards)
+
+        # _lock 保护文档/标签/墓碑等元数据与索引列表的替换；_index_lock 保护 FAISS 索引本身（检索共享、写入独占）
+        self._lock = threading.RLock()
+        self._index_lock = ReadWriteLock()
+        self._indexes = [self._new_index() for _ in range(self.shards)]
+        self._documents: Dict[int, Dict[str, Any]] = {}
+        # 向量标签 <-> 文档ID：文档更新时换新标签，文档ID保持不变
+        self._vectors: Dict[int, np.ndarray] = {}
+        self._label_to_doc: Dict[int, int] = {}
+        self._doc_to_label: Dict[int, int] = {}
+        self._tombstones: set = set()
+        self._next_doc_id = 0
+        self._next_label = 0
+        self._content_bytes = 0
+        self.dirty = False
+        self.searches = 0
+
+        self._compacting = False
+        self._compaction_thread: Optional[threading.Thread] = None
+        self.compactions = 0
+        self.last_compaction_seconds = 0.0
+
+    def _new_index(self):
+        return faiss.IndexIDMap(faiss.IndexFlatIP(self.dim))
+
+    def _shard_of(self, doc_id: int) -> int:
+        return doc_id % self.shards
+
+    def _ntotal(self) -> int:
+        return sum(int(index.ntotal) for index in self._indexes)
+
+    def _build_indexes(self, labels: np.ndarray, doc_ids: np.ndarray, vectors: np.ndarray, indexes: Optional[list] = None) -> list:
+        """按文档ID把向量批量写入各分片索引（indexes 缺省时新建）"""
+        if indexes is None:
+            indexes = [self._new_index() for _ in range(self.shards)]
+        if len(labels):
+            shard_ids = doc_ids % self.shards
+            for shard, index in enumerate(indexes):
+                mask = shard_ids == shard
+                if mask.any():
+                    index.add_with_ids(np.ascontiguousarray(vectors[mask]), labels[mask])
+        return indexes
+
+    def _search_shards(self, indexes: list, query_vectors: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """单分片直接检索；多分片时其余分片提交到共享线程池、首个分片在当前线程检索，再合并 top-k"""
+        if len(indexes) == 1:
+            return indexes[0].search(query_vectors, k)
+        indexes = [index for index in indexes if index.ntotal > 0]
+
+        def search_shard(index):
+            return index.search(query_vectors, min(k, int(index.ntotal)))
+
+        pool = _get_search_pool()
+        futures = [pool.submit(search_shard, index) for index in indexes[1:]]
+        parts = [search_shard(indexes[0])] + [future.result() for future in futures]
+        return merge_topk(parts, k)
+
+    @staticmethod
+    def _as_matrix(embedding) -> np.ndarray:
+        return np.ascontiguousarray(np.asarray(embedding, dtype=np.float32).reshape(1, -1))
+
+    # === 写入 ===
+    def _add_vector(self, doc_id: int, embedding) -> int:
+        label = self._next_label
+        self._next_label += 1
+        vector = self._as_matrix(embedding)
+        with self._index_lock.write():
+            self._indexes[self._shard_of(doc_id)].add_with_ids(vector, np.array([label], dtype=np.int64))
+        self._vectors[label] = vector[0]
+        self._label_to_doc[label] = doc_id
+        self._doc_to_label[doc_id] = label
+        return label
+
+    def _tombstone(self, doc_id: int):
+        label = self._doc_to_label.pop(doc_id, None)
+        if label is None:
+            return
+        self._label_to_doc.pop(label, None)
+        self._vectors.pop(label, None)
+        self._tombstones.add(label)
+
+    def add(self, title: str, content: str, metadata: Dict[str, Any], embedding, timestamp: Optional[str] = None) -> Dict[str, Any]:
+        """添加文档，返回文档信息（含稳定ID）；timestamp 缺省为当前时间（复制回放时沿用日志中的时间）"""
+        with self._lock:
+            doc_id = self._next_doc_id
+            self._next_doc_id += 1
+            doc_info = {
+                "id": doc_id,
+                "title": title,
+                "content": content,
+                "metadata": metadata,
+                "timestamp": timestamp or datetime.now().isoformat(),
+            }
+            self._add_vector(doc_id, embedding)
+            self._documents[doc_id] = doc_info
+            self._content_bytes += len(content.encode("utf-8"))
+            self.dirty = True
+            return doc_info
+
+    def update(self, doc_id: int, title: str, content: str, metadata: Dict[str, Any], embedding, timestamp: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """替换文档内容：旧向量立即打墓碑，新向量沿用同一文档ID"""
+        with self._lock:
+            if doc_id not in self._documents:
+                return None
+            self._tombstone(doc_id)
+            self._add_vector(doc_id, embedding)
+            self._content_bytes -= len(self._documents[doc_id]["content"].encode("utf-8"))
+            self._content_bytes += len(content.encode("utf-8"))
+            self.dirty = True
+            doc_info = {
+                "id": doc_id,
+                "title": title,
+                "content": content,
+                "metadata": metadata,
+                "timestamp": timestamp or datetime.now().isoformat(),
+            }
+            self._documents[doc_id] = doc_info
+        self.maybe_compact()
+        return doc_info
+
+    def delete(self, doc_id: int) -> bool:
+        """删除文档：向量打墓碑后立即不可检索，物理清理交给后台压缩"""
+        with self._lock:
+            if doc_id not in self._documents:
+                return False
+            self._tombstone(doc_id)
+            self._content_bytes -= len(self._documents.pop(doc_id)["content"].encode("utf-8"))
+            self.dirty = True
+        self.maybe_compact()
+        return True
+
+    # === 读取 ===
+    def get(self, doc_id: int) -> Optional[Dict[str, Any]]:
+        return self._documents.get(doc_id)
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def search(self, query_vectors, top_k: int, min_score: Optional[float] = None) -> List[List[Tuple[float, Dict[str, Any]]]]:
+        """批量检索（N 个查询一次 search，多分片时各分片并行），每个查询返回 [(score, doc), ...]，已过滤墓碑与低于 min_score 的结果"""
+        query_vectors = np.ascontiguousarray(np.asarray(query_vectors, dtype=np.float32))
+        # 元数据锁内只取快照：索引列表、候选数与墓碑；压缩换下的旧索引不再被写入，可继续安全检索
+        with self._lock:
+            self.searches += len(query_vectors)
+            indexes = self._indexes
+            label_to_doc = self._label_to_doc
+            documents = self._documents
+            # 多取墓碑数量的候选，保证过滤后仍能凑满 top_k
+            k = min(top_k + len(self._tombstones), self._ntotal())
+            if k <= 0 or top_k <= 0:
+                return [[] for _ in range(len(query_vectors))]
+            tombstones = np.fromiter(self._tombstones, dtype=np.int64, count=len(self._tombstones))
+        with self._index_lock.read():
+            scores, labels = self._search_shards(indexes, query_vectors, k)
+
+        # 向量化过滤：无效位(-1)、墓碑、分数阈值，再按行累计只保留前 top_k 个有效结果
+        valid = labels >= 0
+        if tombstones.size:
+            valid &= ~np.isin(labels, tombstones)
+        if min_score is not None:
+            valid &= scores > min_score
+        valid &= np.cumsum(valid, axis=1) <= top_k
+
+        results = []
+        for row in range(len(labels)):
+            cols = np.flatnonzero(valid[row])
+            hits = []
+            for score, label in zip(scores[row, cols].tolist(), labels[row, cols].tolist()):
+                doc = documents.get(label_to_doc.get(label))
+                if doc is not None:
+                    hits.append((score, doc))
+            results.append(hits)
+        return results
+
+    # === 压缩 ===
+    def tombstone_ratio(self) -> float:
+        total = self._ntotal()
+        return len(self._tombstones) / total if total else 0.0
+
+    def maybe_compact(self) -> bool:
+        """墓碑比例超过阈值时启动后台压缩线程"""
+        with self._lock:
+            if self._compacting:
+                return False
+            if len(self._tombstones) < self.compaction_min_tombstones:
+                return False
+            if self.tombstone_ratio() < self.compaction_threshold:
+                return False
+            self._compacting = True
+        self._compaction_thread = threading.Thread(target=self._compact, name="kb-compaction", daemon=True)
+        self._compaction_thread.start()
+        return True
+
+    def compact(self):
+        """同步压缩（供管理接口与测试使用）"""
+        with self._lock:
+            if self._compacting:
+                thread = self._compaction_thread
+            else:
+                self._compacting = True
+                thread = None
+        if thread is not None:
+            thread.join()
+            return
+        self._compact()
+
+    def _compact(self):
+        started = time.perf_counter()
+        try:
+            # 快照当前存活向量，重建过程不持锁
+            with self._lock:
+                snapshot = dict(self._vectors)
+                owners = [self._label_to_doc[label] for label in snapshot]
+            new_indexes = self._build_indexes(
+                np.fromiter(snapshot.keys(), dtype=np.int64, count=len(snapshot)),
+                np.array(owners, dtype=np.int64),
+                np.vstack(list(snapshot.values())).astype(np.float32) if snapshot else np.zeros((0, self.dim), dtype=np.float32),
+            )
+
+            with self._lock:
+                # 补上重建期间新增的向量
+                added = [label for label in self._vectors if label not in snapshot]
+                if added:
+                    self._build_indexes(
+                        np.array(added, dtype=np.int64),
+                        np.array([self._label_to_doc[label] for label in added], dtype=np.int64),
+                        np.vstack([self._vectors[label] for label in added]).astype(np.float32),
+                        new_indexes,
+                    )
+                # 重建期间被删除的向量仍在新索引中，保留其墓碑
+                self._tombstones = {label for label in self._tombstones if label in snapshot}
+                self._indexes = new_indexes
+            self.compactions += 1
+            self.last_compaction_seconds = time.perf_counter() - started
+            logger.info(f"Knowledge base compacted: {self._ntotal()} vectors in {len(new_indexes)} shard(s) in {self.last_compaction_seconds:.3f}s")
+        except Exception as e:
+            logger.error(f"Knowledge base compaction failed: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def memory_bytes(self) -> int:
+        """估算内存占用：索引向量 + 压缩用向量副本 + 文档正文"""
+        return (self._ntotal() + len(self._vectors)) * self.dim * 4 + self._content_bytes
+
+    # === 持久化 ===
+    def save(self, directory: Path, mark_clean: bool = True):
+        """保存存活文档与向量（墓碑不落盘），先写临时文件再原子替换
+
+        mark_clean=False 用于保存到本地数据目录以外的位置（如复制快照），不影响本地落盘判断。
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            labels = list(self._vectors.keys())
+            vectors = np.vstack([self._vectors[label] for label in labels]) if labels else np.zeros((0, self.dim), dtype=np.float32)
+            state = {
+                "dim": self.dim,
+                "next_doc_id": self._next_doc_id,
+                "next_label": self._next_label,
+                "documents": list(self._documents.values()),
+                "doc_labels": [[doc_id, label] for doc_id, label in self._doc_to_label.items()],
+            }
+            if mark_clean:
+                self.dirty = False
+        tmp_vectors = directory / "vectors.tmp.npz"
+        np.savez(tmp_vectors, labels=np.array(labels, dtype=np.int64), vectors=vectors.astype(np.float32))
+        os.replace(tmp_vectors, directory / "vectors.npz")
+        tmp_state = directory / "documents.tmp.json"
+        tmp_state.write_text(json.dumps(state, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_state, directory / "documents.json")
+
+    @classmethod
+    def load(cls, directory: Path, **kwargs) -> "KnowledgeBase":
+        directory = Path(directory)
+        state = json.loads((directory / "documents.json").read_text(encoding="utf-8"))
+        kb = cls(dim=state["dim"], **kwargs)
+        with np.load(directory / "vectors.npz") as data:
+            labels = data["labels"]
+            vectors = data["vectors"].astype(np.float32)
+        kb._vectors = {int(label): vector for label, vector in zip(labels, vectors)}
+        kb._documents = {doc["id"]: doc for doc in state["documents"]}
+        kb._doc_to_label = {int(doc_id): int(label) for doc_id, label in state["doc_labels"]}
+        kb._label_to_doc = {label: doc_id for doc_id, label in kb._doc_to_label.items()}
+        # 分片数取当前配置，与保存时不同也可直接加载（按文档ID重新分片）
+        kb._build_indexes(labels, np.array([kb._label_to_doc[int(label)] for label in labels], dtype=np.int64), vectors, kb._indexes)
+        kb._next_doc_id = state["next_doc_id"]
+        kb._next_label = state["next_label"]
+        kb._content_bytes = sum(len(doc["content"].encode("utf-8")) for doc in state["documents"])
+        return kb
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "documents": len(self._documents),
+                "vectors": self._ntotal(),
+                "shards": self.shards,
+                "shard_vectors": [int(index.ntotal) for index in self._indexes],
+                "tombstones": len(self._tombstones),
+                "tombstone_ratio": round(self.tombstone_ratio(), 4),
+                "compacting": self._compacting,
+                "compactions": self.compactions,
+                "last_compaction_seconds": round(self.last_compaction_seconds, 4),
+                "memory_bytes": self.memory_bytes(),
+                "searches": self.searches,
+            }
+
+
+COLLECTION_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class CollectionManager:
+    """按集合（命名空间）管理知识库：懒加载 + 全局内存预算下的LRU卸载
+
+    写入须通过 use() 取得集合：使用期间集合被钉住，LRU 卸载会跳过它，避免写入落在已落盘卸载的对象上而丢失。
+    """
+
+    def __init__(self, data_dir: Path, dim: int = 384, memory_budget_bytes: int = 1024 * 1024 * 1024, **kb_options):
+        self.data_dir = Path(data_dir)
+        self.dim = dim
+        self.memory_budget_bytes = memory_budget_bytes
+        self.kb_options = kb_options
+        self._lock = threading.RLock()
+        self._loaded: "OrderedDict[str, KnowledgeBase]" = OrderedDict()
+        self._last_access: Dict[str, float] = {}
+        self._pins: Dict[str, int] = {}
+        self.loads = 0
+        self.unloads = 0
+
+    @staticmethod
+    def validate_name(name: str) -> str:
+        if not COLLECTION_NAME_PATTERN.match(name or ""):
+            raise ValueError(f"非法集合名称: {name!r}（仅允许字母、数字、下划线和短横线，最长64位）")
+        return name
+
+    def _path(self, name: str) -> Path:
+        return self.data_dir / name
+
+    def _on_disk(self, name: str) -> bool:
+        return (self._path(name) / "documents.json").exists()
+
+    def get(self, name: str, create: bool = False) -> Optional[KnowledgeBase]:
+        """获取集合，未加载则从磁盘懒加载；create=True 时不存在即新建"""
+        self.validate_name(name)
+        with self._lock:
+            kb = self._loaded.get(name)
+            if kb is None:
+                if self._on_disk(name):
+                    kb = KnowledgeBase.load(self._path(name), **self.kb_options)
+                    self.loads += 1
+                    logger.info(f"Collection loaded: {name} ({len(kb)} documents)")
+                elif create:
+                    kb = KnowledgeBase(dim=self.dim, **self.kb_options)
+                else:
+                    return None
+                self._loaded[name] = kb
+                self.enforce_budget(keep=name)
+            self._loaded.move_to_end(name)
+            self._last_access[name] = time.time()
+            return kb
+
+    @contextmanager
+    def use(self, name: str, create: bool = False):
+        """取得集合（同 get）并在 with 块内钉住，不会被卸载；结束后按预算卸载，包括刚写入变大的该集合本身"""
+        with self._lock:
+            kb = self.get(name, create=create)
+            if kb is not None:
+                self._pins[name] = self._pins.get(name, 0) + 1
+        try:
+            yield kb
+        finally:
+            if kb is not None:
+                with self._lock:
+                    self._pins[name] -= 1
+                    if not self._pins[name]:
+                        del self._pins[name]
+                    self.enforce_budget()
+
+    def enforce_budget(self, keep: Optional[str] = None):
+        """总内存超出预算时，按最近最少使用顺序落盘卸载冷集合（跳过 keep 与使用中的集合）"""
+        with self._lock:
+            total = sum(kb.memory_bytes() for kb in self._loaded.values())
+            for name in list(self._loaded.keys()):
+                if total <= self.memory_budget_bytes:
+                    break
+                if name == keep or name in self._pins:
+                    continue
+                total -= self._loaded[name].memory_bytes()
+                self._unload(name)
+
+    def _unload(self, name: str):
+        kb = self._loaded.pop(name)
+        # 墓碑不落盘，重新加载时索引天然是压缩后的
+        if kb.dirty or not self._on_disk(name):
+            kb.save(self._path(name))
+        self.unloads += 1
+        logger.info(f"Collection unloaded: {name}")
+
+    def drop(self, name: str) -> bool:
+        """删除整个集合（内存与磁盘）"""
+        self.validate_name(name)
+        with self._lock:
+            existed = self._loaded.pop(name, None) is not None
+            self._last_access.pop(name, None)
+            if self._path(name).exists():
+                shutil.rmtree(self._path(name))
+                existed = True
+            return existed
+
+    def save_all(self):
+        with self._lock:
+            for name, kb in self._loaded.items():
+                if kb.dirty:
+                    kb.save(self._path(name))
+
+    def export_to(self, target: Path):
+        """把全部集合的当前状态写到 target（已加载的从内存保存，未加载的复制磁盘文件），不改变本地状态"""
+        target = Path(target)
+        target.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            for name in self.names():
+                kb = self._loaded.get(name)
+                if kb is not None:
+                    kb.save(target / name, mark_clean=False)
+                else:
+                    shutil.copytree(self._path(name), target / name)
+
+    def restore_from(self, source: Optional[Path]):
+        """丢弃本地全部集合（内存与磁盘），再从 source（export_to 的输出）恢复；source 为 None 时清空"""
+        with self._lock:
+            self._loaded.clear()
+            self._last_access.clear()
+            if self.data_dir.exists():
+                shutil.rmtree(self.data_dir)
+            if source is not None and Path(source).exists():
+                shutil.copytree(source, self.data_dir)
+            else:
+                self.data_dir.mkdir(parents=True, exist_ok=True)
+
+    def names(self) -> List[str]:
+        with self._lock:
+            names = set(self._loaded.keys())
+            if self.data_dir.exists():
+                names.update(p.name for p in self.data_dir.iterdir() if (p / "documents.json").exists())
+            return sorted(names)
+
+    def total_documents(self) -> int:
+        with self._lock:
+            return sum(len(kb) for kb in self._loaded.values())
+
+    def collection_stats(self, name: str) -> Optional[Dict[str, Any]]:
+        """单个集合统计；未加载的集合不触发加载，只返回磁盘信息"""
+        self.validate_name(name)
+        with self._lock:
+            kb = self._loaded.get(name)
+            if kb is not None:
+                stats = kb.stats()
+                stats["loaded"] = True
+            elif self._on_disk(name):
+                path = self._path(name)
+                stats = {
+                    "loaded": False,
+                    "disk_bytes": sum(p.stat().st_size for p in path.iterdir() if p.is_file()),
+                }
+            else:
+                return None
+            stats["name"] = name
+            stats["last_access"] = self._last_access.get(name)
+            return stats
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "memory_bytes": sum(kb.memory_bytes() for kb in self._loaded.values()),
+                "loaded_collections": list(self._loaded.keys()),
+                "loads": self.loads,
+                "unloads": self.unloads,
+                "collections": [self.collection_stats(name) for name in self.names()],
+            }
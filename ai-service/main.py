@@ -1,11 +1,13 @@
-from fastapi import FastAPI, HTTPException, Depends
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 import os
 import asyncio
+import hmac
 import json
 import logging
+import time
 from datetime import datetime
 
 # LLM providers
@@ -18,6 +20,25 @@ from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
 
+from knowledge_base import CollectionManager, KnowledgeBase, configure_search_threads
+from replication import Replicator, apply_operation
+from rerank import Reranker
+from mock_provider import MockProvider
+from singleflight import SingleFlight, StreamFanout, request_key
+from batch import BatchJobStore, run_bounded, summarize
+from admission import (
+    PRIORITY_BATCH,
+    PRIORITY_DEFAULT,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_NAMES,
+    AdmissionController,
+    AdmissionRejected,
+    TokenBucketLimiter,
+)
+import metrics
+import profiling
+from metrics import LLM_FALLBACKS, LLM_LATENCY, instrument_stream, observe_stage
+
 # Load environment variables
 from dotenv import load_dotenv
 from pathlib import Path
@@ -31,11 +52,36 @@ load_dotenv(_service_dir / ".env", override=False)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse
+except ImportError:  # 可选依赖：未安装时使用标准库 json
+    orjson = None
+
+# 快速序列化（可选，需安装 orjson）：接口默认使用 ORJSONResponse，NDJSON 逐行用 orjson 编码
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "false").lower() == "true" and orjson is not None
+
 app = FastAPI(
     title="AI Service", 
     version="1.0.0",
-    description="智能企业协作平台 AI 服务 - 提供大模型对话、RAG检索等功能"
+    description="智能企业协作平台 AI 服务 - 提供大模型对话、RAG检索等功能",
+    default_response_class=ORJSONResponse if FAST_SERIALIZATION else JSONResponse,
 )
+# Prometheus 指标（/metrics）与请求关联ID
+metrics.install(app)
+# 按需请求剖析（PROFILING_ENABLED=true 时启用，/v1/profiles）
+profiling.install(app, _service_dir / "data" / "profiles")
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    """准入控制拒绝：429（限流）/ 503（过载），附带 Retry-After"""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+DEFAULT_COLLECTION = os.getenv("KB_DEFAULT_COLLECTION", "default")
 
 # === Models ===
 class ChatMessage(BaseModel):
@@ -47,22 +93,82 @@ class ChatRequest(BaseModel):
     conversation_history: Optional[List[ChatMessage]] = Field(default=[], description="对话历史")
     model: Optional[str] = Field(default=None, description="指定模型")
     use_rag: Optional[bool] = Field(default=True, description="是否使用RAG检索")
+    collection: Optional[str] = Field(default=DEFAULT_COLLECTION, description="RAG检索使用的知识库集合")
     temperature: Optional[float] = Field(default=0.7, description="生成温度")
+    summary: Optional[str] = Field(default=None, description="此前对话的滚动摘要（与对话历史尾部一起构成上下文）")
+
+class SummarizeRequest(BaseModel):
+    summary: Optional[str] = Field(default="", description="已有摘要")
+    messages: List[ChatMessage] = Field(..., description="需要并入摘要的新消息")
+    max_chars: Optional[int] = Field(default=800, description="摘要最大字数")
+    model: Optional[str] = Field(default=None, description="指定模型")
 
 class DocumentRequest(BaseModel):
     title: str = Field(..., description="文档标题")
     content: str = Field(..., description="文档内容")
     metadata: Optional[Dict[str, Any]] = Field(default={}, description="文档元数据")
+    collection: Optional[str] = Field(default=DEFAULT_COLLECTION, description="知识库集合（命名空间）")
 
 class SearchRequest(BaseModel):
     query: str = Field(..., description="搜索查询")
     top_k: Optional[int] = Field(default=5, description="返回结果数量")
+    collection: Optional[str] = Field(default=DEFAULT_COLLECTION, description="知识库集合（命名空间）")
+
+class MultiSearchRequest(BaseModel):
+    queries: List[str] = Field(..., description="多个搜索查询（一次编码、一次检索）")
+    top_k: Optional[int] = Field(default=5, description="每个查询返回结果数量")
+    collection: Optional[str] = Field(default=DEFAULT_COLLECTION, description="知识库集合（命名空间）")
+    min_score: Optional[float] = Field(default=0.2, description="相似度阈值")
+
+class BatchItem(BaseModel):
+    id: Optional[str] = Field(default=None, description="调用方自定义的条目ID，原样返回")
+    text: str = Field(..., description="条目输入文本（如待摘要/分类的文档）")
+    model: Optional[str] = Field(default=None, description="覆盖批量请求的模型（provider 或 provider:model）")
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem] = Field(..., description="批量条目")
+    instruction: Optional[str] = Field(default=None, description="所有条目共享的任务说明（系统提示），如“用一句话总结以下文档”")
+    model: Optional[str] = Field(default=None, description="默认模型，条目可单独覆盖以分散到多个提供商")
+    use_rag: Optional[bool] = Field(default=False, description="是否为每个条目检索知识库上下文（一次批量编码 + 一次多查询检索）")
+    collection: Optional[str] = Field(default=DEFAULT_COLLECTION, description="RAG检索使用的知识库集合")
+    temperature: Optional[float] = Field(default=0.2, description="生成温度")
+    concurrency: Optional[int] = Field(default=None, description="并发条目数，上限为 BATCH_MAX_CONCURRENCY")
+    item_timeout_seconds: Optional[float] = Field(default=None, description="单个条目超时（含排队），缺省为 BATCH_ITEM_TIMEOUT_SECONDS")
 
 # === Global Variables ===
 llm_clients = {}
 embedding_model = None
-vector_index = None
-document_store = []
+kb_collections: Optional[CollectionManager] = None
+replicator: Optional[Replicator] = None
+reranker: Optional[Reranker] = None
+
+# 相同请求合并：同一时刻的相同提示词/检索只向上游发起一次
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+llm_flights = SingleFlight("llm")
+retrieval_flights = SingleFlight("retrieve")
+stream_flights = StreamFanout("stream_echo")
+
+# 批量补全：单次请求的条目数与并发上限，异步任务保存在进程内
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "5000"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+BATCH_DEFAULT_CONCURRENCY = int(os.getenv("BATCH_DEFAULT_CONCURRENCY", "4"))
+batch_jobs = BatchJobStore(
+    max_jobs=int(os.getenv("BATCH_MAX_JOBS", "100")),
+    ttl_seconds=float(os.getenv("BATCH_JOB_TTL_SECONDS", "3600")),
+)
+
+# 准入控制：按提供商的并发限制与有界优先级队列，按用户/租户的令牌桶限流
+admission = AdmissionController(default_timeout=float(os.getenv("LLM_TIMEOUT_SECONDS", "6")))
+user_rate_limiter = TokenBucketLimiter(
+    "user",
+    rate_per_minute=float(os.getenv("RATE_LIMIT_PER_MINUTE", "60")),
+    burst=int(os.getenv("RATE_LIMIT_BURST", "20")),
+)
+tenant_rate_limiter = TokenBucketLimiter(
+    "tenant",
+    rate_per_minute=float(os.getenv("RATE_LIMIT_TENANT_PER_MINUTE", "600")),
+    burst=int(os.getenv("RATE_LIMIT_TENANT_BURST", "100")),
+)
 
 # === Initialization ===
 def initialize_llm_clients():
@@ -88,30 +194,102 @@ def initialize_llm_clients():
         genai.configure(api_key=gemini_key)
         llm_clients["gemini"] = genai
         logger.info("Gemini client initialized")
+    
+    # 离线模拟提供商（压测/基准测试用）
+    if os.getenv("MOCK_LLM_ENABLED", "false").lower() == "true":
+        llm_clients["mock"] = MockProvider.from_env()
+        logger.info("Mock LLM provider initialized")
 
 def initialize_embedding_model():
     """初始化嵌入模型"""
-    global embedding_model, vector_index
+    global embedding_model, kb_collections
     try:
         # 使用轻量级的中文嵌入模型
         embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        # 初始化FAISS索引 (384维向量)
-        vector_index = faiss.IndexFlatIP(384)
+        # 分片并行检索：KB_SEARCH_THREADS 为各集合共享的分片检索线程数，FAISS_OMP_THREADS 为每次 FAISS 调用的 OpenMP 线程数
+        # 分片时默认每次 FAISS 调用单线程，总检索线程数由 KB_SEARCH_THREADS 决定，避免分片线程 × OpenMP 线程超订
+        kb_shards = int(os.getenv("KB_SHARDS", "1"))
+        configure_search_threads(
+            search_threads=int(os.getenv("KB_SEARCH_THREADS", "0")) or None,
+            omp_threads=int(os.getenv("FAISS_OMP_THREADS", "1" if kb_shards > 1 else "0")) or None,
+        )
+        # 初始化知识库集合管理 (384维向量，每个集合独立 IndexIDMap 索引，KB_SHARDS>1 时按文档ID分片)
+        kb_collections = CollectionManager(
+            data_dir=Path(os.getenv("KB_DATA_DIR", str(_service_dir / "data" / "collections"))),
+            dim=384,
+            memory_budget_bytes=int(float(os.getenv("KB_MEMORY_BUDGET_MB", "1024")) * 1024 * 1024),
+            compaction_threshold=float(os.getenv("KB_COMPACTION_THRESHOLD", "0.25")),
+            compaction_min_tombstones=int(os.getenv("KB_COMPACTION_MIN_TOMBSTONES", "16")),
+            shards=kb_shards,
+        )
         logger.info("Embedding model and vector index initialized")
     except Exception as e:
         logger.error(f"Failed to initialize embedding model: {e}")
 
+def initialize_replication():
+    """多副本复制（可选，KB_REPLICATION_DIR 指向各副本共享的目录时启用）：从最新快照引导并跟读写入日志"""
+    global replicator
+    directory = os.getenv("KB_REPLICATION_DIR")
+    if not directory or kb_collections is None:
+        return
+    try:
+        replicator = Replicator(
+            kb_collections,
+            Path(directory),
+            poll_seconds=float(os.getenv("KB_REPLICATION_POLL_SECONDS", "0.5")),
+            snapshot_every_entries=int(os.getenv("KB_SNAPSHOT_EVERY_ENTRIES", "1000")),
+            snapshot_interval_seconds=float(os.getenv("KB_SNAPSHOT_INTERVAL_SECONDS", "300")),
+            snapshot_retain=int(os.getenv("KB_SNAPSHOT_RETAIN", "2")),
+            segment_bytes=int(float(os.getenv("KB_WAL_SEGMENT_MB", "64")) * 1024 * 1024),
+            fsync=os.getenv("KB_WAL_FSYNC", "true").lower() == "true",
+        )
+        replicator.start()
+        logger.info(f"Knowledge base replication enabled: {directory} (applied seq {replicator.applied_seq})")
+    except Exception as e:
+        replicator = None
+        logger.error(f"Failed to initialize knowledge base replication: {e}")
+
+def initialize_reranker():
+    """初始化交叉编码器重排序（可选，RERANK_ENABLED=true 时启用）"""
+    global reranker
+    if os.getenv("RERANK_ENABLED", "false").lower() != "true":
+        return
+    try:
+        reranker = Reranker(
+            model_name=os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"),
+            candidates=int(os.getenv("RERANK_CANDIDATES", "20")),
+            budget_ms=float(os.getenv("RERANK_BUDGET_MS", "150")),
+            min_score=float(os.getenv("RERANK_MIN_SCORE", "0")),
+            max_queue=int(os.getenv("RERANK_MAX_QUEUE", "4")),
+            batch_budget_ms=float(os.getenv("RERANK_BATCH_BUDGET_MS", "2000")),
+        )
+        logger.info(f"Reranker initialized: {reranker.model_name}")
+    except Exception as e:
+        logger.error(f"Failed to initialize reranker: {e}")
+
 @app.on_event("startup")
 async def startup_event():
     """应用启动时初始化"""
     initialize_llm_clients()
     initialize_embedding_model()
+    initialize_replication()
+    initialize_reranker()
     logger.info("AI Service started successfully")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时停止跟读写入日志，并将已加载集合落盘"""
+    if replicator is not None:
+        replicator.stop()
+    if kb_collections is not None:
+        kb_collections.save_all()
+
 # === Helper Functions ===
 def get_available_model():
-    """获取可用的LLM模型（优先Gemini）"""
-    if "gemini" in llm_clients:
+    """获取可用的LLM模型（启用模拟提供商时优先使用，其次Gemini）"""
+    if "mock" in llm_clients:
+        return "mock", "mock-llm"
+    elif "gemini" in llm_clients:
         return "gemini", os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
     elif "openai" in llm_clients:
         return "openai", os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
@@ -120,29 +298,178 @@ def get_available_model():
     else:
         return None, None
 
-def retrieve_context(query: str, top_k: int = 3) -> List[str]:
+def resolve_model(model: Optional[str]):
+    """解析模型参数（格式：provider 或 provider:model），未指定时使用默认可用模型"""
+    model_type, model_name = get_available_model()
+    if model:
+        parts = model.split(":", 1)
+        if len(parts) == 2:
+            model_type, model_name = parts[0], parts[1]
+        else:
+            model_type = parts[0]
+            # 使用默认模型
+            if model_type == "openai":
+                model_name = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+            elif model_type == "anthropic":
+                model_name = "claude-3-haiku-20240307"
+            elif model_type == "gemini":
+                model_name = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+            elif model_type == "mock":
+                model_name = "mock-llm"
+    return model_type, model_name
+
+# 内部调用方（Django）与AI服务共享的令牌；只有携带该令牌的请求才信任其 X-User-ID / X-Tenant-ID / X-Request-Priority
+AI_SERVICE_TOKEN = os.getenv("AI_SERVICE_TOKEN", "")
+
+def is_internal_caller(http_request: Request) -> bool:
+    """请求是否来自内部调用方：配置了 AI_SERVICE_TOKEN 时校验 X-Internal-Token；
+    未配置时只信任未经 nginx 转发的请求（nginx 对外代理 /ai/ 时总会设置 X-Real-IP）"""
+    if AI_SERVICE_TOKEN:
+        token = http_request.headers.get("X-Internal-Token", "")
+        return bool(token) and hmac.compare_digest(token, AI_SERVICE_TOKEN)
+    return "x-real-ip" not in http_request.headers and "x-forwarded-for" not in http_request.headers
+
+def client_address(http_request: Request) -> str:
+    """外部调用方的客户端地址：优先 nginx 设置的 X-Real-IP，其次 X-Forwarded-For 中 nginx 追加的最后一跳"""
+    real_ip = http_request.headers.get("X-Real-IP")
+    if real_ip:
+        return real_ip.strip()
+    forwarded = http_request.headers.get("X-Forwarded-For")
+    if forwarded:
+        return forwarded.split(",")[-1].strip()
+    return http_request.client.host if http_request.client else "anonymous"
+
+def request_priority(http_request: Request, default: int) -> int:
+    """请求优先级：内部调用方可用 X-Request-Priority 头（interactive/default/batch）指定，否则按接口类型"""
+    if not is_internal_caller(http_request):
+        return default
+    return PRIORITY_NAMES.get(http_request.headers.get("X-Request-Priority", "").lower(), default)
+
+def check_rate_limits(http_request: Request):
+    """用户/租户令牌桶限流：内部调用方按透传的用户ID与租户，外部调用方按客户端地址"""
+    if is_internal_caller(http_request):
+        user_key = http_request.headers.get("X-User-ID") or client_address(http_request)
+        tenant = http_request.headers.get("X-Tenant-ID")
+    else:
+        user_key, tenant = f"ip:{client_address(http_request)}", None
+    user_rate_limiter.check(user_key)
+    if tenant:
+        tenant_rate_limiter.check(tenant)
+
+def admit(http_request: Request, model_type: str, priority: int):
+    """准入预检：用户/租户令牌桶限流 + 提供商排队预估，不通过时抛出 AdmissionRejected"""
+    check_rate_limits(http_request)
+    admission.limiter(model_type).check(priority)
+
+def get_collection(name: Optional[str], create: bool = False) -> Optional[KnowledgeBase]:
+    """按名称获取知识库集合，名称非法时返回400"""
+    if kb_collections is None:
+        raise HTTPException(status_code=503, detail="向量化服务未就绪")
+    try:
+        return kb_collections.get(name or DEFAULT_COLLECTION, create=create)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def ndjson_line(data: Dict[str, Any]) -> str:
+    """NDJSON 行（非 ASCII 字符原样输出），启用快速序列化时使用 orjson"""
+    if FAST_SERIALIZATION:
+        return orjson.dumps(data).decode("utf-8") + "\n"
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+def validate_collection(name: Optional[str]) -> str:
+    """校验集合名称（缺省为默认集合），非法时返回400"""
+    try:
+        return CollectionManager.validate_name(name or DEFAULT_COLLECTION)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def authorize_collection(http_request: Request, name: Optional[str]) -> str:
+    """校验集合名称并按调用方授权：外部调用方（经 nginx /ai/）只能使用默认集合，其他集合仅限内部调用方"""
+    collection = validate_collection(name)
+    if collection != DEFAULT_COLLECTION and not is_internal_caller(http_request):
+        raise HTTPException(status_code=403, detail="只有内部调用方可以访问该知识库集合")
+    return collection
+
+def require_internal(http_request: Request):
+    """修改/删除文档、集合管理与复制快照等管理操作仅限内部调用方"""
+    if not is_internal_caller(http_request):
+        raise HTTPException(status_code=403, detail="仅限内部调用方")
+
+def apply_write(record: Dict[str, Any]) -> Any:
+    """知识库写入：启用复制时先追加到共享写入日志再按序应用，否则直接应用到本地集合"""
+    if replicator is not None:
+        return replicator.submit(record)
+    return apply_operation(kb_collections, record)
+
+async def sync_replica():
+    """写入前先应用其他副本已写入的日志，使存在性检查看到最新状态"""
+    if replicator is not None:
+        await asyncio.to_thread(replicator.catch_up)
+
+def retrieve_context(query: str, top_k: int = 3, collection: Optional[str] = None) -> List[str]:
     """从向量数据库检索相关上下文"""
-    if vector_index is None or embedding_model is None or len(document_store) == 0:
+    if kb_collections is None or embedding_model is None:
         return []
     
     try:
+        knowledge_base = kb_collections.get(collection or DEFAULT_COLLECTION)
+        if knowledge_base is None or len(knowledge_base) == 0:
+            return []
+        
         # 生成查询向量
-        query_vector = embedding_model.encode([query])
+        with observe_stage("encode"):
+            query_vector = embedding_model.encode([query])
+        
+        # 搜索最相似的文档（已过滤墓碑）；启用重排序时多召回一些候选
+        candidates_k = max(top_k, reranker.candidates) if reranker is not None else top_k
+        with observe_stage("search"):
+            hits = knowledge_base.search(query_vector, candidates_k, min_score=0.3)[0]  # 相似度阈值
         
-        # 搜索最相似的文档
-        scores, indices = vector_index.search(query_vector, min(top_k, len(document_store)))
+        # 交叉编码器重排序并裁剪，超出延迟预算时保持向量顺序
+        if reranker is not None:
+            with observe_stage("rerank"):
+                hits = reranker.rerank(query, hits, top_k)
         
         # 返回相关文档内容
-        contexts = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx != -1 and score > 0.3:  # 相似度阈值
-                contexts.append(document_store[idx]["content"][:500])  # 限制长度
+        contexts = [doc["content"][:500] for _, doc in hits[:top_k]]  # 限制长度
         
         return contexts
     except Exception as e:
         logger.error(f"Error in retrieve_context: {e}")
         return []
 
+async def retrieve_context_shared(query: str, top_k: int = 3, collection: Optional[str] = None) -> List[str]:
+    """在线程中执行检索（不阻塞事件循环），相同查询并发到达时只检索一次"""
+    def _retrieve():
+        return asyncio.to_thread(retrieve_context, query, top_k, collection)
+    if not SINGLEFLIGHT_ENABLED:
+        return await _retrieve()
+    key = request_key("retrieve", query, top_k, collection or DEFAULT_COLLECTION)
+    return await retrieval_flights.do(key, _retrieve)
+
+def retrieve_contexts_batch(queries: List[str], top_k: int = 3, collection: Optional[str] = None) -> List[List[str]]:
+    """多个查询共享一次批量编码与一次多查询向量检索，返回每个查询的上下文列表"""
+    empty = [[] for _ in queries]
+    if kb_collections is None or embedding_model is None or not queries:
+        return empty
+    try:
+        knowledge_base = kb_collections.get(collection or DEFAULT_COLLECTION)
+        if knowledge_base is None or len(knowledge_base) == 0:
+            return empty
+        with observe_stage("encode"):
+            query_vectors = embedding_model.encode(queries, batch_size=64)
+        candidates_k = max(top_k, reranker.candidates) if reranker is not None else top_k
+        with observe_stage("search"):
+            all_hits = knowledge_base.search(query_vectors, candidates_k, min_score=0.3)
+        # 所有查询的候选对合并为一次交叉编码器推理
+        if reranker is not None:
+            with observe_stage("rerank"):
+                all_hits = reranker.rerank_many(queries, all_hits, top_k)
+        return [[doc["content"][:500] for _, doc in hits[:top_k]] for hits in all_hits]
+    except Exception as e:
+        logger.error(f"Error in retrieve_contexts_batch: {e}")
+        return empty
+
 async def call_llm(messages: List[Dict], model_type: str, model_name: str, temperature: float = 0.7, stream: bool = False):
     """调用LLM生成回复"""
     try:
@@ -280,6 +607,16 @@ async def call_llm(messages: List[Dict], model_type: str, model_name: str, tempe
                     return resp.text if hasattr(resp, "text") else ""
                 
                 return await asyncio.to_thread(_sync_gemini_generate)
+        
+        elif model_type == "mock":
+            mock_provider = llm_clients["mock"]
+            if stream:
+                async def _async_wrap_mock_stream():
+                    async for token in mock_provider.stream(messages):
+                        yield MockStreamChunk(token)
+                return _async_wrap_mock_stream()
+            else:
+                return await mock_provider.complete(messages)
     
     except Exception as e:
         logger.error(f"LLM call failed: {e}")
@@ -308,35 +645,28 @@ def healthz():
         "service": "ai-service",
         "available_llm": f"{model_type}:{model_name}" if model_type else "none",
         "embedding_ready": embedding_model is not None,
-        "vector_index_ready": vector_index is not None,
-        "documents_count": len(document_store)
+        "vector_index_ready": kb_collections is not None,
+        "documents_count": kb_collections.total_documents() if kb_collections is not None else 0
     }
 
 @app.post("/v1/echo")
-async def chat_completion(request: ChatRequest):
+async def chat_completion(request: ChatRequest, http_request: Request):
     """智能对话接口 - 支持RAG检索增强"""
-    model_type, model_name = get_available_model()
     # 支持通过request.model覆盖默认模型（格式：provider 或 provider:model）
-    if request.model:
-        parts = request.model.split(":", 1)
-        if len(parts) == 2:
-            model_type, model_name = parts[0], parts[1]
-        else:
-            model_type = parts[0]
-            # 使用默认模型
-            if model_type == "openai":
-                model_name = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
-            elif model_type == "anthropic":
-                model_name = "claude-3-haiku-20240307"
-            elif model_type == "gemini":
-                model_name = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+    model_type, model_name = resolve_model(request.model)
     if not model_type:
         raise HTTPException(status_code=503, detail="没有可用的LLM服务，请检查API密钥配置")
     
+    # 准入控制：超限/过载时尽早返回 429/503
+    collection = authorize_collection(http_request, request.collection)
+    priority = request_priority(http_request, PRIORITY_DEFAULT)
+    admit(http_request, model_type, priority)
+    
     # RAG检索
     contexts = []
     if request.use_rag and request.text:
-        contexts = retrieve_context(request.text)
+        with observe_stage("retrieve"):
+            contexts = await retrieve_context_shared(request.text, collection=collection)
     
     # 构建消息
     messages = []
@@ -351,6 +681,8 @@ async def chat_completion(request: ChatRequest):
     
     if contexts:
         system_prompt += f"\n\n参考上下文信息：\n" + "\n".join([f"- {ctx}" for ctx in contexts])
+    if request.summary:
+        system_prompt += f"\n\n此前对话摘要：\n{request.summary}"
     
     messages.append({"role": "system", "content": system_prompt})
     
@@ -363,12 +695,28 @@ async def chat_completion(request: ChatRequest):
     
     # 调用LLM（增加超时保护与离线兜底）
     llm_timeout = float(os.getenv("LLM_TIMEOUT_SECONDS", "6"))
+    llm_started = time.perf_counter()
+    
+    async def _generate():
+        async def _call_with_slot():
+            # 排队等待计入超时时间
+            async with admission.limiter(model_type).slot(priority):
+                return await call_llm(messages, model_type, model_name, request.temperature)
+        return await asyncio.wait_for(_call_with_slot(), timeout=llm_timeout)
+    
     try:
-        response_text = await asyncio.wait_for(
-            call_llm(messages, model_type, model_name, request.temperature),
-            timeout=llm_timeout,
-        )
+        with observe_stage("llm"):
+            if SINGLEFLIGHT_ENABLED:
+                # 相同的完整提示词 + 模型 + 温度共享一次上游调用
+                llm_key = request_key("echo", messages, model_type, model_name, request.temperature)
+                response_text = await llm_flights.do(llm_key, _generate)
+            else:
+                response_text = await _generate()
+        LLM_LATENCY.labels(provider=model_type, stream="false").observe(time.perf_counter() - llm_started)
+    except AdmissionRejected:
+        raise
     except asyncio.TimeoutError:
+        LLM_FALLBACKS.labels(provider=model_type, reason="timeout").inc()
         user_msg = next((m["content"] for m in messages if m["role"] == "user"), "")
         # 简单离线兜底
         if "1+1" in user_msg or "加法" in user_msg or "等于" in user_msg:
@@ -377,6 +725,7 @@ async def chat_completion(request: ChatRequest):
             response_text = f"抱歉，当前连接到AI提供商超时，已返回离线兜底回复：您刚才问的是“{user_msg}”。"
         logger.warning("LLM call timeout, returned offline fallback response")
     except Exception as e:
+        LLM_FALLBACKS.labels(provider=model_type, reason="error").inc()
         user_msg = next((m["content"] for m in messages if m["role"] == "user"), "")
         if "1+1" in user_msg or "加法" in user_msg or "等于" in user_msg:
             response_text = "1+1等于2。这是一个基本的数学加法运算。（离线兜底）"
@@ -392,46 +741,79 @@ async def chat_completion(request: ChatRequest):
     }
 
 @app.get("/v1/stream_echo")
-async def stream_chat(text: str, use_rag: bool = True, model: str = None):
+async def stream_chat(http_request: Request, text: str, use_rag: bool = True, model: str = None, collection: str = DEFAULT_COLLECTION, summary: str = None):
     """流式对话接口"""
-    model_type, model_name = get_available_model()
+    return await stream_chat_response(http_request, text, use_rag, model, collection, summary=summary)
+
+@app.post("/v1/stream_echo")
+async def stream_chat_with_history(request: ChatRequest, http_request: Request):
+    """流式对话接口（POST）：支持对话历史与滚动摘要"""
+    return await stream_chat_response(
+        http_request,
+        request.text,
+        request.use_rag,
+        request.model,
+        request.collection,
+        history=request.conversation_history,
+        summary=request.summary,
+        temperature=request.temperature,
+    )
+
+async def stream_chat_response(
+    http_request: Request,
+    text: str,
+    use_rag: bool,
+    model: Optional[str],
+    collection: Optional[str],
+    history: Optional[List[ChatMessage]] = None,
+    summary: Optional[str] = None,
+    temperature: float = 0.7,
+):
+    """流式对话：构建消息并返回SSE响应"""
     # 支持通过query参数model覆盖（格式：provider 或 provider:model）
-    if model:
-        parts = model.split(":", 1)
-        if len(parts) == 2:
-            model_type, model_name = parts[0], parts[1]
-        else:
-            model_type = parts[0]
-            if model_type == "openai":
-                model_name = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
-            elif model_type == "anthropic":
-                model_name = "claude-3-haiku-20240307"
-            elif model_type == "gemini":
-                model_name = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+    model_type, model_name = resolve_model(model)
     if not model_type:
         raise HTTPException(status_code=503, detail="没有可用的LLM服务")
     
+    collection = authorize_collection(http_request, collection)
+    # 准入控制：交互式流式请求优先于批量任务；超限/过载时在开始推流前返回 429/503
+    priority = request_priority(http_request, PRIORITY_INTERACTIVE)
+    admit(http_request, model_type, priority)
+    
     # RAG检索
     contexts = []
     if use_rag:
-        contexts = retrieve_context(text)
+        with observe_stage("retrieve"):
+            contexts = await retrieve_context_shared(text, collection=collection)
     
     # 构建消息
     system_prompt = """你是一个智能企业协作平台的AI助手，请以友好专业的语气回答问题。"""
     if contexts:
         system_prompt += f"\n\n参考信息：\n" + "\n".join([f"- {ctx}" for ctx in contexts])
+    if summary:
+        system_prompt += f"\n\n此前对话摘要：\n{summary}"
     
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": text}
-    ]
+    messages = [{"role": "system", "content": system_prompt}]
+    for msg in (history or [])[-5:]:  # 只保留最近5轮对话
+        messages.append({"role": msg.role, "content": msg.content})
+    messages.append({"role": "user", "content": text})
     
     async def event_generator():
         stream_timeout = float(os.getenv("STREAM_TIMEOUT_SECONDS", "8"))
+        limiter = admission.limiter(model_type)
+        try:
+            await asyncio.wait_for(limiter.acquire(priority), timeout=stream_timeout)
+        except (asyncio.TimeoutError, AdmissionRejected):
+            # 排队超时/过载兜底
+            LLM_FALLBACKS.labels(provider=model_type, reason="shed").inc()
+            yield f"data: {'抱歉，当前AI服务繁忙，请稍后重试。'}\n\n"
+            yield "event: end\ndata: [DONE]\n\n"
+            return
+        slot_started = time.perf_counter()
         try:
             if model_type == "openai":
                 response = await asyncio.wait_for(
-                    call_llm(messages, model_type, model_name, stream=True),
+                    call_llm(messages, model_type, model_name, temperature, stream=True),
                     timeout=stream_timeout,
                 )
                 async for chunk in response:
@@ -443,7 +825,7 @@ async def stream_chat(text: str, use_rag: bool = True, model: str = None):
             elif model_type == "anthropic":
                 # Anthropic流式响应处理
                 response = await asyncio.wait_for(
-                    call_llm(messages, model_type, model_name, stream=True),
+                    call_llm(messages, model_type, model_name, temperature, stream=True),
                     timeout=stream_timeout,
                 )
                 async for event in response:
@@ -452,10 +834,10 @@ async def stream_chat(text: str, use_rag: bool = True, model: str = None):
                             yield f"data: {event.delta.text}\n\n"
                             await asyncio.sleep(0.01)
             
-            elif model_type == "gemini":
+            elif model_type in ("gemini", "mock"):
                 # 由于call_llm中已包装为MockStreamChunk，与OpenAI分支一致处理
                 response = await asyncio.wait_for(
-                    call_llm(messages, model_type, model_name, stream=True),
+                    call_llm(messages, model_type, model_name, temperature, stream=True),
                     timeout=stream_timeout,
                 )
                 async for chunk in response:
@@ -468,76 +850,416 @@ async def stream_chat(text: str, use_rag: bool = True, model: str = None):
             yield "event: end\ndata: [DONE]\n\n"
         except asyncio.TimeoutError:
             # 超时兜底
+            LLM_FALLBACKS.labels(provider=model_type, reason="timeout").inc()
             yield f"data: {'抱歉，当前AI服务连接较慢，已返回离线兜底简要答复。'}\n\n"
             yield "event: end\ndata: [DONE]\n\n"
         except Exception as e:
             # 一般异常兜底
+            LLM_FALLBACKS.labels(provider=model_type, reason="error").inc()
             yield f"data: {'抱歉，当前AI服务异常，已返回离线兜底简要答复。'}\n\n"
             yield "event: end\ndata: [DONE]\n\n"
+        finally:
+            limiter.release(time.perf_counter() - slot_started)
+    
+    if SINGLEFLIGHT_ENABLED:
+        # 相同提示词的并发流式请求共享一次上游生成，事件扇出给每个订阅者
+        events = stream_flights.subscribe(request_key("stream_echo", messages, model_type, model_name, temperature), event_generator)
+    else:
+        events = event_generator()
     
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    return StreamingResponse(
+        instrument_stream(events, model_type, "stream_echo"),
+        media_type="text/event-stream",
+    )
+
+@app.post("/v1/summarize")
+async def summarize_conversation(request: SummarizeRequest, http_request: Request):
+    """滚动摘要：将新消息并入已有摘要。失败时返回503而非兜底文本，避免污染摘要"""
+    model_type, model_name = resolve_model(request.model)
+    if not model_type:
+        raise HTTPException(status_code=503, detail="没有可用的LLM服务")
+    
+    # 摘要属于后台批量任务，排在交互式请求之后
+    priority = request_priority(http_request, PRIORITY_BATCH)
+    admit(http_request, model_type, priority)
+    
+    transcript = "\n".join(
+        f"{'用户' if msg.role == 'user' else 'AI助手'}：{msg.content}" for msg in request.messages
+    )
+    messages = [
+        {
+            "role": "system",
+            "content": f"你负责维护一段对话的滚动摘要。请将新对话内容并入已有摘要，保留关键事实、结论、待办事项与用户偏好，"
+                       f"删除寒暄与重复信息，不超过{request.max_chars}字，只输出摘要正文。",
+        },
+        {"role": "user", "content": f"已有摘要：\n{request.summary or '（无）'}\n\n新对话内容：\n{transcript}"},
+    ]
+    
+    summary_timeout = float(os.getenv("LLM_SUMMARY_TIMEOUT_SECONDS", "30"))
+    
+    async def _call_with_slot():
+        async with admission.limiter(model_type).slot(priority):
+            return await call_llm(messages, model_type, model_name, temperature=0.2)
+    
+    try:
+        with observe_stage("llm"):
+            summary = await asyncio.wait_for(_call_with_slot(), timeout=summary_timeout)
+    except AdmissionRejected:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="摘要生成超时")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Summarize failed: {e}")
+        raise HTTPException(status_code=503, detail=f"摘要生成失败: {str(e)}")
+    
+    summary = (summary or "").strip()
+    if not summary:
+        raise HTTPException(status_code=503, detail="摘要生成失败: 模型未返回内容")
+    return {"summary": summary[: request.max_chars], "model": f"{model_type}:{model_name}"}
+
+def prepare_batch(request: BatchRequest, http_request: Request):
+    """校验批量请求并返回结果生成器工厂；条目失败只记入该条结果，不中断整个批次"""
+    if not request.items:
+        raise HTTPException(status_code=400, detail="items 不能为空")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单次最多 {BATCH_MAX_ITEMS} 个条目")
+    request.collection = authorize_collection(http_request, request.collection)
+    default_type, _ = resolve_model(request.model)
+    if not default_type:
+        raise HTTPException(status_code=503, detail="没有可用的LLM服务")
+    
+    # 批量任务排在交互式请求之后；整个批次只消耗一次限流令牌
+    priority = request_priority(http_request, PRIORITY_BATCH)
+    check_rate_limits(http_request)
+    
+    concurrency = min(request.concurrency or BATCH_DEFAULT_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    item_timeout = request.item_timeout_seconds or float(os.getenv("BATCH_ITEM_TIMEOUT_SECONDS", "60"))
+    instruction = request.instruction or "你是一个智能企业协作平台的AI助手，请完成用户给出的文档处理任务。"
+    
+    async def results():
+        contexts: List[List[str]] = [[] for _ in request.items]
+        if request.use_rag:
+            with observe_stage("retrieve"):
+                contexts = await asyncio.to_thread(
+                    retrieve_contexts_batch, [item.text for item in request.items], 3, request.collection
+                )
+        
+        async def complete_item(index: int) -> Dict[str, Any]:
+            item = request.items[index]
+            model_type, model_name = resolve_model(item.model or request.model)
+            if model_type not in llm_clients:
+                raise ValueError(f"模型不可用: {item.model or request.model}")
+            system_prompt = instruction
+            if contexts[index]:
+                system_prompt += f"\n\n参考信息：\n" + "\n".join([f"- {ctx}" for ctx in contexts[index]])
+            messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": item.text}]
+            limiter = admission.limiter(model_type)
+            
+            async def _call_with_slot():
+                while True:
+                    try:
+                        await limiter.acquire(priority)
+                        break
+                    except AdmissionRejected as e:
+                        # 批量条目遇到过载时等待后重试（计入条目超时），而不是直接失败
+                        await asyncio.sleep(min(e.retry_after, 5))
+                started = time.perf_counter()
+                try:
+                    return await call_llm(messages, model_type, model_name, request.temperature)
+                finally:
+                    limiter.release(time.perf_counter() - started)
+            
+            try:
+                response_text = await asyncio.wait_for(_call_with_slot(), timeout=item_timeout)
+            except HTTPException as e:
+                raise RuntimeError(e.detail)
+            return {
+                "id": item.id,
+                "response": response_text,
+                "model": f"{model_type}:{model_name}",
+                "contexts_used": len(contexts[index]),
+            }
+        
+        async for result in run_bounded(len(request.items), complete_item, concurrency):
+            result["id"] = request.items[result["index"]].id
+            yield result
+    
+    return results
+
+@app.post("/v1/batch")
+async def batch_completion(request: BatchRequest, http_request: Request):
+    """批量补全：有界并发执行，按完成顺序以 NDJSON 流式返回每个条目的结果与耗时，最后一行为汇总"""
+    results = prepare_batch(request, http_request)
+    
+    async def ndjson():
+        collected = []
+        started = time.perf_counter()
+        async for result in results():
+            collected.append(result)
+            yield ndjson_line(result)
+        yield ndjson_line(summarize(collected, time.perf_counter() - started))
+    
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@app.post("/v1/batch/jobs", status_code=202)
+async def submit_batch_job(request: BatchRequest, http_request: Request):
+    """异步批量任务：立即返回 job_id，后台执行，通过 GET /v1/batch/jobs/{job_id} 查询进度与结果"""
+    results = prepare_batch(request, http_request)
+    try:
+        job = batch_jobs.submit(len(request.items), results)
+    except RuntimeError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return job.info()
+
+@app.get("/v1/batch/jobs/{job_id}")
+async def get_batch_job(job_id: str, include_results: bool = True, offset: int = 0):
+    """查询批量任务进度；offset 用于增量拉取已完成的结果"""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return job.info(include_results=include_results, offset=offset)
+
+@app.delete("/v1/batch/jobs/{job_id}")
+async def cancel_batch_job(job_id: str):
+    """取消批量任务，已完成的结果保留"""
+    job = batch_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return job.info()
 
 @app.post("/v1/documents")
-async def add_document(request: DocumentRequest):
+async def add_document(request: DocumentRequest, http_request: Request):
     """添加文档到知识库"""
-    if embedding_model is None or vector_index is None:
+    if embedding_model is None or kb_collections is None:
         raise HTTPException(status_code=503, detail="向量化服务未就绪")
+    collection = authorize_collection(http_request, request.collection)
     
     try:
         # 生成文档嵌入向量
         embedding = embedding_model.encode([request.content])
         
-        # 添加到向量索引
-        vector_index.add(embedding)
-        
-        # 保存文档信息
-        doc_info = {
+        # 添加到向量索引并保存文档信息（启用复制时经写入日志同步到其他副本）
+        doc_info = await asyncio.to_thread(apply_write, {
+            "op": "add",
+            "collection": collection,
             "title": request.title,
             "content": request.content,
-            "metadata": request.metadata,
+            "metadata": request.metadata or {},
+            "embedding": embedding[0],
             "timestamp": datetime.now().isoformat(),
-            "id": len(document_store)
-        }
-        document_store.append(doc_info)
+        })
         
-        logger.info(f"Document added: {request.title}")
-        return {"message": "文档添加成功", "document_id": doc_info["id"]}
+        logger.info(f"Document added: {request.title} -> {collection}")
+        return {"message": "文档添加成功", "document_id": doc_info["id"], "collection": collection}
     
     except Exception as e:
         logger.error(f"Failed to add document: {e}")
         raise HTTPException(status_code=500, detail=f"文档添加失败: {str(e)}")
 
+@app.get("/v1/documents/{document_id}")
+async def get_document(document_id: int, http_request: Request, collection: str = DEFAULT_COLLECTION):
+    """获取知识库文档"""
+    knowledge_base = get_collection(authorize_collection(http_request, collection))
+    doc = knowledge_base.get(document_id) if knowledge_base is not None else None
+    if doc is None:
+        raise HTTPException(status_code=404, detail="文档不存在")
+    return doc
+
+@app.put("/v1/documents/{document_id}")
+async def update_document(document_id: int, request: DocumentRequest, http_request: Request):
+    """替换知识库文档（旧向量立即失效），仅限内部调用方"""
+    require_internal(http_request)
+    if embedding_model is None or kb_collections is None:
+        raise HTTPException(status_code=503, detail="向量化服务未就绪")
+    collection = validate_collection(request.collection)
+    await sync_replica()
+    knowledge_base = get_collection(collection)
+    if knowledge_base is None or knowledge_base.get(document_id) is None:
+        raise HTTPException(status_code=404, detail="文档不存在")
+    
+    try:
+        embedding = embedding_model.encode([request.content])
+        doc_info = await asyncio.to_thread(apply_write, {
+            "op": "update",
+            "collection": collection,
+            "doc_id": document_id,
+            "title": request.title,
+            "content": request.content,
+            "metadata": request.metadata or {},
+            "embedding": embedding[0],
+            "timestamp": datetime.now().isoformat(),
+        })
+    except Exception as e:
+        logger.error(f"Failed to update document: {e}")
+        raise HTTPException(status_code=500, detail=f"文档更新失败: {str(e)}")
+    
+    if doc_info is None:
+        raise HTTPException(status_code=404, detail="文档不存在")
+    logger.info(f"Document updated: {document_id} in {collection}")
+    return {"message": "文档更新成功", "document_id": document_id, "collection": collection}
+
+@app.delete("/v1/documents/{document_id}")
+async def delete_document(document_id: int, http_request: Request, collection: str = DEFAULT_COLLECTION):
+    """删除知识库文档（打墓碑，后台压缩时物理清理），仅限内部调用方"""
+    require_internal(http_request)
+    if kb_collections is None:
+        raise HTTPException(status_code=503, detail="向量化服务未就绪")
+    collection = validate_collection(collection)
+    if not await asyncio.to_thread(apply_write, {"op": "delete", "collection": collection, "doc_id": document_id}):
+        raise HTTPException(status_code=404, detail="文档不存在")
+    logger.info(f"Document deleted: {document_id} in {collection}")
+    return {"message": "文档删除成功", "document_id": document_id, "collection": collection}
+
+@app.get("/v1/collections")
+async def list_collections(http_request: Request):
+    """列出知识库集合及内存预算使用情况（仅限内部调用方）"""
+    require_internal(http_request)
+    if kb_collections is None:
+        raise HTTPException(status_code=503, detail="向量化服务未就绪")
+    return kb_collections.stats()
+
+@app.get("/v1/collections/{collection}/stats")
+async def collection_stats(collection: str, http_request: Request):
+    """单个集合统计（文档数、墓碑比例、内存占用、检索次数），仅限内部调用方"""
+    require_internal(http_request)
+    if kb_collections is None:
+        raise HTTPException(status_code=503, detail="向量化服务未就绪")
+    try:
+        stats = kb_collections.collection_stats(collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if stats is None:
+        raise HTTPException(status_code=404, detail="集合不存在")
+    return stats
+
+@app.delete("/v1/collections/{collection}")
+async def drop_collection(collection: str, http_request: Request):
+    """删除整个集合（仅限内部调用方）"""
+    require_internal(http_request)
+    if kb_collections is None:
+        raise HTTPException(status_code=503, detail="向量化服务未就绪")
+    collection = validate_collection(collection)
+    dropped = await asyncio.to_thread(apply_write, {"op": "drop", "collection": collection})
+    if not dropped:
+        raise HTTPException(status_code=404, detail="集合不存在")
+    logger.info(f"Collection dropped: {collection}")
+    return {"message": "集合删除成功", "collection": collection}
+
+@app.post("/v1/collections/{collection}/compact")
+async def compact_collection(collection: str, http_request: Request):
+    """手动触发集合索引压缩（在线程中执行，不阻塞检索），仅限内部调用方"""
+    require_internal(http_request)
+    collection = validate_collection(collection)
+
+    def _compact():
+        with kb_collections.use(collection) as knowledge_base:
+            if knowledge_base is None:
+                return None
+            knowledge_base.compact()
+            return knowledge_base.stats()
+
+    if kb_collections is None:
+        raise HTTPException(status_code=503, detail="向量化服务未就绪")
+    stats = await asyncio.to_thread(_compact)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="集合不存在")
+    return stats
+
+@app.get("/v1/replication/status")
+async def replication_status(http_request: Request):
+    """多副本复制状态：已应用/最新日志序号、复制延迟（未应用条数与等待时长）、快照与日志段（仅限内部调用方）"""
+    require_internal(http_request)
+    if replicator is None:
+        return {"enabled": False}
+    return await asyncio.to_thread(replicator.status)
+
+@app.post("/v1/replication/snapshot")
+async def create_replication_snapshot(http_request: Request):
+    """立即生成快照（覆盖到本副本已应用的日志序号），并清理旧快照与日志段（仅限内部调用方）"""
+    require_internal(http_request)
+    if replicator is None:
+        raise HTTPException(status_code=400, detail="未启用知识库复制（KB_REPLICATION_DIR）")
+    manifest = await asyncio.to_thread(replicator.maybe_snapshot, True)
+    return {"created": manifest is not None, "snapshot": manifest, "snapshot_seq": replicator.snapshot_seq}
+
+SEARCH_MAX_QUERIES = int(os.getenv("SEARCH_MAX_QUERIES", "1000"))
+
+def search_many(knowledge_base: KnowledgeBase, queries: List[str], top_k: int, min_score: float = 0.2) -> List[List[Dict[str, Any]]]:
+    """多查询检索：相同查询只编码一次，全部查询一次批量编码 + 一次 N×dim 检索，返回与 queries 对齐的结果"""
+    unique_queries = list(dict.fromkeys(queries))
+    with observe_stage("encode"):
+        query_vectors = embedding_model.encode(unique_queries, batch_size=64)
+    with observe_stage("search"):
+        all_hits = knowledge_base.search(query_vectors, top_k, min_score=min_score)
+    by_query = {
+        query: [
+            {
+                "id": doc["id"],
+                "title": doc["title"],
+                "content": doc["content"][:200] + "..." if len(doc["content"]) > 200 else doc["content"],
+                "score": score,
+                "metadata": doc["metadata"],
+            }
+            for score, doc in hits
+        ]
+        for query, hits in zip(unique_queries, all_hits)
+    }
+    return [by_query[query] for query in queries]
+
 @app.post("/v1/search")
-async def search_documents(request: SearchRequest):
+async def search_documents(request: SearchRequest, http_request: Request):
     """搜索知识库文档"""
-    if embedding_model is None or vector_index is None or len(document_store) == 0:
+    request.collection = authorize_collection(http_request, request.collection)
+    if embedding_model is None or kb_collections is None:
+        return {"results": [], "message": "知识库为空"}
+    knowledge_base = get_collection(request.collection)
+    if knowledge_base is None or len(knowledge_base) == 0:
         return {"results": [], "message": "知识库为空"}
     
     try:
-        # 生成查询向量
-        query_vector = embedding_model.encode([request.query])
-        
-        # 搜索
-        scores, indices = vector_index.search(query_vector, min(request.top_k, len(document_store)))
-        
-        # 构建结果
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx != -1 and score > 0.2:  # 相似度阈值
-                doc = document_store[idx]
-                results.append({
-                    "title": doc["title"],
-                    "content": doc["content"][:200] + "..." if len(doc["content"]) > 200 else doc["content"],
-                    "score": float(score),
-                    "metadata": doc["metadata"]
-                })
-        
-        return {"results": results}
+        # 编码与检索在线程中执行，不阻塞事件循环（已过滤墓碑与低分结果）
+        results = (await asyncio.to_thread(search_many, knowledge_base, [request.query], request.top_k))[0]
+        return {"results": results, "collection": request.collection}
     
     except Exception as e:
         logger.error(f"Search failed: {e}")
         raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
 
+@app.post("/v1/search/batch")
+async def search_documents_batch(request: MultiSearchRequest, http_request: Request):
+    """多查询检索：一次请求完成多个查询，results 与 queries 按下标对齐"""
+    request.collection = authorize_collection(http_request, request.collection)
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="queries 不能为空")
+    if len(request.queries) > SEARCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"单次最多 {SEARCH_MAX_QUERIES} 个查询")
+    if embedding_model is None or kb_collections is None:
+        return {"results": [[] for _ in request.queries], "message": "知识库为空"}
+    knowledge_base = get_collection(request.collection)
+    if knowledge_base is None or len(knowledge_base) == 0:
+        return {"results": [[] for _ in request.queries], "message": "知识库为空"}
+    
+    try:
+        results = await asyncio.to_thread(search_many, knowledge_base, request.queries, request.top_k, request.min_score)
+        return {"results": results, "collection": request.collection}
+    except Exception as e:
+        logger.error(f"Batch search failed: {e}")
+        raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
+
+@app.get("/v1/rerank/stats")
+async def rerank_stats():
+    """重排序统计（候选数输入/输出、耗时、超时回退次数）"""
+    if reranker is None:
+        return {"enabled": False}
+    return {"enabled": True, **reranker.stats()}
+
+@app.get("/v1/admission/stats")
+async def admission_stats():
+    """各提供商并发与排队情况"""
+    return {"providers": admission.stats()}
+
 @app.get("/v1/models")
 async def list_models():
     """列出可用的模型"""
@@ -560,5 +1282,8 @@ async def list_models():
             {"provider": "gemini", "model": "gemini-1.5-flash", "type": "chat"},
             {"provider": "gemini", "model": "gemini-1.5-pro", "type": "chat"},
         ])
+
+    if "mock" in llm_clients:
+        available_models.append({"provider": "mock", "model": "mock-llm", "type": "chat"})
     
     return {"models": available_models}
\ No newline at end of file
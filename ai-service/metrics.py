@@ -0,0 +1,134 @@
+"""Prometheus 指标与按阶段耗时追踪
+
+- 每个请求携带关联ID（X-Request-ID，由 Django 透传或在此生成），写入响应头与日志
+- RAG 检索各阶段（encode/search/rerank）、LLM 首字延迟与总耗时、SSE 流时长均记录为直方图
+- 非流式请求的阶段耗时通过 Server-Timing 响应头返回，便于定位慢请求
+"""
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+stage_timings_var: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_LATENCY = Histogram(
+    "ai_http_request_duration_seconds", "AI服务HTTP请求耗时", ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+RAG_STAGE_LATENCY = Histogram(
+    "ai_rag_stage_duration_seconds", "RAG检索各阶段耗时", ["stage"], buckets=LATENCY_BUCKETS
+)
+LLM_TTFT = Histogram(
+    "ai_llm_time_to_first_token_seconds", "LLM首个token延迟", ["provider"], buckets=LATENCY_BUCKETS
+)
+LLM_LATENCY = Histogram(
+    "ai_llm_duration_seconds", "LLM调用总耗时", ["provider", "stream"], buckets=LATENCY_BUCKETS
+)
+LLM_FALLBACKS = Counter("ai_llm_fallbacks_total", "LLM超时/异常后返回离线兜底的次数", ["provider", "reason"])
+SSE_DURATION = Histogram(
+    "ai_sse_stream_duration_seconds", "SSE流持续时长", ["endpoint"], buckets=LATENCY_BUCKETS
+)
+RERANK_CANDIDATES = Counter("ai_rerank_candidates_total", "重排序候选数", ["direction"])
+ADMISSION_IN_FLIGHT = Gauge("ai_admission_in_flight", "各提供商正在执行的上游调用数", ["provider"])
+ADMISSION_QUEUE_DEPTH = Gauge("ai_admission_queue_depth", "各提供商排队等待的请求数", ["provider"])
+ADMISSION_QUEUE_WAIT = Histogram(
+    "ai_admission_queue_wait_seconds", "排队等待时长", ["provider", "priority"], buckets=LATENCY_BUCKETS
+)
+ADMISSION_SHED = Counter("ai_admission_shed_total", "因队列已满或预计等待超时被拒绝的请求数", ["provider", "reason"])
+RATE_LIMITED = Counter("ai_rate_limited_total", "被令牌桶限流拒绝的请求数", ["scope"])
+BATCH_ITEMS = Counter("ai_batch_items_total", "批量补全条目数", ["outcome"])
+BATCH_ITEM_LATENCY = Histogram("ai_batch_item_duration_seconds", "批量补全单个条目耗时", buckets=LATENCY_BUCKETS)
+REPLICATION_APPLIED = Counter("ai_replication_applied_total", "本副本从写入日志应用的记录数", ["op"])
+REPLICATION_APPLY_DELAY = Histogram(
+    "ai_replication_apply_delay_seconds", "日志记录从写入到在本副本应用的延迟（复制延迟）", buckets=LATENCY_BUCKETS
+)
+REPLICATION_APPLIED_SEQ = Gauge("ai_replication_applied_seq", "本副本已应用的写入日志序号")
+SINGLEFLIGHT_REQUESTS = Counter(
+    "ai_singleflight_requests_total", "相同请求合并：发起上游调用(leader)与共享结果(follower)的请求数", ["kind", "role"]
+)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def record_stage(stage: str, seconds: float):
+    """记录阶段耗时到直方图及当前请求的阶段汇总"""
+    RAG_STAGE_LATENCY.labels(stage=stage).observe(seconds)
+    timings = stage_timings_var.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def observe_stage(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+def install(app):
+    """为 FastAPI 应用注册指标中间件与 /metrics 端点"""
+    from fastapi import Request, Response
+
+    @app.middleware("http")
+    async def metrics_middleware(request: Request, call_next):
+        request_id = request.headers.get(REQUEST_ID_HEADER) or new_request_id()
+        request_id_var.set(request_id)
+        timings: Dict[str, float] = {}
+        stage_timings_var.set(timings)
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            elapsed = time.perf_counter() - started
+            route = request.scope.get("route")
+            REQUEST_LATENCY.labels(
+                method=request.method,
+                route=getattr(route, "path", "unmatched"),
+                status=str(status),
+            ).observe(elapsed)
+        response.headers[REQUEST_ID_HEADER] = request_id
+        if timings:
+            response.headers["Server-Timing"] = server_timing_header(timings)
+            logger.info(f"[{request_id}] {request.method} {request.url.path} {elapsed * 1000:.1f}ms stages={server_timing_header(timings)}")
+        return response
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+async def instrument_stream(events, provider: str, endpoint: str):
+    """包装SSE事件生成器：记录首个数据块延迟、LLM总耗时与流持续时长"""
+    started = time.perf_counter()
+    first_chunk = True
+    try:
+        async for event in events:
+            if first_chunk and event.startswith("data: "):
+                LLM_TTFT.labels(provider=provider).observe(time.perf_counter() - started)
+                first_chunk = False
+            yield event
+    finally:
+        elapsed = time.perf_counter() - started
+        LLM_LATENCY.labels(provider=provider, stream="true").observe(elapsed)
+        SSE_DURATION.labels(endpoint=endpoint).observe(elapsed)
+        logger.info(f"[{request_id_var.get()}] {endpoint} stream finished in {elapsed * 1000:.1f}ms provider={provider}")
@@ -0,0 +1,83 @@
+"""离线模拟LLM提供商
+
+用于本地开发、压测与基准测试：不访问外部网络，可配置首字延迟、生成速率、回复长度与错误注入，
+结果可通过随机种子复现。MOCK_LLM_ENABLED=true 时注册为 "mock" 提供商并优先使用。
+"""
+import asyncio
+import os
+import random
+from typing import AsyncIterator, Dict, List, Optional
+
+_VOCABULARY = (
+    "好的 我们 可以 根据 当前 项目 的 进度 安排 任务 并 同步 给 团队 成员 "
+    "文档 已经 更新 请 查阅 知识库 中 的 相关 说明 如有 问题 随时 反馈"
+).split()
+
+
+class MockProviderError(Exception):
+    """模拟提供商注入的错误"""
+
+
+class MockProvider:
+    """可配置延迟特征的模拟LLM"""
+
+    def __init__(
+        self,
+        ttft_ms: float = 200.0,
+        tokens_per_second: float = 50.0,
+        response_tokens: int = 60,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.ttft_seconds = ttft_ms / 1000.0
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+    @classmethod
+    def from_env(cls) -> "MockProvider":
+        seed = os.getenv("MOCK_LLM_SEED")
+        return cls(
+            ttft_ms=float(os.getenv("MOCK_LLM_TTFT_MS", "200")),
+            tokens_per_second=float(os.getenv("MOCK_LLM_TOKENS_PER_SECOND", "50")),
+            response_tokens=int(os.getenv("MOCK_LLM_RESPONSE_TOKENS", "60")),
+            error_rate=float(os.getenv("MOCK_LLM_ERROR_RATE", "0")),
+            seed=int(seed) if seed else None,
+        )
+
+    def _tokens(self, messages: List[Dict]) -> List[str]:
+        user_msg = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        tokens = [f"【模拟回复】{user_msg[:50]}"]
+        while len(tokens) < self.response_tokens:
+            tokens.append(self._random.choice(_VOCABULARY))
+        return tokens[: max(self.response_tokens, 1)]
+
+    def _maybe_fail(self):
+        if self.error_rate > 0 and self._random.random() < self.error_rate:
+            raise MockProviderError("模拟提供商注入错误")
+
+    async def _inter_token_delay(self):
+        if self.tokens_per_second > 0:
+            await asyncio.sleep(1.0 / self.tokens_per_second)
+
+    async def complete(self, messages: List[Dict]) -> str:
+        """非流式：等待首字延迟 + 全部token生成时间后一次性返回"""
+        self._maybe_fail()
+        tokens = self._tokens(messages)
+        await asyncio.sleep(self.ttft_seconds)
+        if self.tokens_per_second > 0:
+            await asyncio.sleep((len(tokens) - 1) / self.tokens_per_second)
+        return " ".join(tokens)
+
+    async def stream(self, messages: List[Dict]) -> AsyncIterator[str]:
+        """流式：首字延迟后按固定速率逐token产出，中途也可能注入错误"""
+        self._maybe_fail()
+        tokens = self._tokens(messages)
+        await asyncio.sleep(self.ttft_seconds)
+        for i, token in enumerate(tokens):
+            if i > 0:
+                await self._inter_token_delay()
+                if self.error_rate > 0 and self._random.random() < self.error_rate / len(tokens):
+                    raise MockProviderError("模拟提供商流式中断")
+            yield token if i == 0 else " " + token
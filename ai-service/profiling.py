@@ -0,0 +1,386 @@
+"""按需请求剖析（PROFILING_ENABLED=true 时由 install() 注册，关闭时不注册任何中间件）
+
+被选中的请求（X-Profile 请求头携带 PROFILING_TOKEN，或按 PROFILING_SAMPLE_RATE 抽样）记录：
+- 调用树：后台线程按 PROFILING_INTERVAL_MS 采样，只计入属于该请求的栈：事件循环线程正在运行该请求的任务
+  （中间件所在任务及其创建的子任务，由任务工厂登记）时，以及该请求经 asyncio.to_thread / run_in_executor
+  交给默认线程池执行的工作线程；按线程分根节点，ms 为样本数 × 实际采样间隔
+- 外部 HTTP：经 httpx 发出的请求（LLM 提供商、嵌入服务等）
+- 阶段耗时：metrics 中间件写入的 Server-Timing（encode/search/rerank 等）
+事件循环线程上其他并发请求的任务与空闲等待不计入；请求自建线程中的工作不会被采样。
+流式响应在响应体发送完毕后结束剖析。结果以 JSON 写入 PROFILING_DIR，通过 /v1/profiles 查看。
+与 Django 的 config/profiling.py 结构相同但各自独立（两个服务分别构建镜像），这里只保留 AI 服务需要的部分：
+没有 SQL 记录，采样按请求的任务与工作线程归属。
+"""
+import asyncio
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-ID"
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", "200"))
+
+current_profile: ContextVar[Optional["RequestProfile"]] = ContextVar("current_profile", default=None)
+
+
+@lru_cache(maxsize=4096)
+def _short_path(filename: str) -> str:
+    """去掉 sys.path 前缀，调用树中只显示模块相对路径"""
+    for prefix in sorted((p for p in sys.path if p), key=len, reverse=True):
+        if filename.startswith(prefix.rstrip(os.sep) + os.sep):
+            return filename[len(prefix.rstrip(os.sep)) + 1:]
+    return filename
+
+
+class StackSampler:
+    """后台线程按固定间隔抓取属于一个请求的调用栈，按线程名 + 函数汇总为调用树
+
+    - 事件循环线程：仅当循环当前运行的任务在 tasks 中时采样
+    - 工作线程：attach 之后、detach 之前每次都采样
+    """
+
+    def __init__(self, interval: float, loop: asyncio.AbstractEventLoop):
+        self.interval = interval
+        self.samples = 0
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.tasks: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+        self.threads: Dict[int, str] = {}
+        self._root: Dict[str, list] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def attach(self, thread_id: int, label: str):
+        self.threads[thread_id] = label
+
+    def detach(self, thread_id: int):
+        self.threads.pop(thread_id, None)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            frames = sys._current_frames()
+            targets = list(self.threads.items())
+            # 从采样线程读取循环当前任务：只读一次字典查找，循环线程上其他请求的任务不计入
+            if asyncio.current_task(self.loop) in self.tasks:
+                targets.append((self.loop_thread, "event-loop"))
+            for thread_id, label in targets:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{getattr(code, 'co_qualname', code.co_name)} ({_short_path(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if not stack:
+                    continue
+                stack.append(f"[{label}]")
+                node = self._root
+                for name in reversed(stack):
+                    entry = node.setdefault(name, [0, {}])
+                    entry[0] += 1
+                    node = entry[1]
+
+    def call_tree(self, wall_ms: float) -> List[Dict[str, Any]]:
+        """调用树：[{name, samples, ms, children}]，ms 为样本数 × 实际采样间隔（墙钟耗时 / 采样次数）"""
+        ms_per_sample = wall_ms / self.samples if self.samples else 0.0
+
+        def build(nodes):
+            return [
+                {"name": name, "samples": count, "ms": round(count * ms_per_sample, 2), "children": build(children)}
+                for name, (count, children) in sorted(nodes.items(), key=lambda item: -item[1][0])
+            ]
+
+        return build(self._root)
+
+
+class RequestProfile:
+    def __init__(self, trigger: str):
+        self.id = uuid.uuid4().hex
+        self.trigger = trigger
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self._ended: Optional[float] = None
+        self.http: List[Dict[str, Any]] = []
+        self.sampler = StackSampler(PROFILING_INTERVAL_MS / 1000.0, asyncio.get_running_loop())
+        self.sampler.tasks.add(asyncio.current_task())
+        self.sampler.start()
+
+    def record_http(self, method: str, url: str, status: Optional[int], seconds: float, error: Optional[str] = None):
+        self.http.append({"method": method, "url": url, "status": status, "ms": round(seconds * 1000, 3), "error": error})
+
+    def end(self):
+        """请求结束：记录结束时间并通知采样线程停止（不等待），可在事件循环中调用"""
+        self._ended = time.perf_counter()
+        self.sampler._stop.set()
+
+    def finish(self, request, status: int, request_id: Optional[str], stages: Optional[str]) -> Dict[str, Any]:
+        """等待采样线程退出并生成结果（会阻塞，须在线程中调用）"""
+        self.sampler.stop()
+        wall_ms = ((self._ended or time.perf_counter()) - self._started) * 1000
+        # 不保存查询字符串：GET /v1/stream_echo 等接口的参数包含用户消息原文
+        path = request.url.path
+        return {
+            "id": self.id,
+            "service": "ai-service",
+            "trigger": self.trigger,
+            "request_id": request_id,
+            "method": request.method,
+            "path": path,
+            "status": status,
+            "started_at": self.started_at,
+            "wall_ms": round(wall_ms, 3),
+            "sample_interval_ms": PROFILING_INTERVAL_MS,
+            "samples": self.sampler.samples,
+            "http_count": len(self.http),
+            "http_ms": round(sum(call["ms"] for call in self.http), 3),
+            "stages": stages,
+            "http": self.http,
+            "call_tree": self.sampler.call_tree(wall_ms),
+        }
+
+
+SUMMARY_FIELDS = (
+    "id", "service", "trigger", "request_id", "method", "path", "status", "started_at", "wall_ms",
+    "samples", "http_count", "http_ms",
+)
+
+
+class ProfileStore:
+    """剖析结果目录：每个请求一个 JSON 文件（文件名以毫秒时间戳开头），超出上限时删除最旧的"""
+
+    def __init__(self, directory: Path, max_files: int):
+        self.directory = Path(directory)
+        self.max_files = max_files
+
+    def _files(self) -> List[Path]:
+        return sorted(self.directory.glob("*.json"), reverse=True) if self.directory.exists() else []
+
+    def save(self, profile: Dict[str, Any]) -> Path:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{int(profile['started_at'] * 1000)}-{profile['id']}.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(profile, ensure_ascii=False, default=str), encoding="utf-8")
+        os.replace(tmp, path)
+        for old in self._files()[self.max_files:]:
+            old.unlink(missing_ok=True)
+        return path
+
+    def list(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """最近的剖析摘要（新的在前）"""
+        summaries = []
+        for path in self._files()[:limit]:
+            try:
+                profile = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            summaries.append({field: profile.get(field) for field in SUMMARY_FIELDS})
+        return summaries
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        if not PROFILE_ID_PATTERN.match(profile_id or ""):
+            return None
+        for path in self.directory.glob(f"*-{profile_id}.json"):
+            return json.loads(path.read_text(encoding="utf-8"))
+        return None
+
+
+class ProfilingExecutor(ThreadPoolExecutor):
+    """事件循环的默认线程池：提交任务时若当前请求正在剖析，执行期间把工作线程加入采样"""
+
+    def submit(self, fn, /, *args, **kwargs):
+        profile = current_profile.get()
+        if profile is None:
+            return super().submit(fn, *args, **kwargs)
+
+        def run():
+            thread_id = threading.get_ident()
+            profile.sampler.attach(thread_id, f"worker:{threading.current_thread().name}")
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.sampler.detach(thread_id)
+
+        return super().submit(run)
+
+
+def profiling_task_factory(loop, coro, context=None):
+    """事件循环的任务工厂：在剖析中的请求上下文里创建的任务登记到该请求的采样器"""
+    task = asyncio.Task(coro, loop=loop, context=context)
+    profile = context.get(current_profile) if context is not None else current_profile.get()
+    if profile is not None:
+        profile.sampler.tasks.add(task)
+    return task
+
+
+def install_httpx_hook():
+    """包装 httpx.Client/AsyncClient.send：当前上下文有进行中的剖析时记录外部 HTTP 调用，否则直接透传"""
+    try:
+        import httpx
+    except ImportError:
+        return
+    if getattr(httpx.Client.send, "_profiled", False):
+        return
+    sync_send = httpx.Client.send
+    async_send = httpx.AsyncClient.send
+
+    def send(self, request, *args, **kwargs):
+        profile = current_profile.get()
+        if profile is None:
+            return sync_send(self, request, *args, **kwargs)
+        started = time.perf_counter()
+        status, error = None, None
+        try:
+            response = sync_send(self, request, *args, **kwargs)
+            status = response.status_code
+            return response
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            profile.record_http(request.method, str(request.url), status, time.perf_counter() - started, error)
+
+    async def send_async(self, request, *args, **kwargs):
+        profile = current_profile.get()
+        if profile is None:
+            return await async_send(self, request, *args, **kwargs)
+        started = time.perf_counter()
+        status, error = None, None
+        try:
+            response = await async_send(self, request, *args, **kwargs)
+            status = response.status_code
+            return response
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            profile.record_http(request.method, str(request.url), status, time.perf_counter() - started, error)
+
+    send._profiled = True
+    httpx.Client.send = send
+    httpx.AsyncClient.send = send_async
+
+
+def token_valid(value: Optional[str]) -> bool:
+    return bool(value and PROFILING_TOKEN and hmac.compare_digest(value, PROFILING_TOKEN))
+
+
+def select_trigger(header_value: Optional[str]) -> Optional[str]:
+    """请求是否需要剖析：携带正确令牌的 X-Profile 头（header）或命中抽样（sample），否则返回 None"""
+    if token_valid(header_value):
+        return "header"
+    if PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE:
+        return "sample"
+    return None
+
+
+def install(app, directory: Path):
+    """PROFILING_ENABLED=true 时注册剖析中间件、默认线程池、任务工厂与 /v1/profiles 端点（须在 metrics.install 之后调用，
+    使剖析中间件位于外层，能读到 Server-Timing 与 X-Request-ID）"""
+    if not PROFILING_ENABLED:
+        return
+    from fastapi import HTTPException, Request
+
+    store = ProfileStore(Path(os.getenv("PROFILING_DIR", str(directory))), PROFILING_MAX_FILES)
+    install_httpx_hook()
+
+    def write(profile: RequestProfile, request: Request, status: int, headers=None):
+        try:
+            result = profile.finish(
+                request, status,
+                headers.get("X-Request-ID") if headers is not None else None,
+                headers.get("Server-Timing") if headers is not None else None,
+            )
+            store.save(result)
+            logger.info(f"Request profiled: {result['method']} {result['path']} {result['wall_ms']:.1f}ms "
+                        f"http={result['http_count']} id={result['id']}")
+        except Exception as e:
+            logger.error(f"Failed to save request profile {profile.id}: {e}")
+
+    async def save(profile: RequestProfile, request: Request, status: int, headers=None):
+        """停止采样后，等待采样线程与写文件、清理旧文件都在线程中进行，不阻塞事件循环"""
+        profile.end()
+        await asyncio.to_thread(write, profile, request, status, headers)
+
+    async def profiled_body(profile: RequestProfile, request: Request, response, body):
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            await save(profile, request, response.status_code, response.headers)
+
+    @app.on_event("startup")
+    async def install_profiling_executor():
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ProfilingExecutor(thread_name_prefix="asyncio"))
+        loop.set_task_factory(profiling_task_factory)
+
+    @app.middleware("http")
+    async def profiling_middleware(request: Request, call_next):
+        trigger = None if request.url.path.startswith("/v1/profiles") else select_trigger(request.headers.get(PROFILE_HEADER))
+        if trigger is None:
+            return await call_next(request)
+
+        profile = RequestProfile(trigger)
+        token = current_profile.set(profile)
+        try:
+            response = await call_next(request)
+        except Exception:
+            await save(profile, request, 500)
+            raise
+        finally:
+            current_profile.reset(token)
+        response.headers[PROFILE_ID_HEADER] = profile.id
+        response.body_iterator = profiled_body(profile, request, response, response.body_iterator)
+        return response
+
+    def check_token(request: Request):
+        """查看剖析须携带有效的 X-Profile 令牌；未配置 PROFILING_TOKEN 时不对外提供（剖析内容只在 PROFILING_DIR 中）"""
+        if not PROFILING_TOKEN:
+            raise HTTPException(status_code=403, detail="未配置 PROFILING_TOKEN，剖析结果不通过接口提供")
+        if not token_valid(request.headers.get(PROFILE_HEADER)):
+            raise HTTPException(status_code=403, detail="需要有效的 X-Profile 令牌")
+
+    @app.get("/v1/profiles")
+    async def list_profiles(request: Request, limit: int = 50):
+        """最近的请求剖析摘要（须携带 X-Profile 令牌）"""
+        check_token(request)
+        limit = max(1, min(limit, PROFILING_MAX_FILES))
+        return {"profiles": await asyncio.to_thread(store.list, limit)}
+
+    @app.get("/v1/profiles/{profile_id}")
+    async def get_profile(profile_id: str, request: Request):
+        """单个请求剖析的完整内容（调用树、外部 HTTP 调用、阶段耗时）"""
+        check_token(request)
+        profile = await asyncio.to_thread(store.get, profile_id)
+        if profile is None:
+            raise HTTPException(status_code=404, detail="剖析不存在")
+        return profile
@@ -0,0 +1,439 @@
+"""知识库多副本复制：共享存储上的追加写入日志（WAL）+ 定期索引快照
+
+多个 ai-service 副本挂载同一共享目录（KB_REPLICATION_DIR，本地目录即可用于测试）：
+- 写入（添加/更新/删除文档、删除集合）先追加到日志取得全局递增序号，再由各副本按序号顺序应用；
+  向量随记录写入日志，回放时无需重新编码，各副本上的文档ID与内容一致
+- 后台线程持续跟读日志，增量应用其他副本的写入，并统计复制延迟
+- 定期把全部集合保存为快照（记录覆盖到的日志序号）；副本启动时从最新快照引导，再跟读之后的日志，
+  早于最旧保留快照的日志段会被清理
+
+目录结构：
+    wal/{首条序号}.log                 每行一条 JSON 记录，写入方持 wal/LOCK 文件锁分配序号
+    snapshots/{序号}/manifest.json     快照元信息
+    snapshots/{序号}/collections/      CollectionManager.export_to 的输出
+跨进程互斥依赖 fcntl.flock（网络文件系统需支持 flock，如 NFSv4）。
+"""
+import base64
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from knowledge_base import CollectionManager
+from metrics import REPLICATION_APPLIED, REPLICATION_APPLIED_SEQ, REPLICATION_APPLY_DELAY
+
+try:
+    import fcntl
+except ImportError:  # Windows：只有进程内互斥，共享目录只能由单个进程写入
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SEQ_WIDTH = 20
+
+
+def encode_vector(vector) -> str:
+    return base64.b64encode(np.ascontiguousarray(vector, dtype="<f4").tobytes()).decode("ascii")
+
+
+def decode_vector(data: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype="<f4").astype(np.float32)
+
+
+@contextmanager
+def file_lock(path: Path, blocking: bool = True):
+    """跨进程文件锁；blocking=False 且锁已被占用时产出 False"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+") as f:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def apply_operation(collections: CollectionManager, record: Dict[str, Any]) -> Any:
+    """把一条写入应用到本地集合（复制回放与单机模式共用），返回值与对应的 KnowledgeBase 方法一致"""
+    op = record["op"]
+    name = record["collection"]
+    if op == "drop":
+        return collections.drop(name)
+    if op not in ("add", "update", "delete"):
+        raise ValueError(f"unknown knowledge base operation: {op}")
+    # 写入期间钉住集合，LRU 卸载不会在取得集合与写入之间把它落盘移出；结束后按预算卸载
+    with collections.use(name, create=op == "add") as knowledge_base:
+        if op == "add":
+            return knowledge_base.add(
+                record["title"], record["content"], record["metadata"], record["embedding"], timestamp=record.get("timestamp")
+            )
+        if knowledge_base is None:
+            return None if op == "update" else False
+        if op == "update":
+            return knowledge_base.update(
+                record["doc_id"], record["title"], record["content"], record["metadata"], record["embedding"],
+                timestamp=record.get("timestamp"),
+            )
+        return knowledge_base.delete(record["doc_id"])
+
+
+class IngestLog:
+    """分段的追加写入日志：段文件以首条记录序号命名，超过 segment_bytes 后新开一段"""
+
+    def __init__(self, directory: Path, segment_bytes: int = 64 * 1024 * 1024, fsync: bool = True):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._lock_path = self.directory / "LOCK"
+        # 写入方扫描到的位置：(段, 偏移, 最后序号)，其他进程追加的记录在下次写入时补扫
+        self._tail: Tuple[Optional[int], int, int] = (None, 0, 0)
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.directory / f"{segment:0{SEQ_WIDTH}d}.log"
+
+    def segments(self) -> List[int]:
+        return sorted(int(p.stem) for p in self.directory.glob("*.log") if p.stem.isdigit())
+
+    def locate(self, seq: int) -> Optional[int]:
+        """包含序号 seq 的段（首条序号不大于 seq 的最后一段）；seq 所在段已被清理时返回最早的段"""
+        segments = self.segments()
+        if not segments:
+            return None
+        candidates = [segment for segment in segments if segment <= seq]
+        return candidates[-1] if candidates else segments[0]
+
+    def next_segment(self, segment: int) -> Optional[int]:
+        return next((s for s in self.segments() if s > segment), None)
+
+    def read(self, segment: int, offset: int) -> Tuple[List[Dict[str, Any]], int]:
+        """读取段内 offset 之后的完整记录，返回 (记录, 新偏移)；末尾尚未写完的行留待下次读取"""
+        try:
+            with open(self._segment_path(segment), "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+        end = data.rfind(b"\n") + 1
+        records = []
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                logger.warning(f"Skipping corrupt WAL line in segment {segment}")
+        return records, offset + end
+
+    def append(self, record: Dict[str, Any]) -> int:
+        """追加一条记录并返回其序号；持文件锁补扫其他写入方追加的记录后分配序号"""
+        with self._lock, file_lock(self._lock_path):
+            segments = self.segments()
+            segment, offset, last_seq = self._tail
+            if segments and segment != segments[-1]:
+                segment, offset, last_seq = segments[-1], 0, max(last_seq, segments[-1] - 1)
+            if segment is not None:
+                records, offset = self.read(segment, offset)
+                if records:
+                    last_seq = records[-1]["seq"]
+            seq = last_seq + 1
+            if segment is None or offset >= self.segment_bytes:
+                segment, offset = seq, 0
+            data = (json.dumps({**record, "seq": seq}, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+            with open(self._segment_path(segment), "ab") as f:
+                if f.tell() > offset:
+                    # 之前的写入中断留下了残缺行：另起一行，读取方会跳过残缺行
+                    data = b"\n" + data
+                f.write(data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+                offset = f.tell()
+            self._tail = (segment, offset, seq)
+            return seq
+
+    def prune(self, upto_seq: int) -> int:
+        """删除记录全部不晚于 upto_seq 的段（始终保留最后一段），返回删除的段数"""
+        removed = 0
+        with self._lock, file_lock(self._lock_path):
+            segments = self.segments()
+            for segment, next_start in zip(segments, segments[1:]):
+                if next_start - 1 > upto_seq:
+                    break
+                self._segment_path(segment).unlink(missing_ok=True)
+                removed += 1
+        if removed:
+            logger.info(f"WAL pruned {removed} segments up to seq {upto_seq}")
+        return removed
+
+
+class SnapshotStore:
+    """共享目录中的快照：先写临时目录再重命名，副本只会看到完整的快照"""
+
+    def __init__(self, directory: Path, retain: int = 2):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.retain = max(1, retain)
+        self.lock_path = self.directory / "LOCK"
+
+    def path(self, seq: int) -> Path:
+        return self.directory / f"{seq:0{SEQ_WIDTH}d}"
+
+    def collections_path(self, seq: int) -> Path:
+        return self.path(seq) / "collections"
+
+    def list(self) -> List[int]:
+        return sorted(int(p.name) for p in self.directory.iterdir() if p.name.isdigit() and (p / "manifest.json").exists())
+
+    def manifest(self, seq: int) -> Dict[str, Any]:
+        return json.loads((self.path(seq) / "manifest.json").read_text(encoding="utf-8"))
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        seqs = self.list()
+        return self.manifest(seqs[-1]) if seqs else None
+
+    def create(self, seq: int, collections: CollectionManager) -> Dict[str, Any]:
+        """保存覆盖到日志序号 seq 的快照，调用方需保证期间不再应用新的日志记录"""
+        started = time.perf_counter()
+        tmp = self.directory / f".tmp-{uuid.uuid4().hex}"
+        try:
+            collections.export_to(tmp / "collections")
+            manifest = {
+                "seq": seq,
+                "created_at": time.time(),
+                "collections": sorted(p.name for p in (tmp / "collections").iterdir()),
+                "bytes": sum(p.stat().st_size for p in tmp.rglob("*") if p.is_file()),
+            }
+            (tmp / "manifest.json").write_text(json.dumps(manifest), encoding="utf-8")
+            if self.path(seq).exists():
+                return self.manifest(seq)
+            os.rename(tmp, self.path(seq))
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        logger.info(f"Knowledge base snapshot {seq} created: {manifest['bytes']} bytes in {time.perf_counter() - started:.3f}s")
+        return manifest
+
+    def prune(self) -> Optional[int]:
+        """只保留最新 retain 个快照并清理中断遗留的临时目录，返回最旧保留快照的序号"""
+        seqs = self.list()
+        for seq in seqs[:-self.retain]:
+            shutil.rmtree(self.path(seq), ignore_errors=True)
+        for tmp in self.directory.glob(".tmp-*"):
+            if time.time() - tmp.stat().st_mtime > 3600:
+                shutil.rmtree(tmp, ignore_errors=True)
+        kept = seqs[-self.retain:]
+        return kept[0] if kept else None
+
+
+class Replicator:
+    """副本复制：写入经日志排序后应用，后台跟读其他副本的写入并定期生成快照"""
+
+    def __init__(
+        self,
+        collections: CollectionManager,
+        directory: Path,
+        poll_seconds: float = 0.5,
+        snapshot_every_entries: int = 1000,
+        snapshot_interval_seconds: float = 300.0,
+        snapshot_retain: int = 2,
+        segment_bytes: int = 64 * 1024 * 1024,
+        fsync: bool = True,
+    ):
+        self.collections = collections
+        self.directory = Path(directory)
+        self.log = IngestLog(self.directory / "wal", segment_bytes=segment_bytes, fsync=fsync)
+        self.snapshots = SnapshotStore(self.directory / "snapshots", retain=snapshot_retain)
+        self.poll_seconds = poll_seconds
+        self.snapshot_every_entries = snapshot_every_entries
+        self.snapshot_interval_seconds = snapshot_interval_seconds
+
+        self._apply_lock = threading.RLock()
+        # 跟读位置：(段, 偏移)，段为 None 时按 applied_seq 重新定位
+        self._position: Tuple[Optional[int], int] = (None, 0)
+        self.applied_seq = 0
+        self.applied_total = 0
+        self.last_applied_at: Optional[float] = None
+        self.snapshot_seq: Optional[int] = None
+        self.snapshot_created_at = 0.0
+        self.snapshots_taken = 0
+        self.bootstraps = 0
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # === 生命周期 ===
+    def start(self):
+        self.bootstrap()
+        self.catch_up()
+        self._thread = threading.Thread(target=self._run, name="kb-replication", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.catch_up()
+                self.maybe_snapshot()
+            except Exception as e:
+                logger.error(f"Knowledge base replication poll failed: {e}")
+
+    def bootstrap(self):
+        """从最新快照恢复本地集合，之后从快照覆盖的序号继续跟读日志
+
+        共享目录中既没有快照也没有日志时，若本副本已有本地集合（首次启用复制），
+        以本地集合作为序号 0 的初始快照，其他副本从它引导。
+        """
+        with self._apply_lock, file_lock(self.snapshots.lock_path):
+            latest = self.snapshots.latest()
+            if latest is None and not self.log.segments() and self.collections.names():
+                latest = self.snapshots.create(0, self.collections)
+                logger.info(f"Seeded replication snapshot from local collections: {latest['collections']}")
+            else:
+                # 持快照锁复制，避免其他副本同时清理该快照
+                self.collections.restore_from(self.snapshots.collections_path(latest["seq"]) if latest else None)
+            self.applied_seq = latest["seq"] if latest else 0
+            self.snapshot_seq = latest["seq"] if latest else None
+            self.snapshot_created_at = latest["created_at"] if latest else time.time()
+            self._position = (None, 0)
+            self.bootstraps += 1
+        REPLICATION_APPLIED_SEQ.set(self.applied_seq)
+        logger.info(f"Knowledge base replica bootstrapped at seq {self.applied_seq}")
+
+    # === 写入与跟读 ===
+    def submit(self, record: Dict[str, Any]) -> Any:
+        """追加一条写入并在本副本应用到该条为止，返回该写入的结果（写入后本副本立即可读）"""
+        record = dict(record, ts=time.time())
+        if "embedding" in record:
+            record["embedding"] = encode_vector(record["embedding"])
+        with self._apply_lock:
+            seq = self.log.append(record)
+            return self.catch_up(capture_seq=seq)
+
+    def _read_pending(self, advance: bool = True) -> List[Dict[str, Any]]:
+        """从跟读位置读取全部新记录（跨段），只返回序号大于 applied_seq 的记录"""
+        segment, offset = self._position
+        applied_seq = self.applied_seq
+        records: List[Dict[str, Any]] = []
+        while True:
+            if segment is None:
+                segment, offset = self.log.locate(applied_seq + 1), 0
+                if segment is None:
+                    break
+            batch, offset = self.log.read(segment, offset)
+            records.extend(batch)
+            next_segment = self.log.next_segment(segment)
+            if next_segment is None:
+                break
+            # 写入方只在写完旧段后才新开一段：再读一次旧段的剩余内容，然后切换
+            batch, offset = self.log.read(segment, offset)
+            records.extend(batch)
+            segment, offset = next_segment, 0
+        if advance:
+            self._position = (segment, offset)
+        return [record for record in records if record["seq"] > applied_seq]
+
+    def catch_up(self, capture_seq: Optional[int] = None) -> Any:
+        """应用日志中的全部新记录；capture_seq 指定时返回该条记录的应用结果"""
+        with self._apply_lock:
+            captured, error = None, None
+            for record in self._read_pending():
+                seq = record["seq"]
+                if seq <= self.applied_seq:
+                    continue
+                if seq != self.applied_seq + 1:
+                    latest = self.snapshots.latest()
+                    if latest is not None and latest["seq"] > self.applied_seq and latest["seq"] >= seq - 1:
+                        logger.warning(f"WAL entries {self.applied_seq + 1}..{seq - 1} were pruned, re-bootstrapping from snapshot {latest['seq']}")
+                        self.bootstrap()
+                        return self.catch_up(capture_seq)
+                    logger.error(f"WAL entries {self.applied_seq + 1}..{seq - 1} are missing, skipping ahead to {seq}")
+                if "embedding" in record:
+                    record["embedding"] = decode_vector(record["embedding"])
+                try:
+                    result = apply_operation(self.collections, record)
+                except Exception as e:
+                    # 应用失败在每个副本上都是确定的（同样的状态、同样的记录），跳过该条保持一致
+                    logger.error(f"Failed to apply WAL entry {seq} ({record.get('op')}): {e}")
+                    result, error = None, (e if seq == capture_seq else error)
+                if seq == capture_seq:
+                    captured = result
+                self.applied_seq = seq
+                self.applied_total += 1
+                self.last_applied_at = time.time()
+                REPLICATION_APPLIED.labels(op=record.get("op", "unknown")).inc()
+                REPLICATION_APPLY_DELAY.observe(max(0.0, self.last_applied_at - record.get("ts", self.last_applied_at)))
+            REPLICATION_APPLIED_SEQ.set(self.applied_seq)
+            if error is not None:
+                raise error
+            return captured
+
+    # === 快照 ===
+    def maybe_snapshot(self, force: bool = False) -> Optional[Dict[str, Any]]:
+        """距最新快照的日志条数或时间超过阈值时生成快照（同一时刻只有一个副本生成），并清理旧快照与日志段"""
+        if not force and not self._snapshot_due():
+            return None
+        # 其他副本可能刚生成过快照：按共享目录中的最新快照重新判断
+        latest = self.snapshots.latest()
+        if latest is not None:
+            self.snapshot_seq, self.snapshot_created_at = latest["seq"], latest["created_at"]
+        if not force and not self._snapshot_due():
+            return None
+        # 与 bootstrap 相同的加锁顺序：先停止应用日志，再取快照锁
+        with self._apply_lock, file_lock(self.snapshots.lock_path, blocking=force) as acquired:
+            if not acquired:
+                return None
+            if self.snapshot_seq is not None and self.snapshot_seq >= self.applied_seq:
+                return None
+            manifest = self.snapshots.create(self.applied_seq, self.collections)
+            self.snapshot_seq, self.snapshot_created_at = manifest["seq"], manifest["created_at"]
+            self.snapshots_taken += 1
+            oldest = self.snapshots.prune()
+        if oldest is not None:
+            self.log.prune(oldest)
+        return manifest
+
+    def _snapshot_due(self) -> bool:
+        behind = self.applied_seq - (self.snapshot_seq or 0)
+        if behind <= 0:
+            return False
+        return behind >= self.snapshot_every_entries or time.time() - self.snapshot_created_at >= self.snapshot_interval_seconds
+
+    # === 状态 ===
+    def status(self) -> Dict[str, Any]:
+        """复制状态：已应用/最新序号、尚未应用的记录数与最早一条的等待时长（复制延迟）"""
+        pending = self._read_pending(advance=False)
+        now = time.time()
+        return {
+            "enabled": True,
+            "directory": str(self.directory),
+            "applied_seq": self.applied_seq,
+            "head_seq": pending[-1]["seq"] if pending else self.applied_seq,
+            "lag_entries": pending[-1]["seq"] - self.applied_seq if pending else 0,
+            "lag_seconds": round(max(0.0, now - pending[0].get("ts", now)), 3) if pending else 0.0,
+            "applied_total": self.applied_total,
+            "last_applied_at": self.last_applied_at,
+            "snapshot_seq": self.snapshot_seq,
+            "snapshots": self.snapshots.list(),
+            "segments": self.log.segments(),
+            "snapshots_taken": self.snapshots_taken,
+            "bootstraps": self.bootstraps,
+        }
@@ -0,0 +1,198 @@
+"""交叉编码器重排序
+
+向量检索召回的候选文档与查询成对打分（一次批量推理），按相关性重新排序并裁剪，
+减少注入系统提示的无关上下文。重排序超出延迟预算时回退为向量检索顺序。
+
+推理在单线程中执行，已开始的推理无法中途取消，因此：
+- 每个任务在提交时确定截止时间（提交时刻 + 预算），排队等待与推理共用这一个预算；
+- 到截止时间仍未开始的任务在出队时直接跳过，不再占用推理线程；
+- 排队（含执行中）的任务数有上限，超出时立即回退为向量顺序。
+多个查询（批量检索）按查询分块，每块不超过 batch_size 个候选对、单独提交并各有一个预算，
+块之间交互式请求可以插队；批量检索总耗时超过 batch_budget_ms 后，剩余查询回退为向量顺序。
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sentence_transformers import CrossEncoder
+
+from metrics import RERANK_CANDIDATES
+
+logger = logging.getLogger(__name__)
+
+Candidate = Tuple[float, Dict[str, Any]]
+
+
+class _Job:
+    """一次排队的打分任务：deadline 之前未开始则跳过"""
+
+    def __init__(self, pairs: List[Tuple[str, str]], deadline: float):
+        self.pairs = pairs
+        self.deadline = deadline
+        self.started = threading.Event()
+
+
+class Reranker:
+    """CPU 交叉编码器重排序，带延迟预算、有界排队与统计"""
+
+    def __init__(
+        self,
+        model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+        candidates: int = 20,
+        budget_ms: float = 150.0,
+        min_score: float = 0.0,
+        max_length: int = 256,
+        max_queue: int = 4,
+        batch_size: int = 128,
+        batch_budget_ms: float = 2000.0,
+    ):
+        self.model_name = model_name
+        self.candidates = candidates
+        self.budget_seconds = budget_ms / 1000.0
+        self.batch_budget_seconds = batch_budget_ms / 1000.0
+        self.min_score = min_score
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+        # 单线程执行：超时任务不会堆积出更多推理线程；排队数受 max_queue 限制
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self._pending = 0
+
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.rejected = 0
+        self.errors = 0
+        self.candidates_in = 0
+        self.candidates_out = 0
+        self.total_seconds = 0.0
+        self.last_seconds = 0.0
+
+    def _score(self, job: _Job) -> Optional[np.ndarray]:
+        """推理线程中执行；出队时已过截止时间（调用方已回退）则跳过，返回 None"""
+        if time.perf_counter() >= job.deadline:
+            with self._lock:
+                self.skipped += 1
+            return None
+        job.started.set()
+        batch_size = min(len(job.pairs), self.batch_size)
+        return np.asarray(self.model.predict(job.pairs, batch_size=batch_size, show_progress_bar=False))
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    def _run(self, pairs: List[Tuple[str, str]], deadline: float) -> np.ndarray:
+        """提交一个任务并等到截止时间；排队已满时抛出 RuntimeError，超时抛出 FutureTimeoutError"""
+        with self._lock:
+            if self._pending >= self.max_queue:
+                self.rejected += 1
+                raise RuntimeError(f"rerank queue full ({self.max_queue})")
+            self._pending += 1
+        job = _Job(pairs, deadline)
+        future = self._executor.submit(self._score, job)
+        future.add_done_callback(self._release)
+        if not job.started.wait(timeout=max(0.0, deadline - time.perf_counter())):
+            future.cancel()
+            raise FutureTimeoutError()
+        scores = future.result(timeout=max(0.0, deadline - time.perf_counter()))
+        if scores is None:
+            raise FutureTimeoutError()
+        return scores
+
+    def _chunks(self, candidate_lists: List[List[Candidate]]) -> List[List[int]]:
+        """按查询下标分块，每块候选对总数不超过 batch_size（单个查询的候选不拆开），跳过没有候选的查询"""
+        chunks, current, size = [], [], 0
+        for i, candidates in enumerate(candidate_lists):
+            if not candidates:
+                continue
+            if current and size + len(candidates) > self.batch_size:
+                chunks.append(current)
+                current, size = [], 0
+            current.append(i)
+            size += len(candidates)
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def rerank(self, query: str, candidates: List[Candidate], top_k: int) -> List[Candidate]:
+        """返回按交叉编码器分数排序并裁剪后的候选；超时、排队已满或失败时按向量顺序截取 top_k"""
+        return self.rerank_many([query], [candidates], top_k)[0]
+
+    def rerank_many(self, queries: List[str], candidate_lists: List[List[Candidate]], top_k: int) -> List[List[Candidate]]:
+        """多个查询分块依次打分后分别排序裁剪；每块一个预算，总耗时不超过 batch_budget（单个查询时为一个预算）"""
+        results = [candidates[:top_k] for candidates in candidate_lists]
+        chunks = self._chunks(candidate_lists)
+        total_budget = self.budget_seconds if len(chunks) <= 1 else max(self.budget_seconds, self.batch_budget_seconds)
+        overall_deadline = time.perf_counter() + total_budget
+        for chunk in chunks:
+            n_in = sum(len(candidate_lists[i]) for i in chunk)
+            n_fallback = sum(len(results[i]) for i in chunk)
+            started = time.perf_counter()
+            if started >= overall_deadline:
+                self._record(n_in, n_fallback, started, timeout=True)
+                continue
+            pairs = [(queries[i], doc["content"][:500]) for i in chunk for _, doc in candidate_lists[i]]
+            try:
+                scores = self._run(pairs, min(started + self.budget_seconds, overall_deadline))
+            except FutureTimeoutError:
+                self._record(n_in, n_fallback, started, timeout=True)
+                logger.warning(f"Rerank exceeded budget ({self.budget_seconds * 1000:.0f}ms), falling back to vector order")
+                continue
+            except RuntimeError as e:
+                self._record(n_in, n_fallback, started, timeout=True)
+                logger.warning(f"{e}, falling back to vector order")
+                continue
+            except Exception as e:
+                self._record(n_in, n_fallback, started, error=True)
+                logger.error(f"Rerank failed: {e}")
+                continue
+
+            offset = 0
+            n_out = 0
+            for i in chunk:
+                candidates = candidate_lists[i]
+                query_scores = scores[offset:offset + len(candidates)]
+                offset += len(candidates)
+                order = np.argsort(-query_scores)
+                results[i] = [
+                    (float(query_scores[j]), candidates[j][1]) for j in order if query_scores[j] >= self.min_score
+                ][:top_k]
+                n_out += len(results[i])
+            self._record(n_in, n_out, started)
+        return results
+
+    def _record(self, n_in: int, n_out: int, started: float, timeout: bool = False, error: bool = False):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.calls += 1
+            self.timeouts += int(timeout)
+            self.errors += int(error)
+            self.candidates_in += n_in
+            self.candidates_out += n_out
+            self.total_seconds += elapsed
+            self.last_seconds = elapsed
+        RERANK_CANDIDATES.labels(direction="in").inc(n_in)
+        RERANK_CANDIDATES.labels(direction="out").inc(n_out)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "model": self.model_name,
+                "budget_ms": self.budget_seconds * 1000,
+                "batch_budget_ms": self.batch_budget_seconds * 1000,
+                "calls": self.calls,
+                "timeouts": self.timeouts,
+                "skipped": self.skipped,
+                "rejected": self.rejected,
+                "max_queue": self.max_queue,
+                "errors": self.errors,
+                "candidates_in": self.candidates_in,
+                "candidates_out": self.candidates_out,
+                "avg_ms": round(self.total_seconds / self.calls * 1000, 3) if self.calls else 0.0,
+                "last_ms": round(self.last_seconds * 1000, 3),
+            }
@@ -0,0 +1,135 @@
+"""相同请求合并（single-flight）
+
+同一时刻到达的相同请求（相同提示词 + 模型 + 温度）只向上游发起一次调用：
+- SingleFlight：非流式调用，所有等待方共享同一结果或异常
+- StreamFanout：流式调用，上游产出的每个事件广播给所有订阅者，迟到的订阅者先补发已产出的事件
+
+某个等待方/订阅者断开只影响自身；全部断开时才取消上游调用。调用结束后立即移除，不做结果缓存。
+"""
+import asyncio
+import hashlib
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from metrics import SINGLEFLIGHT_REQUESTS
+
+
+def request_key(*parts: Any) -> str:
+    """将请求参数序列化为稳定的哈希键"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """合并相同键的并发非流式调用"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _task: self._forget(key, call))
+            SINGLEFLIGHT_REQUESTS.labels(kind=self.name, role="leader").inc()
+        else:
+            SINGLEFLIGHT_REQUESTS.labels(kind=self.name, role="follower").inc()
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            # 最后一个等待方取消时才取消上游调用
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+                self._forget(key, call)
+            raise
+        finally:
+            call.waiters -= 1
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+class _Broadcast:
+    def __init__(self):
+        self.events: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class StreamFanout:
+    """合并相同键的并发流式调用，并把上游事件扇出给每个订阅者"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[Hashable, _Broadcast] = {}
+
+    def _forget(self, key: Hashable, broadcast: _Broadcast):
+        if self._flights.get(key) is broadcast:
+            del self._flights[key]
+
+    async def _pump(self, key: Hashable, broadcast: _Broadcast, events: AsyncIterator[str]):
+        try:
+            async for event in events:
+                broadcast.events.append(event)
+                broadcast.notify()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            broadcast.done = True
+            self._forget(key, broadcast)
+            broadcast.notify()
+
+    async def subscribe(self, key: Hashable, factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        broadcast = self._flights.get(key)
+        if broadcast is None:
+            broadcast = _Broadcast()
+            self._flights[key] = broadcast
+            broadcast.task = asyncio.ensure_future(self._pump(key, broadcast, factory()))
+            SINGLEFLIGHT_REQUESTS.labels(kind=self.name, role="leader").inc()
+        else:
+            SINGLEFLIGHT_REQUESTS.labels(kind=self.name, role="follower").inc()
+
+        broadcast.subscribers += 1
+        position = 0
+        try:
+            while True:
+                while position < len(broadcast.events):
+                    yield broadcast.events[position]
+                    position += 1
+                if broadcast.done:
+                    if broadcast.error is not None:
+                        raise broadcast.error
+                    return
+                await broadcast.changed.wait()
+        finally:
+            broadcast.subscribers -= 1
+            # 所有订阅者都已断开：取消上游调用
+            if broadcast.subscribers == 0 and not broadcast.done:
+                broadcast.task.cancel()
+                self._forget(key, broadcast)
+
+    def in_flight(self) -> int:
+        return len(self._flights)
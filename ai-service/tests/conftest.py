@@ -0,0 +1,5 @@
+"""AI服务测试：服务代码是 ai-service 下的平铺模块，把该目录加入导入路径"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,116 @@
+"""准入控制：优先级排队、取消时名额不泄漏、负载削减与令牌桶限流"""
+import asyncio
+
+import pytest
+
+from admission import PRIORITY_BATCH, PRIORITY_INTERACTIVE, AdmissionRejected, ProviderLimiter, TokenBucketLimiter
+
+
+def make_limiter(**options) -> ProviderLimiter:
+    options.setdefault("max_concurrency", 1)
+    options.setdefault("max_queue", 8)
+    options.setdefault("max_wait_seconds", 60.0)
+    return ProviderLimiter("test", **options)
+
+
+def test_interactive_requests_are_admitted_before_queued_batch_requests():
+    async def scenario():
+        limiter, order = make_limiter(), []
+        await limiter.acquire()
+
+        async def request(name, priority):
+            async with limiter.slot(priority):
+                order.append(name)
+
+        tasks = [asyncio.create_task(request("batch-1", PRIORITY_BATCH)), asyncio.create_task(request("batch-2", PRIORITY_BATCH))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request("interactive", PRIORITY_INTERACTIVE)))
+        await asyncio.sleep(0)
+        limiter.release()
+        await asyncio.gather(*tasks)
+        return order, limiter.active
+
+    order, active = asyncio.run(scenario())
+    assert order == ["interactive", "batch-1", "batch-2"]
+    assert active == 0
+
+
+def test_cancelled_waiter_leaves_the_queue_without_taking_a_slot():
+    async def scenario():
+        limiter = make_limiter()
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        state = (limiter.waiting, limiter.active)
+        limiter.release()
+        return state, limiter.active
+
+    assert asyncio.run(scenario()) == ((0, 1), 0)
+
+
+def test_slot_handed_to_a_cancelled_waiter_is_passed_on():
+    async def scenario():
+        limiter = make_limiter()
+        await limiter.acquire()
+        cancelled = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        next_waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        # 名额已移交给第一个等待者，但它在恢复运行前被取消：名额应转给下一个等待者
+        limiter.release()
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        await asyncio.wait_for(next_waiter, timeout=1)
+        state = (limiter.active, limiter.waiting)
+        limiter.release()
+        return state, limiter.active
+
+    assert asyncio.run(scenario()) == ((1, 0), 0)
+
+
+def test_full_queue_is_shed_with_retry_after():
+    async def scenario():
+        limiter = make_limiter(max_queue=1)
+        await limiter.acquire()
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await limiter.acquire()
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        return rejected.value
+
+    rejected = asyncio.run(scenario())
+    assert rejected.status_code == 503
+    assert rejected.retry_after >= 1
+
+
+def test_expected_wait_beyond_timeout_is_shed():
+    limiter = make_limiter(max_wait_seconds=1.0, initial_service_seconds=5.0)
+    asyncio.run(limiter.acquire())
+    with pytest.raises(AdmissionRejected) as rejected:
+        limiter.check(PRIORITY_INTERACTIVE)
+    assert rejected.value.status_code == 503
+    assert rejected.value.retry_after == 5
+
+
+def test_token_bucket_allows_burst_then_limits_per_key():
+    limiter = TokenBucketLimiter("user", rate_per_minute=60, burst=2)
+    limiter.check("alice")
+    limiter.check("alice")
+    with pytest.raises(AdmissionRejected) as rejected:
+        limiter.check("alice")
+    assert rejected.value.status_code == 429
+    assert rejected.value.retry_after == 1
+    limiter.check("bob")
+
+
+def test_token_bucket_keeps_only_recent_keys():
+    limiter = TokenBucketLimiter("user", rate_per_minute=1, burst=1, max_keys=2)
+    for key in ("a", "b", "c"):
+        limiter.check(key)
+    assert list(limiter._buckets) == ["b", "c"]
+    # a 的桶已被淘汰，重新获得突发额度
+    limiter.check("a")
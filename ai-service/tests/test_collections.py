@@ -0,0 +1,73 @@
+"""集合管理：懒加载、内存预算下的LRU卸载与写入期间钉住"""
+import numpy as np
+import pytest
+
+from knowledge_base import CollectionManager
+
+DIM = 8
+VECTOR = np.ones(DIM, dtype=np.float32) / np.sqrt(DIM)
+
+
+def fill(manager: CollectionManager, name: str, documents: int = 1, size: int = 100):
+    with manager.use(name, create=True) as kb:
+        for i in range(documents):
+            kb.add(f"{name}-{i}", "x" * size, {}, VECTOR)
+
+
+def test_missing_collection_is_created_only_on_request(tmp_path):
+    manager = CollectionManager(tmp_path, dim=DIM)
+    assert manager.get("tenant-a") is None
+    assert manager.get("tenant-a", create=True) is not None
+    with pytest.raises(ValueError):
+        manager.get("../etc")
+
+
+def test_least_recently_used_collection_is_unloaded_and_lazily_reloaded(tmp_path):
+    manager = CollectionManager(tmp_path, dim=DIM, memory_budget_bytes=400)
+    fill(manager, "a")
+    fill(manager, "b")
+    manager.get("a")
+    fill(manager, "c")
+
+    stats = manager.stats()
+    assert stats["unloads"] == 1
+    assert stats["loaded_collections"] == ["a", "c"]
+    assert (tmp_path / "b" / "documents.json").exists()
+
+    kb = manager.get("b")
+    assert len(kb) == 1 and kb.get(0)["title"] == "b-0"
+    assert manager.loads == 1
+
+
+def test_pinned_collection_keeps_writes_made_while_over_budget(tmp_path):
+    manager = CollectionManager(tmp_path, dim=DIM, memory_budget_bytes=400)
+    fill(manager, "a")
+    with manager.use("a") as kb:
+        # 其他集合把内存推过预算：被钉住的 a 不能在写入前被落盘卸载
+        fill(manager, "b", size=300)
+        assert manager.stats()["loaded_collections"] == ["a"]
+        kb.add("a-1", "late write", {}, VECTOR)
+    manager.save_all()
+
+    reopened = CollectionManager(tmp_path, dim=DIM)
+    assert [doc["title"] for doc in (reopened.get("a").get(i) for i in range(2))] == ["a-0", "a-1"]
+
+
+def test_collection_growing_past_budget_is_unloaded_after_use(tmp_path):
+    manager = CollectionManager(tmp_path, dim=DIM, memory_budget_bytes=400)
+    fill(manager, "a")
+    # b 在使用期间自身超出预算：结束使用后连同 b 一起卸载，而不是等到下一次加载集合
+    fill(manager, "b", documents=3)
+    assert manager.stats()["loaded_collections"] == []
+    assert len(manager.get("a")) == 1
+    assert len(manager.get("b")) == 3
+
+
+def test_drop_removes_memory_and_disk(tmp_path):
+    manager = CollectionManager(tmp_path, dim=DIM)
+    fill(manager, "a")
+    manager.save_all()
+    assert manager.drop("a")
+    assert manager.get("a") is None
+    assert not (tmp_path / "a").exists()
+    assert not manager.drop("a")
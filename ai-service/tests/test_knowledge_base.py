@@ -0,0 +1,109 @@
+"""知识库：稳定文档ID、墓碑删除与索引压缩"""
+import numpy as np
+
+from knowledge_base import KnowledgeBase
+
+DIM = 8
+
+
+def unit(i: int) -> np.ndarray:
+    vector = np.zeros(DIM, dtype=np.float32)
+    vector[i % DIM] = 1.0
+    return vector
+
+
+def make_kb(**options) -> KnowledgeBase:
+    options.setdefault("compaction_min_tombstones", 1000)
+    return KnowledgeBase(dim=DIM, **options)
+
+
+def search_ids(kb: KnowledgeBase, vector, top_k: int = 10, min_score=None):
+    return [doc["id"] for _, doc in kb.search(np.array([vector]), top_k, min_score)[0]]
+
+
+def test_ids_stay_stable_across_update_and_delete():
+    kb = make_kb()
+    ids = [kb.add(f"doc{i}", f"content {i}", {}, unit(i))["id"] for i in range(4)]
+    assert ids == [0, 1, 2, 3]
+
+    assert kb.delete(1)
+    updated = kb.update(2, "doc2 v2", "new content", {}, unit(5))
+    assert updated["id"] == 2
+    assert kb.add("doc4", "content 4", {}, unit(6))["id"] == 4
+    assert kb.get(1) is None and kb.get(2)["title"] == "doc2 v2"
+    assert not kb.delete(1)
+    assert kb.update(1, "t", "c", {}, unit(1)) is None
+
+
+def test_tombstoned_vectors_are_not_returned():
+    kb = make_kb()
+    for i in range(3):
+        kb.add(f"doc{i}", "c", {}, unit(i))
+    kb.delete(0)
+    kb.update(1, "doc1 v2", "c", {}, unit(7))
+
+    assert 0 not in search_ids(kb, unit(0))
+    # 旧向量打了墓碑：只有新向量能命中文档1
+    assert search_ids(kb, unit(1), min_score=0.5) == []
+    assert search_ids(kb, unit(7), min_score=0.5) == [1]
+    assert kb.stats()["tombstones"] == 2
+
+
+def test_compaction_drops_tombstones_and_keeps_results():
+    kb = make_kb()
+    for i in range(6):
+        kb.add(f"doc{i}", "c", {}, unit(i))
+    for doc_id in (0, 2, 4):
+        kb.delete(doc_id)
+    kb.update(1, "doc1 v2", "c", {}, unit(6))
+    before = {doc_id: search_ids(kb, unit(doc_id)) for doc_id in range(DIM)}
+
+    kb.compact()
+
+    stats = kb.stats()
+    assert stats["tombstones"] == 0
+    assert stats["vectors"] == stats["documents"] == 3
+    assert stats["compactions"] == 1
+    assert {doc_id: search_ids(kb, unit(doc_id)) for doc_id in range(DIM)} == before
+
+
+def test_background_compaction_triggers_at_threshold():
+    kb = make_kb(compaction_threshold=0.5, compaction_min_tombstones=2)
+    for i in range(4):
+        kb.add(f"doc{i}", "c", {}, unit(i))
+    kb.delete(0)
+    assert kb.stats()["compactions"] == 0
+    kb.delete(1)
+    kb._compaction_thread.join(timeout=5)
+
+    assert kb.stats()["compactions"] == 1
+    assert kb.stats()["tombstones"] == 0
+    assert sorted(search_ids(kb, unit(2)) + search_ids(kb, unit(3))) == [2, 2, 3, 3]
+
+
+def test_sharded_search_matches_single_index():
+    single, sharded = make_kb(), make_kb(shards=3)
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(30, DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    for kb in (single, sharded):
+        for i, vector in enumerate(vectors):
+            kb.add(f"doc{i}", "c", {}, vector)
+        for doc_id in range(0, 30, 4):
+            kb.delete(doc_id)
+    for vector in vectors[:5]:
+        assert search_ids(single, vector, 5) == search_ids(sharded, vector, 5)
+
+
+def test_save_and_load_preserve_ids_without_tombstones(tmp_path):
+    kb = make_kb()
+    for i in range(3):
+        kb.add(f"doc{i}", "c", {}, unit(i))
+    kb.delete(1)
+    kb.save(tmp_path)
+
+    loaded = KnowledgeBase.load(tmp_path, compaction_min_tombstones=1000)
+    assert loaded.stats()["tombstones"] == 0
+    assert [loaded.get(i) is not None for i in range(3)] == [True, False, True]
+    assert loaded.add("doc3", "c", {}, unit(3))["id"] == 3
+    assert search_ids(loaded, unit(2))[0] == 2
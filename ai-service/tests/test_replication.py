@@ -0,0 +1,112 @@
+"""知识库复制：WAL 顺序回放、快照引导与日志清理"""
+import numpy as np
+
+from knowledge_base import CollectionManager
+from replication import IngestLog, Replicator
+
+DIM = 8
+
+
+def unit(i: int) -> np.ndarray:
+    vector = np.zeros(DIM, dtype=np.float32)
+    vector[i % DIM] = 1.0
+    return vector
+
+
+def add(title: str, i: int, collection: str = "default") -> dict:
+    return {"op": "add", "collection": collection, "title": title, "content": f"{title} body", "metadata": {}, "embedding": unit(i)}
+
+
+def make_replica(tmp_path, name: str, shared: str = "shared", **options) -> Replicator:
+    collections = CollectionManager(tmp_path / name, dim=DIM)
+    options.setdefault("fsync", False)
+    options.setdefault("snapshot_every_entries", 10**6)
+    options.setdefault("snapshot_interval_seconds", 10**6)
+    replicator = Replicator(collections, tmp_path / shared, **options)
+    replicator.bootstrap()
+    return replicator
+
+
+def documents(replica: Replicator, collection: str = "default") -> dict:
+    kb = replica.collections.get(collection)
+    if kb is None:
+        return {}
+    return {doc_id: kb.get(doc_id)["title"] for doc_id in range(kb._next_doc_id) if kb.get(doc_id)}
+
+
+def test_writes_replay_on_other_replicas_with_the_same_ids(tmp_path):
+    primary, follower = make_replica(tmp_path, "a"), make_replica(tmp_path, "b")
+    first = primary.submit(add("one", 0))
+    follower.submit(add("two", 1))
+    primary.submit({"op": "update", "collection": "default", "doc_id": first["id"], "title": "one v2",
+                    "content": "new", "metadata": {}, "embedding": unit(2)})
+    assert follower.submit({"op": "delete", "collection": "default", "doc_id": 1}) is True
+    primary.catch_up()
+    follower.catch_up()
+
+    assert documents(primary) == documents(follower) == {0: "one v2"}
+    assert primary.applied_seq == follower.applied_seq == 4
+    assert follower.status()["lag_entries"] == 0
+
+
+def test_status_reports_lag_until_caught_up(tmp_path):
+    primary, follower = make_replica(tmp_path, "a"), make_replica(tmp_path, "b")
+    for i in range(3):
+        primary.submit(add(f"doc{i}", i))
+    assert follower.status()["lag_entries"] == 3
+    follower.catch_up()
+    assert follower.status()["lag_entries"] == 0
+
+
+def test_new_replica_bootstraps_from_snapshot_and_replays_later_entries(tmp_path):
+    primary = make_replica(tmp_path, "a", segment_bytes=1, snapshot_retain=1)
+    for i in range(3):
+        primary.submit(add(f"doc{i}", i))
+    manifest = primary.maybe_snapshot(force=True)
+    primary.submit(add("after snapshot", 3))
+
+    assert manifest["seq"] == 3
+    # 每条记录一个段：快照覆盖到的段已被清理，只留快照之后的日志
+    assert primary.log.segments() == [3, 4]
+
+    replica = make_replica(tmp_path, "c")
+    assert replica.applied_seq == 3
+    replica.catch_up()
+    assert documents(replica) == {0: "doc0", 1: "doc1", 2: "doc2", 3: "after snapshot"}
+    assert replica.applied_seq == 4
+
+
+def test_lagging_replica_rebootstraps_when_its_entries_were_pruned(tmp_path):
+    primary = make_replica(tmp_path, "a", segment_bytes=1, snapshot_retain=1)
+    lagging = make_replica(tmp_path, "b")
+    for i in range(3):
+        primary.submit(add(f"doc{i}", i))
+    primary.maybe_snapshot(force=True)
+    primary.submit(add("doc3", 3))
+
+    lagging.catch_up()
+    assert lagging.bootstraps == 2
+    assert documents(lagging) == documents(primary)
+
+
+def test_first_replica_seeds_snapshot_from_existing_local_collections(tmp_path):
+    local = CollectionManager(tmp_path / "a", dim=DIM)
+    with local.use("default", create=True) as kb:
+        kb.add("local", "c", {}, unit(0))
+    local.save_all()
+    seeded = Replicator(local, tmp_path / "shared", fsync=False)
+    seeded.bootstrap()
+
+    assert seeded.snapshots.list() == [0]
+    assert documents(make_replica(tmp_path, "b")) == {0: "local"}
+
+
+def test_reader_skips_torn_lines_and_appends_after_them(tmp_path):
+    log = IngestLog(tmp_path / "wal", fsync=False)
+    assert log.append({"op": "drop", "collection": "a"}) == 1
+    with open(log._segment_path(1), "ab") as f:
+        f.write(b'{"op":"drop","coll')
+    assert log.append({"op": "drop", "collection": "b"}) == 2
+
+    records, _ = log.read(1, 0)
+    assert [record["seq"] for record in records] == [1, 2]
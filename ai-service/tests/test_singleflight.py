@@ -0,0 +1,126 @@
+"""相同请求合并：共享结果/异常、取消语义与流式扇出"""
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight, StreamFanout, request_key
+
+
+def test_request_key_is_stable_and_distinguishes_parameters():
+    assert request_key("hi", "gpt", 0.7) == request_key("hi", "gpt", 0.7)
+    assert request_key({"b": 1, "a": 2}) == request_key({"a": 2, "b": 1})
+    assert request_key("hi", "gpt", 0.7) != request_key("hi", "gpt", 0.2)
+
+
+def test_concurrent_callers_share_one_upstream_call():
+    async def scenario():
+        flight, calls = SingleFlight("test"), []
+        release = asyncio.Event()
+
+        async def upstream():
+            calls.append(1)
+            await release.wait()
+            return "answer"
+
+        waiters = [asyncio.create_task(flight.do("k", upstream)) for _ in range(5)]
+        await asyncio.sleep(0)
+        assert flight.in_flight() == 1
+        release.set()
+        results = await asyncio.gather(*waiters)
+        return calls, results, flight.in_flight()
+
+    calls, results, in_flight = asyncio.run(scenario())
+    assert calls == [1]
+    assert results == ["answer"] * 5
+    # 调用结束即移除，不缓存结果
+    assert in_flight == 0
+
+
+def test_errors_are_shared_and_not_cached():
+    async def scenario():
+        flight, calls = SingleFlight("test"), []
+
+        async def failing():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream down")
+
+        results = await asyncio.gather(*(flight.do("k", failing) for _ in range(3)), return_exceptions=True)
+        await asyncio.gather(flight.do("k", failing), return_exceptions=True)
+        return calls, results
+
+    calls, results = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert calls == [1, 1]
+
+
+def test_upstream_is_cancelled_only_when_every_waiter_leaves():
+    async def scenario():
+        flight = SingleFlight("test")
+        cancelled = asyncio.Event()
+
+        async def upstream():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        first = asyncio.create_task(flight.do("k", upstream))
+        second = asyncio.create_task(flight.do("k", upstream))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        after_first = cancelled.is_set()
+        second.cancel()
+        await asyncio.sleep(0.01)
+        return after_first, cancelled.is_set(), flight.in_flight()
+
+    after_first, after_all, in_flight = asyncio.run(scenario())
+    assert not after_first
+    assert after_all
+    assert in_flight == 0
+
+
+def test_stream_fanout_replays_events_to_late_subscribers():
+    async def scenario():
+        fanout, calls = StreamFanout("test"), []
+        gate = asyncio.Event()
+
+        async def upstream():
+            calls.append(1)
+            yield "a"
+            await gate.wait()
+            yield "b"
+            yield "c"
+
+        async def collect():
+            return [event async for event in fanout.subscribe("k", upstream)]
+
+        early = asyncio.create_task(collect())
+        await asyncio.sleep(0.01)
+        late = asyncio.create_task(collect())
+        await asyncio.sleep(0.01)
+        gate.set()
+        return calls, await early, await late
+
+    calls, early, late = asyncio.run(scenario())
+    assert calls == [1]
+    assert early == late == ["a", "b", "c"]
+
+
+def test_stream_fanout_propagates_upstream_errors():
+    async def scenario():
+        fanout = StreamFanout("test")
+
+        async def upstream():
+            yield "a"
+            raise RuntimeError("stream broke")
+
+        events = []
+        with pytest.raises(RuntimeError):
+            async for event in fanout.subscribe("k", upstream):
+                events.append(event)
+        return events, fanout.in_flight()
+
+    assert asyncio.run(scenario()) == (["a"], 0)
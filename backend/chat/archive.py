@@ -0,0 +1,235 @@
+"""冷热分层：长期不活跃的对话压缩归档
+
+- 归档：对话的全部消息序列化为 JSON 后整体压缩（zstd 可用时优先，否则 zlib）写入 ConversationArchive，
+  并从 chat_message 删除，热表只保留活跃对话
+- 读取：对话接口读取已归档对话时在内存中解压，返回格式与热数据一致；解压结果按 (对话ID, 归档时间) 缓存在进程内
+- 写入：append_message 锁住对话行后写入消息，已归档对话先恢复（rehydrate）到热表；归档同样先锁对话行，
+  两者串行，检查之后才被归档的对话不会吞掉新消息
+"""
+import json
+import logging
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Conversation, ConversationArchive, Message
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖：未安装时使用 zlib
+    zstandard = None
+
+
+def available_codecs():
+    return ('zstd', 'zlib') if zstandard is not None else ('zlib',)
+
+
+def resolve_codec(codec=None):
+    codec = codec or settings.CHAT_ARCHIVE_CODEC
+    if codec == 'zstd' and zstandard is None:
+        logger.warning("zstandard is not installed, falling back to zlib for archives")
+        codec = 'zlib'
+    if codec not in ('zstd', 'zlib'):
+        raise ValueError(f"unsupported archive codec: {codec}")
+    return codec
+
+
+def compress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=settings.CHAT_ARCHIVE_ZSTD_LEVEL).compress(data)
+    return zlib.compress(data, settings.CHAT_ARCHIVE_ZLIB_LEVEL)
+
+
+def decompress(data, codec):
+    data = bytes(data)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("archive is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def archive_records(payload, codec):
+    """解压归档，返回 (id, role, content, created_at) 元组列表（按ID升序）"""
+    return [
+        (msg_id, role, content, parse_datetime(created_at))
+        for msg_id, role, content, created_at in json.loads(decompress(payload, codec))
+    ]
+
+
+def archived_messages(archive):
+    """解压归档，返回未保存的 Message 实例列表（按ID升序），可直接交给 MessageSerializer"""
+    return [
+        Message(id=msg_id, conversation_id=archive.conversation_id, role=role, content=content, created_at=created_at)
+        for msg_id, role, content, created_at in archive_records(archive.payload, archive.codec)
+    ]
+
+
+# 归档在 (对话ID, 归档时间) 下不可变（恢复后 archived_at 清空，再次归档时间不同），解压结果可在进程内复用
+_records_cache = OrderedDict()
+_records_lock = threading.Lock()
+
+
+def cached_archive_records(conversation_id, archived_at):
+    """已缓存的解压结果，未命中时返回 None"""
+    with _records_lock:
+        records = _records_cache.get((conversation_id, archived_at))
+        if records is not None:
+            _records_cache.move_to_end((conversation_id, archived_at))
+        return records
+
+
+def cache_archive_records(conversation_id, archived_at, records):
+    if settings.CHAT_ARCHIVE_CACHE_SIZE <= 0:
+        return
+    with _records_lock:
+        _records_cache[(conversation_id, archived_at)] = records
+        _records_cache.move_to_end((conversation_id, archived_at))
+        while len(_records_cache) > settings.CHAT_ARCHIVE_CACHE_SIZE:
+            _records_cache.popitem(last=False)
+
+
+def archive_conversation(conversation_id, codec=None, inactive_before=None):
+    """归档单个对话，返回 ConversationArchive；对话已归档、已被重新激活或没有消息时返回 None"""
+    codec = resolve_codec(codec)
+    with transaction.atomic():
+        conversations = Conversation.objects.select_for_update().filter(id=conversation_id, archived_at__isnull=True)
+        if inactive_before is not None:
+            conversations = conversations.filter(updated_at__lt=inactive_before)
+        conv = conversations.first()
+        if conv is None:
+            return None
+        records = list(
+            Message.objects.filter(conversation_id=conversation_id)
+            .order_by('id')
+            .values_list('id', 'role', 'content', 'created_at')
+        )
+        if not records:
+            return None
+        raw = json.dumps(
+            [[msg_id, role, content, created_at.isoformat()] for msg_id, role, content, created_at in records],
+            ensure_ascii=False,
+            separators=(',', ':'),
+        ).encode('utf-8')
+        payload = compress(raw, codec)
+        archive = ConversationArchive.objects.create(
+            conversation_id=conversation_id,
+            codec=codec,
+            payload=payload,
+            message_count=len(records),
+            raw_bytes=len(raw),
+            compressed_bytes=len(payload),
+            first_message_at=records[0][3],
+            last_message_at=records[-1][3],
+        )
+        Message.objects.filter(conversation_id=conversation_id, id__lte=records[-1][0]).delete()
+        if Message.objects.filter(conversation_id=conversation_id).exists():
+            # 归档期间有新消息写入：对话已重新活跃，放弃本次归档
+            transaction.set_rollback(True)
+            return None
+        # update() 不触发 auto_now，归档不改变对话的最近活动时间
+        Conversation.objects.filter(id=conversation_id).update(archived_at=timezone.now())
+    return archive
+
+
+def rehydrate_conversation(conv):
+    """把已归档对话的消息恢复到热表（保留原消息ID与创建时间），返回恢复的消息数"""
+    if conv.archived_at is None:
+        return 0
+    with transaction.atomic():
+        archive = ConversationArchive.objects.select_for_update().filter(conversation_id=conv.id).first()
+        restored = 0
+        if archive is not None:
+            messages = archived_messages(archive)
+            created_at = {msg.id: msg.created_at for msg in messages}
+            Message.objects.bulk_create(messages, batch_size=1000)
+            # bulk_create 会用当前时间覆盖 auto_now_add 字段，再按原值写回
+            for msg in messages:
+                msg.created_at = created_at[msg.id]
+            Message.objects.bulk_update(messages, ['created_at'], batch_size=1000)
+            archive.delete()
+            restored = len(messages)
+        Conversation.objects.filter(id=conv.id).update(archived_at=None)
+    conv.archived_at = None
+    logger.info(f"Conversation {conv.id} rehydrated {restored} messages from archive")
+    return restored
+
+
+def append_message(conv, role, content):
+    """向对话追加一条消息并更新最近活动时间，返回 Message
+
+    在事务中锁住对话行后重新读取归档状态：已归档（包括读取 conv 之后才被归档）时先恢复到热表。
+    只保存 updated_at，不用内存中可能过期的其他字段覆盖对话行。
+    """
+    with transaction.atomic():
+        conv.archived_at = Conversation.objects.select_for_update().values_list('archived_at', flat=True).get(id=conv.id)
+        rehydrate_conversation(conv)
+        msg = Message.objects.create(conversation=conv, role=role, content=content)
+        conv.save(update_fields=['updated_at'])
+    return msg
+
+
+def archive_inactive_conversations(inactive_days=None, batch_size=None, limit=None, codec=None, dry_run=False, progress=None):
+    """归档最近活动早于 inactive_days 天的对话，逐个对话独立事务；返回汇总统计
+
+    progress(stats) 每处理完一批调用一次，用于输出进度。
+    """
+    inactive_days = settings.CHAT_ARCHIVE_INACTIVE_DAYS if inactive_days is None else inactive_days
+    batch_size = batch_size or settings.CHAT_ARCHIVE_BATCH_SIZE
+    codec = resolve_codec(codec)
+    cutoff = timezone.now() - timedelta(days=inactive_days)
+    candidates = (
+        Conversation.objects.filter(archived_at__isnull=True, updated_at__lt=cutoff)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+    if limit:
+        candidates = candidates[:limit]
+    # 先取出候选ID，避免归档过程中与迭代中的游标交错
+    candidate_ids = list(candidates)
+
+    stats = {
+        'candidates': len(candidate_ids),
+        'conversations': 0,
+        'messages': 0,
+        'raw_bytes': 0,
+        'compressed_bytes': 0,
+        'codec': codec,
+        'dry_run': dry_run,
+    }
+    started = time.perf_counter()
+    for offset in range(0, len(candidate_ids), batch_size):
+        for conversation_id in candidate_ids[offset:offset + batch_size]:
+            if dry_run:
+                stats['messages'] += Message.objects.filter(conversation_id=conversation_id).count()
+                continue
+            try:
+                archive = archive_conversation(conversation_id, codec, inactive_before=cutoff)
+            except Exception as e:
+                logger.error(f"Archive conversation {conversation_id} failed: {e}")
+                continue
+            if archive is None:
+                continue
+            stats['conversations'] += 1
+            stats['messages'] += archive.message_count
+            stats['raw_bytes'] += archive.raw_bytes
+            stats['compressed_bytes'] += archive.compressed_bytes
+        stats['processed'] = min(offset + batch_size, len(candidate_ids))
+        stats['elapsed_s'] = round(time.perf_counter() - started, 3)
+        if progress:
+            progress(stats)
+
+    stats['processed'] = len(candidate_ids)
+    stats['elapsed_s'] = round(time.perf_counter() - started, 3)
+    stats['ratio'] = round(stats['raw_bytes'] / stats['compressed_bytes'], 2) if stats['compressed_bytes'] else 0.0
+    logger.info(f"Archive run finished: {stats}")
+    return stats
@@ -0,0 +1,180 @@
+"""对话消息流式导出（NDJSON / CSV，可选 gzip）
+
+按消息ID顺序以 .iterator(chunk_size) 逐批读取（PostgreSQL 下为服务端游标），
+逐行编码并按块输出，内存占用与导出数据量无关。热表之后逐个解压输出已归档对话的消息。
+HTTP 接口与管理命令共用本模块。
+"""
+import csv
+import io
+import json
+import logging
+import time
+import zlib
+from datetime import datetime, time as dt_time
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .archive import decompress
+from .models import ConversationArchive, Message
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_FIELDS = (
+    'id', 'conversation_id', 'conversation_title', 'user_id', 'username', 'role', 'content', 'created_at',
+)
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+_COLUMNS = (
+    'id', 'conversation_id', 'conversation__title', 'conversation__user_id', 'conversation__user__username',
+    'role', 'content', 'created_at',
+)
+
+
+def parse_bound(value):
+    """解析时间范围边界：支持 ISO 日期（当天零点）或日期时间，无时区时按当前时区处理；非法值抛出 ValueError"""
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"invalid date: {value}")
+        parsed = datetime.combine(day, dt_time.min)
+    if settings.USE_TZ and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def export_queryset(user_id=None, since=None, until=None):
+    """按用户与时间范围（created_at ∈ [since, until)）过滤的消息行，只取导出所需列"""
+    qs = Message.objects.all()
+    if user_id is not None:
+        qs = qs.filter(conversation__user_id=user_id)
+    if since is not None:
+        qs = qs.filter(created_at__gte=since)
+    if until is not None:
+        qs = qs.filter(created_at__lt=until)
+    return qs.order_by('id').values_list(*_COLUMNS)
+
+
+def archived_rows(user_id=None, since=None, until=None):
+    """已归档对话中符合条件的消息行，列顺序与 export_queryset 一致；一次只解压一个对话"""
+    qs = ConversationArchive.objects.all()
+    if user_id is not None:
+        qs = qs.filter(conversation__user_id=user_id)
+    if since is not None:
+        qs = qs.filter(last_message_at__gte=since)
+    if until is not None:
+        qs = qs.filter(first_message_at__lt=until)
+    archives = qs.order_by('conversation_id').values_list(
+        'conversation_id', 'conversation__title', 'conversation__user_id', 'conversation__user__username', 'codec', 'payload'
+    )
+    for conversation_id, title, owner_id, username, codec, payload in archives.iterator(chunk_size=settings.CHAT_EXPORT_ARCHIVE_CHUNK_SIZE):
+        for msg_id, role, content, created_at in json.loads(decompress(payload, codec)):
+            created_at = parse_datetime(created_at)
+            if (since is not None and created_at < since) or (until is not None and created_at >= until):
+                continue
+            yield msg_id, conversation_id, title, owner_id, username, role, content, created_at
+
+
+def export_rows(user_id=None, since=None, until=None, chunk_size=None):
+    """导出的全部消息行：先热表（按消息ID），再已归档对话（按对话ID）"""
+    chunk_size = chunk_size or settings.CHAT_EXPORT_CHUNK_SIZE
+    yield from export_queryset(user_id, since, until).iterator(chunk_size=chunk_size)
+    yield from archived_rows(user_id, since, until)
+
+
+class ExportStats:
+    """导出进度统计：行数、字节数与吞吐量"""
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'elapsed_s': round(self.elapsed, 3),
+            'rows_per_sec': round(self.rows_per_second, 1),
+        }
+
+
+def _count_rows(rows, stats):
+    for row in rows:
+        stats.rows += 1
+        yield row
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        record = dict(zip(EXPORT_FIELDS, row))
+        record['created_at'] = record['created_at'].isoformat()
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        row = list(row)
+        row[-1] = row[-1].isoformat()
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    # 表头在没有任何数据行时也要输出
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_export(rows, export_format='ndjson', compress=False, stats=None, flush_bytes=None):
+    """把 export_rows() 的消息行编码为字节块：逐行编码，攒够 flush_bytes 后输出一块（gzip 时输出压缩后的块）"""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"unsupported export format: {export_format}")
+    stats = stats or ExportStats()
+    flush_bytes = flush_bytes or settings.CHAT_EXPORT_FLUSH_BYTES
+    encode_lines = _ndjson_lines if export_format == 'ndjson' else _csv_lines
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits=31：gzip 格式
+
+    def emit(data):
+        if compressor is not None:
+            data = compressor.compress(data)
+        stats.bytes += len(data)
+        return data
+
+    pending = []
+    pending_size = 0
+    try:
+        for line in encode_lines(_count_rows(rows, stats)):
+            data = line.encode('utf-8')
+            pending.append(data)
+            pending_size += len(data)
+            if pending_size >= flush_bytes:
+                block = emit(b''.join(pending))
+                pending, pending_size = [], 0
+                if block:
+                    yield block
+        tail = emit(b''.join(pending)) if pending else b''
+        if compressor is not None:
+            flushed = compressor.flush()
+            stats.bytes += len(flushed)
+            tail += flushed
+        if tail:
+            yield tail
+    finally:
+        stats.finish()
+        logger.info(f"Chat export {export_format}{'+gzip' if compress else ''}: {stats.as_dict()}")
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.archive import archive_inactive_conversations, available_codecs
+
+
+class Command(BaseCommand):
+    help = "压缩归档长期不活跃的对话（冷数据），输出进度与压缩比"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inactive-days', type=int, default=None, help='缺省取 CHAT_ARCHIVE_INACTIVE_DAYS')
+        parser.add_argument('--batch-size', type=int, default=None, help='每批处理的对话数，缺省取 CHAT_ARCHIVE_BATCH_SIZE')
+        parser.add_argument('--limit', type=int, default=None, help='本次最多归档的对话数')
+        parser.add_argument('--codec', choices=('zstd', 'zlib'), default=None, help='缺省取 CHAT_ARCHIVE_CODEC')
+        parser.add_argument('--dry-run', action='store_true', help='只统计候选对话与消息数，不归档')
+
+    def handle(self, *args, **options):
+        if options['codec'] and options['codec'] not in available_codecs():
+            raise CommandError(f"codec {options['codec']} is not available (pip install zstandard)")
+
+        def progress(stats):
+            self.stdout.write(
+                f"[{stats['processed']}/{stats['candidates']}] archived {stats['conversations']} conversations, "
+                f"{stats['messages']} messages, {stats['elapsed_s']}s"
+            )
+
+        stats = archive_inactive_conversations(
+            inactive_days=options['inactive_days'],
+            batch_size=options['batch_size'],
+            limit=options['limit'],
+            codec=options['codec'],
+            dry_run=options['dry_run'],
+            progress=progress,
+        )
+        if stats['dry_run']:
+            self.stdout.write(f"dry run: {stats['candidates']} conversations, {stats['messages']} messages would be archived")
+            return
+        saved = stats['raw_bytes'] - stats['compressed_bytes']
+        self.stdout.write(self.style.SUCCESS(
+            f"archived {stats['conversations']} conversations / {stats['messages']} messages with {stats['codec']}: "
+            f"{stats['raw_bytes']} -> {stats['compressed_bytes']} bytes "
+            f"(ratio {stats['ratio']}x, saved {saved} bytes) in {stats['elapsed_s']}s"
+        ))
@@ -0,0 +1,56 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.export import EXPORT_FORMATS, ExportStats, export_rows, iter_export, parse_bound
+
+
+class Command(BaseCommand):
+    help = "流式导出对话消息为 NDJSON/CSV（可选 gzip），内存占用与数据量无关"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-format', choices=EXPORT_FORMATS, default='ndjson')
+        parser.add_argument('--gzip', action='store_true', help='gzip 压缩输出')
+        parser.add_argument('--user', help='只导出该用户（用户名或ID）的消息')
+        parser.add_argument('--since', help='起始时间（含），ISO 日期或日期时间')
+        parser.add_argument('--until', help='结束时间（不含），ISO 日期或日期时间')
+        parser.add_argument('--chunk-size', type=int, default=None, help='每批读取行数，缺省取 CHAT_EXPORT_CHUNK_SIZE')
+        parser.add_argument('--output', '-o', default='-', help='输出文件路径，缺省为标准输出')
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_bound(options['since'])
+            until = parse_bound(options['until'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        user_id = None
+        if options['user']:
+            lookup = {'id': int(options['user'])} if options['user'].isdigit() else {'username': options['user']}
+            user_id = User.objects.filter(**lookup).values_list('id', flat=True).first()
+            if user_id is None:
+                raise CommandError(f"user not found: {options['user']}")
+
+        stats = ExportStats()
+        chunks = iter_export(
+            export_rows(user_id, since, until, chunk_size=options['chunk_size']),
+            options['output_format'],
+            compress=options['gzip'],
+            stats=stats,
+        )
+        if options['output'] == '-':
+            out = sys.stdout.buffer
+            for chunk in chunks:
+                out.write(chunk)
+            out.flush()
+        else:
+            with open(options['output'], 'wb') as out:
+                for chunk in chunks:
+                    out.write(chunk)
+
+        summary = stats.as_dict()
+        self.stderr.write(
+            f"exported {summary['rows']} rows, {summary['bytes']} bytes in {summary['elapsed_s']}s "
+            f"({summary['rows_per_sec']} rows/sec)"
+        )
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.13 on 2026-10-19 09:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_conversation_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationArchive',
+            fields=[
+                ('conversation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive', serialize=False, to='chat.conversation')),
+                ('codec', models.CharField(max_length=10)),
+                ('payload', models.BinaryField()),
+                ('message_count', models.IntegerField()),
+                ('raw_bytes', models.BigIntegerField()),
+                ('compressed_bytes', models.BigIntegerField()),
+                ('first_message_at', models.DateTimeField(null=True)),
+                ('last_message_at', models.DateTimeField(null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -6,9 +6,28 @@ class Conversation(models.Model):
     title = models.CharField(max_length=200, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # 滚动摘要：summary 覆盖到 summary_message_id（含）为止的消息，后台每隔N条消息增量更新
+    summary = models.TextField(blank=True, default='')
+    summary_message_id = models.BigIntegerField(null=True, blank=True)
+    summary_updated_at = models.DateTimeField(null=True, blank=True)
+    # 冷数据归档：非空表示消息已压缩移入 ConversationArchive，读取时透明解压
+    archived_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
 class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     role = models.CharField(max_length=10, choices=(('user','user'),('ai','ai')))
     content = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class ConversationArchive(models.Model):
+    """长期不活跃对话的压缩归档：整段对话的消息序列化后压缩为一个二进制块"""
+    conversation = models.OneToOneField(Conversation, on_delete=models.CASCADE, primary_key=True, related_name='archive')
+    codec = models.CharField(max_length=10)
+    payload = models.BinaryField()
+    message_count = models.IntegerField()
+    raw_bytes = models.BigIntegerField()
+    compressed_bytes = models.BigIntegerField()
+    first_message_at = models.DateTimeField(null=True)
+    last_message_at = models.DateTimeField(null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
@@ -1,5 +1,8 @@
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Conversation, Message
+from .models import Conversation, ConversationArchive, Message
+from .archive import archive_records, cache_archive_records, cached_archive_records
 
 class MessageSerializer(serializers.ModelSerializer):
   class Meta:
@@ -7,7 +10,93 @@ class MessageSerializer(serializers.ModelSerializer):
     fields = ['id', 'role', 'content', 'created_at']
 
 class ConversationSerializer(serializers.ModelSerializer):
-  messages = MessageSerializer(many=True, read_only=True)
+  messages = serializers.SerializerMethodField()
   class Meta:
     model = Conversation
-    fields = ['id', 'title', 'created_at', 'updated_at', 'messages']
\ No newline at end of file
+    fields = ['id', 'title', 'created_at', 'updated_at', 'messages']
+
+  def get_messages(self, instance):
+    if instance.archived_at is None:
+      return MessageSerializer(instance.messages.all(), many=True).data
+    # 已归档对话：消息在压缩归档中（不查询热表），读取时解压，返回格式与热数据一致
+    records = cached_archive_records(instance.id, instance.archived_at)
+    if records is None:
+      try:
+        archive = instance.archive
+      except ConversationArchive.DoesNotExist:
+        return []
+      records = archive_records(archive.payload, archive.codec)
+      cache_archive_records(instance.id, instance.archived_at, records)
+    messages = [
+      Message(id=msg_id, conversation_id=instance.id, role=role, content=content, created_at=created_at)
+      for msg_id, role, content, created_at in records
+    ]
+    return MessageSerializer(messages, many=True).data
+
+
+# === 只读快速序列化（FAST_SERIALIZATION）：基于 values() 直接构建字典，不实例化模型与字段对象 ===
+# 输出与 ConversationSerializer / MessageSerializer 完全一致
+
+MESSAGE_FIELDS = ('id', 'role', 'content', 'created_at')
+
+
+def format_datetime(value, tz=None):
+  """与 DRF DateTimeField 相同：转换到当前时区（tz，缺省为当前时区）后输出 ISO 8601，UTC 以 Z 结尾"""
+  if value is None:
+    return None
+  if settings.USE_TZ and value.utcoffset() is not None:
+    value = value.astimezone(tz or timezone.get_current_timezone())
+  value = value.isoformat()
+  if value.endswith('+00:00'):
+    value = value[:-6] + 'Z'
+  return value
+
+
+def message_dicts(rows, tz=None):
+  """(id, role, content, created_at) 行 → MessageSerializer 格式的字典列表"""
+  tz = tz or timezone.get_current_timezone()
+  return [
+    {'id': msg_id, 'role': role, 'content': content, 'created_at': format_datetime(created_at, tz)}
+    for msg_id, role, content, created_at in rows
+  ]
+
+
+def serialize_conversations(queryset):
+  """按 queryset 顺序序列化对话及其全部消息：热数据一次查询取回后按对话分组，已归档对话解压归档"""
+  # 当前时区只解析一次，避免每个时间字段都访问线程局部变量
+  tz = timezone.get_current_timezone()
+  conversations = list(queryset.values('id', 'title', 'created_at', 'updated_at', 'archived_at'))
+  messages = {conv['id']: [] for conv in conversations}
+  hot_ids = [conv['id'] for conv in conversations if conv['archived_at'] is None]
+  archived_at = {conv['id']: conv['archived_at'] for conv in conversations if conv['archived_at'] is not None}
+  if hot_ids:
+    rows = (
+      Message.objects.filter(conversation_id__in=hot_ids)
+      .order_by('id')
+      .values_list('conversation_id', *MESSAGE_FIELDS)
+    )
+    for conversation_id, *row in rows:
+      messages[conversation_id].append(row)
+  # 已归档对话优先使用进程内缓存的解压结果，只查询并解压未命中的归档
+  missing = []
+  for conversation_id, archived in archived_at.items():
+    records = cached_archive_records(conversation_id, archived)
+    if records is None:
+      missing.append(conversation_id)
+    else:
+      messages[conversation_id] = records
+  if missing:
+    archives = ConversationArchive.objects.filter(conversation_id__in=missing).values_list('conversation_id', 'codec', 'payload')
+    for conversation_id, codec, payload in archives:
+      messages[conversation_id] = archive_records(payload, codec)
+      cache_archive_records(conversation_id, archived_at[conversation_id], messages[conversation_id])
+  return [
+    {
+      'id': conv['id'],
+      'title': conv['title'],
+      'created_at': format_datetime(conv['created_at'], tz),
+      'updated_at': format_datetime(conv['updated_at'], tz),
+      'messages': message_dicts(messages[conv['id']], tz),
+    }
+    for conv in conversations
+  ]
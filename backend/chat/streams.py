@@ -0,0 +1,195 @@
+"""可恢复的流式回复
+
+每次流式回复分配一个 stream_id，由后台线程独立于客户端连接消费AI服务的流并持久化消息，
+事件按序号写入 Redis Stream（条数有上限并带TTL）。客户端断线后携带 Last-Event-ID
+（格式 "{stream_id}:{序号}"）重连，先回放错过的事件再继续实时推送，不会重新调用LLM。
+Redis 不可用时由调用方退回为直接推流。
+生成线程数固定（CHAT_STREAM_WORKERS），排队数有上限（CHAT_STREAM_MAX_QUEUE）：调用方先 reserve_producer()
+预留名额，名额已满时直接拒绝，而不是让新的流在线程池队列里等到客户端空闲超时。
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from config.renderers import dumps
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_producers = 0
+_producers_lock = threading.Lock()
+
+
+def reserve_producer():
+    """为一个回复预留生成名额（执行中 + 排队 ≤ WORKERS + MAX_QUEUE），已满时返回 False"""
+    global _producers
+    with _producers_lock:
+        if _producers >= settings.CHAT_STREAM_WORKERS + settings.CHAT_STREAM_MAX_QUEUE:
+            return False
+        _producers += 1
+        return True
+
+
+def release_producer():
+    global _producers
+    with _producers_lock:
+        _producers -= 1
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.CHAT_STREAM_WORKERS, thread_name_prefix="chat-stream")
+    return _executor
+
+
+def _redis():
+    from django_redis import get_redis_connection
+    return get_redis_connection("default")
+
+
+def format_event(event_type, data, event_id=None):
+    """SSE 帧：与原有 stream_chat 协议一致（data 为 {type, data} JSON，结束为 event: end），可附带事件ID"""
+    prefix = f"id: {event_id}\n" if event_id else ""
+    if event_type == 'end':
+        return f"{prefix}event: end\ndata: [DONE]\n\n"
+    return f"{prefix}data: {dumps({'type': event_type, 'data': data})}\n\n"
+
+
+def parse_last_event_id(value):
+    """解析 Last-Event-ID："{stream_id}:{序号}" → (stream_id, 序号)；非法时返回 (None, 0)"""
+    stream_id, _, seq = (value or '').rpartition(':')
+    if not stream_id or not seq.isdigit():
+        return None, 0
+    return stream_id, int(seq)
+
+
+class StreamBuffer:
+    """单个流式回复的 Redis 回放缓冲：事件流 + 已生成文本 + 元信息，三个键共享TTL"""
+
+    def __init__(self, stream_id, client=None):
+        self.stream_id = stream_id
+        self.client = client or _redis()
+        self.key = f"chat:stream:{stream_id}"
+        self.text_key = f"{self.key}:text"
+        self.meta_key = f"{self.key}:meta"
+        self.seq = 0
+        self.text_length = 0
+
+    def create(self, user_id, conversation_id):
+        ttl = settings.CHAT_STREAM_TTL
+        pipe = self.client.pipeline()
+        pipe.hset(self.meta_key, mapping={'user_id': user_id, 'conversation_id': conversation_id})
+        pipe.expire(self.meta_key, ttl)
+        pipe.execute()
+
+    def append(self, event_type, data):
+        self.seq += 1
+        fields = {'type': event_type, 'data': dumps(data)}
+        ttl = settings.CHAT_STREAM_TTL
+        pipe = self.client.pipeline()
+        if event_type == 'ai_chunk':
+            # 记录该块结束时的文本长度：回放缓冲被裁剪时据此生成准确的文本快照
+            self.text_length += len(data)
+            fields['offset'] = self.text_length
+            pipe.append(self.text_key, data)
+            pipe.expire(self.text_key, ttl)
+        # 显式ID "0-序号"：Last-Event-ID 的序号可直接作为 XREAD 起点
+        pipe.xadd(self.key, fields, id=f"0-{self.seq}", maxlen=settings.CHAT_STREAM_MAX_EVENTS, approximate=True)
+        pipe.expire(self.key, ttl)
+        pipe.expire(self.meta_key, ttl)
+        pipe.execute()
+
+    def meta(self):
+        meta = self.client.hgetall(self.meta_key)
+        return {k.decode(): int(v) for k, v in meta.items()} if meta else None
+
+    def read(self, after, block_ms):
+        """读取序号大于 after 的事件：[(序号, 类型, 数据, 文本偏移)]，无新事件时阻塞最多 block_ms"""
+        result = self.client.xread({self.key: f"0-{after}"}, count=500, block=block_ms)
+        events = []
+        for _key, entries in result or []:
+            for entry_id, fields in entries:
+                seq = int(entry_id.decode().split('-')[1])
+                offset = fields.get(b'offset')
+                events.append((seq, fields[b'type'].decode(), json.loads(fields[b'data']), int(offset) if offset else None))
+        return events
+
+    def text(self):
+        return (self.client.get(self.text_key) or b'').decode('utf-8', errors='ignore')
+
+
+def _produce(buffer, events):
+    """后台消费回复事件并写入缓冲；写缓冲失败也继续消费，保证回复被完整持久化"""
+    close_old_connections()
+    buffer_ok = True
+    try:
+        for event_type, data in events:
+            if not buffer_ok:
+                continue
+            try:
+                buffer.append(event_type, data)
+            except Exception as e:
+                buffer_ok = False
+                logger.error(f"Stream {buffer.stream_id} buffer write failed, continuing without replay: {e}")
+    except Exception as e:
+        logger.error(f"Stream {buffer.stream_id} producer failed: {e}")
+    finally:
+        connection.close()
+        release_producer()
+
+
+def start_stream(user_id, conversation_id, events):
+    """在后台开始生成并缓冲回复事件，返回 stream_id；Redis 不可用时返回 None（由调用方直接推流）
+
+    调用前须已通过 reserve_producer() 预留名额：返回 stream_id 时名额在生成结束后释放，返回 None 时由调用方释放。
+    """
+    stream_id = uuid.uuid4().hex
+    try:
+        buffer = StreamBuffer(stream_id)
+        buffer.create(user_id, conversation_id)
+    except Exception as e:
+        logger.warning(f"Stream buffer unavailable, streaming without resume support: {e}")
+        return None
+    _get_executor().submit(_produce, buffer, events)
+    return stream_id
+
+
+def iter_stream(stream_id, after=0, buffer=None):
+    """从缓冲中回放序号大于 after 的事件并继续实时推送，直到结束事件
+
+    缓冲已被裁剪（错过的事件不在缓冲中）时，先发送截至当前位置的完整文本快照（ai_snapshot）。
+    等待期间定期发送注释行保活；超过 CHAT_STREAM_IDLE_SECONDS 没有新事件则结束。
+    """
+    buffer = buffer or StreamBuffer(stream_id)
+    block_ms = int(settings.CHAT_STREAM_KEEPALIVE_SECONDS * 1000)
+    idle_since = time.monotonic()
+    while True:
+        events = buffer.read(after, block_ms)
+        if not events:
+            if time.monotonic() - idle_since > settings.CHAT_STREAM_IDLE_SECONDS:
+                logger.warning(f"Stream {stream_id} idle, closing at event {after}")
+                return
+            yield ": keepalive\n\n"
+            continue
+        idle_since = time.monotonic()
+        first_seq = events[0][0]
+        if first_seq > after + 1:
+            snapshot_offset = next((offset for _, event_type, _, offset in events if event_type == 'ai_chunk'), None)
+            text = buffer.text()
+            if snapshot_offset is not None:
+                # 快照截至第一个可回放的文本块之前，后续块照常推送
+                first_chunk = next(data for _, event_type, data, _ in events if event_type == 'ai_chunk')
+                text = text[:snapshot_offset - len(first_chunk)]
+            yield format_event('ai_snapshot', text, f"{stream_id}:{first_seq - 1}")
+        for seq, event_type, data, _offset in events:
+            after = seq
+            yield format_event(event_type, data, f"{stream_id}:{seq}")
+            if event_type == 'end':
+                return
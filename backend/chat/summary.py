@@ -0,0 +1,134 @@
+"""对话滚动摘要
+
+长对话每次请求只携带：滚动摘要 + 最近几条消息（受字符预算约束），而不是完整历史；
+摘要由后台任务每隔 N 条新消息增量更新（旧摘要 + 新增消息 → 新摘要），不阻塞用户请求。
+"""
+import logging
+import os
+import threading
+
+import httpx
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+AI_SERVICE_URL = os.getenv("AI_SERVICE_URL", "http://localhost:8002")
+AI_SERVICE_TOKEN = os.getenv("AI_SERVICE_TOKEN", "")
+
+
+def _as_history_item(msg):
+    return {
+        'role': 'assistant' if msg.role == 'ai' else msg.role,
+        'content': msg.content,
+    }
+
+
+def _unsummarized(conv):
+    qs = Message.objects.filter(conversation_id=conv.id)
+    if conv.summary_message_id:
+        qs = qs.filter(id__gt=conv.summary_message_id)
+    return qs
+
+
+def build_history(conv, exclude_id=None):
+    """返回 (摘要, 最近消息列表)
+
+    最近消息只取摘要之后的部分，最多 CONVERSATION_HISTORY_TAIL 条，
+    从新到旧累加直到超出 CONVERSATION_HISTORY_MAX_CHARS，最早的一条必要时截断。
+    """
+    tail_size = settings.CONVERSATION_HISTORY_TAIL
+    budget = settings.CONVERSATION_HISTORY_MAX_CHARS
+    qs = _unsummarized(conv)
+    if exclude_id is not None:
+        qs = qs.exclude(id=exclude_id)
+    recent = list(qs.order_by('-id')[:tail_size])
+
+    history = []
+    used = 0
+    for msg in recent:
+        remaining = budget - used
+        if remaining <= 0:
+            break
+        item = _as_history_item(msg)
+        if len(item['content']) > remaining:
+            item['content'] = item['content'][-remaining:]
+        used += len(item['content'])
+        history.append(item)
+    history.reverse()
+    return conv.summary, history
+
+
+def _lock_key(conversation_id):
+    return f"chat:summary:lock:{conversation_id}"
+
+
+def maybe_schedule_summary(conv):
+    """摘要之后的新消息数达到阈值时，在事务提交后调度后台摘要任务（同一对话同时只调度一个）"""
+    if not settings.CONVERSATION_SUMMARY_ENABLED:
+        return
+    threshold = settings.CONVERSATION_SUMMARY_EVERY + settings.CONVERSATION_HISTORY_TAIL
+    if _unsummarized(conv).count() < threshold:
+        return
+    try:
+        if not cache.add(_lock_key(conv.id), 1, timeout=settings.CONVERSATION_SUMMARY_LOCK_SECONDS):
+            return
+    except Exception as e:
+        # 缓存不可用时仍调度，最坏情况重复摘要一次，由乐观更新保证结果一致
+        logger.warning(f"Summary lock unavailable: {e}")
+    conversation_id = conv.id
+    transaction.on_commit(lambda: _dispatch(conversation_id))
+
+
+def _dispatch(conversation_id):
+    if settings.CONVERSATION_SUMMARY_ASYNC == 'celery':
+        try:
+            from .tasks import summarize_conversation
+            summarize_conversation.apply_async(args=[conversation_id], ignore_result=True)
+            return
+        except Exception as e:
+            logger.warning(f"Celery dispatch failed, summarizing in thread: {e}")
+    threading.Thread(target=update_summary, args=(conversation_id,), daemon=True).start()
+
+
+def update_summary(conversation_id):
+    """旧摘要 + 摘要之后、最近保留窗口之前的消息 → 新摘要"""
+    try:
+        conv = Conversation.objects.get(id=conversation_id)
+        pending = list(_unsummarized(conv).order_by('id'))
+        keep = settings.CONVERSATION_HISTORY_TAIL
+        to_fold = pending[:-keep] if keep else pending
+        if len(to_fold) < settings.CONVERSATION_SUMMARY_EVERY:
+            return
+
+        payload = {
+            "summary": conv.summary,
+            "messages": [_as_history_item(m) for m in to_fold],
+            "max_chars": settings.CONVERSATION_SUMMARY_MAX_CHARS,
+        }
+        headers = {'X-Request-Priority': 'batch', 'X-User-ID': str(conv.user_id)}
+        if AI_SERVICE_TOKEN:
+            headers['X-Internal-Token'] = AI_SERVICE_TOKEN
+        with httpx.Client(timeout=settings.CONVERSATION_SUMMARY_TIMEOUT) as client:
+            response = client.post(f"{AI_SERVICE_URL}/v1/summarize", json=payload, headers=headers)
+            response.raise_for_status()
+            summary = response.json().get('summary', '').strip()
+        if not summary:
+            return
+
+        # 乐观更新：期间已被其他任务推进则放弃；update() 不触发 auto_now，不影响对话排序
+        updated = Conversation.objects.filter(
+            id=conversation_id, summary_message_id=conv.summary_message_id
+        ).update(summary=summary, summary_message_id=to_fold[-1].id, summary_updated_at=timezone.now())
+        logger.info(f"Conversation {conversation_id} summary updated={bool(updated)} folded={len(to_fold)} chars={len(summary)}")
+    except Exception as e:
+        logger.error(f"Summarize conversation {conversation_id} failed: {e}")
+    finally:
+        try:
+            cache.delete(_lock_key(conversation_id))
+        except Exception:
+            pass
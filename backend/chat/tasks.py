@@ -0,0 +1,16 @@
+from celery import shared_task
+
+from .summary import update_summary
+
+
+@shared_task(ignore_result=True)
+def summarize_conversation(conversation_id):
+    """后台更新对话滚动摘要"""
+    update_summary(conversation_id)
+
+
+@shared_task(ignore_result=True)
+def archive_inactive_conversations():
+    """定时归档长期不活跃的对话"""
+    from .archive import archive_inactive_conversations as run_archive
+    run_archive()
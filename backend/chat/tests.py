@@ -0,0 +1,76 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .archive import append_message, archive_conversation, archive_inactive_conversations, archived_messages, rehydrate_conversation
+from .models import Conversation, ConversationArchive, Message
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ConversationArchiveTests(TestCase):
+    """冷热分层：归档/恢复保留消息ID与创建时间，只归档不活跃的对话"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+        self.conv = Conversation.objects.create(user=self.user, title='旧对话')
+        for i in range(3):
+            Message.objects.create(conversation=self.conv, role='user' if i % 2 == 0 else 'assistant', content=f'消息 {i}')
+        created_at = timezone.now() - timedelta(days=40)
+        for offset, msg in enumerate(self.conv.messages.order_by('id')):
+            Message.objects.filter(id=msg.id).update(created_at=created_at + timedelta(minutes=offset))
+        Conversation.objects.filter(id=self.conv.id).update(updated_at=created_at)
+        self.original = list(self.conv.messages.order_by('id').values_list('id', 'role', 'content', 'created_at'))
+
+    def test_archive_moves_messages_to_cold_storage(self):
+        archive = archive_conversation(self.conv.id, codec='zlib')
+
+        self.assertIsNotNone(archive)
+        self.assertFalse(Message.objects.filter(conversation=self.conv).exists())
+        self.conv.refresh_from_db()
+        self.assertIsNotNone(self.conv.archived_at)
+        self.assertEqual(archive.message_count, 3)
+        self.assertEqual(
+            [(m.id, m.role, m.content, m.created_at) for m in archived_messages(archive)],
+            self.original,
+        )
+        # 已归档的对话不会重复归档
+        self.assertIsNone(archive_conversation(self.conv.id, codec='zlib'))
+
+    def test_rehydrate_restores_original_ids_and_timestamps(self):
+        archive_conversation(self.conv.id, codec='zlib')
+        self.conv.refresh_from_db()
+
+        self.assertEqual(rehydrate_conversation(self.conv), 3)
+
+        self.assertEqual(list(self.conv.messages.order_by('id').values_list('id', 'role', 'content', 'created_at')), self.original)
+        self.assertFalse(ConversationArchive.objects.filter(conversation=self.conv).exists())
+        self.conv.refresh_from_db()
+        self.assertIsNone(self.conv.archived_at)
+
+    def test_append_to_archived_conversation_rehydrates_first(self):
+        archive_conversation(self.conv.id, codec='zlib')
+        # 持有归档前读取的对象：append_message 须重新读取归档状态
+        stale = Conversation.objects.get(id=self.conv.id)
+        stale.archived_at = None
+
+        msg = append_message(stale, 'user', '新消息')
+
+        ids = list(self.conv.messages.order_by('id').values_list('id', flat=True))
+        self.assertEqual(ids, [row[0] for row in self.original] + [msg.id])
+        self.assertGreater(msg.id, self.original[-1][0])
+        self.conv.refresh_from_db()
+        self.assertIsNone(self.conv.archived_at)
+        self.assertGreater(self.conv.updated_at, self.original[-1][3])
+
+    @override_settings(CHAT_ARCHIVE_INACTIVE_DAYS=30)
+    def test_archive_run_skips_active_conversations(self):
+        active = Conversation.objects.create(user=self.user, title='新对话')
+        Message.objects.create(conversation=active, role='user', content='你好')
+
+        stats = archive_inactive_conversations(codec='zlib')
+
+        self.assertEqual((stats['candidates'], stats['conversations'], stats['messages']), (1, 1, 3))
+        self.assertTrue(Message.objects.filter(conversation=active).exists())
+        self.assertFalse(Message.objects.filter(conversation=self.conv).exists())
@@ -1,7 +1,10 @@
 from rest_framework.routers import DefaultRouter
-from .views import ConversationViewSet
+from django.urls import path
+from .views import ConversationViewSet, export_messages
 
 router = DefaultRouter()
 router.register(r'conversations', ConversationViewSet, basename='conversation')
 
-urlpatterns = router.urls
\ No newline at end of file
+urlpatterns = [
+    path('export/', export_messages, name='chat-export'),
+] + router.urls
\ No newline at end of file
@@ -1,15 +1,180 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
+from django.conf import settings
 from django.http import StreamingHttpResponse
 from .models import Conversation, Message
-from .serializers import ConversationSerializer, MessageSerializer
+from .serializers import ConversationSerializer, MessageSerializer, serialize_conversations
+from .summary import build_history, maybe_schedule_summary
+from .archive import append_message
+from .streams import (
+    StreamBuffer,
+    format_event,
+    iter_stream,
+    parse_last_event_id,
+    release_producer,
+    reserve_producer,
+    start_stream,
+)
+from .export import CONTENT_TYPES, EXPORT_FORMATS, export_rows, iter_export, parse_bound
 import httpx
 import asyncio
 import json
 import os
+import time
+from config.streaming import streaming_content
+from config.metrics import (
+    AI_FALLBACKS,
+    AI_SERVICE_LATENCY,
+    AI_SERVICE_REJECTED,
+    AI_SERVICE_TTFT,
+    REQUEST_ID_HEADER,
+    SSE_DURATION,
+    STREAM_REJECTED,
+)
 
 AI_SERVICE_URL = os.getenv("AI_SERVICE_URL", "http://localhost:8002")
+# 与AI服务共享的内部令牌：AI服务只信任携带该令牌的请求中的 X-User-ID / X-Request-Priority
+AI_SERVICE_TOKEN = os.getenv("AI_SERVICE_TOKEN", "")
+
+
+def ai_service_headers(request):
+    """透传关联ID与用户ID：关联ID用于日志/指标对应，用户ID用于AI服务按用户限流（须附内部令牌才被信任）"""
+    headers = {}
+    if AI_SERVICE_TOKEN:
+        headers['X-Internal-Token'] = AI_SERVICE_TOKEN
+    request_id = getattr(request, 'request_id', None)
+    if request_id:
+        headers[REQUEST_ID_HEADER] = request_id
+    if request.user.is_authenticated:
+        headers['X-User-ID'] = str(request.user.id)
+    return headers
+
+
+# AI服务限流(429)/过载(503)：原样返回给客户端（附 Retry-After），不生成兜底回复
+BUSY_STATUSES = (429, 503)
+
+
+class AIServiceBusy(Exception):
+    def __init__(self, response):
+        super().__init__(f"AI service returned {response.status_code}")
+        self.status_code = response.status_code
+        self.retry_after = response.headers.get('Retry-After')
+        try:
+            self.detail = response.json().get('detail')
+        except Exception:
+            self.detail = None
+
+
+def busy_response(exc):
+    headers = {'Retry-After': exc.retry_after} if exc.retry_after else None
+    return Response({'detail': exc.detail or 'AI服务繁忙，请稍后重试'}, status=exc.status_code, headers=headers)
+
+
+def discard_turn(conv, user_msg, created):
+    """AI服务拒绝时撤销本轮：删除已保存的用户消息，本次新建的对话一并删除，客户端可原样重试"""
+    user_msg.delete()
+    if created:
+        conv.delete()
+
+
+def reply_payload(conv, user_msg, user_text, use_rag, temperature):
+    # 获取对话历史：滚动摘要 + 摘要之后的最近几条消息（不含当前消息）
+    summary, conversation_history = build_history(conv, exclude_id=user_msg.id)
+    return {
+        "text": user_text,
+        "conversation_history": conversation_history,
+        "summary": summary,
+        "use_rag": use_rag,
+        "temperature": temperature
+    }
+
+
+def open_reply_stream(payload, headers):
+    """在返回响应前打开AI服务的流式回复，返回 (client, response)
+
+    限流/过载时抛出 AIServiceBusy，由视图返回 429/503；连接失败等其他异常由调用方交给 reply_events 兜底。
+    """
+    client = httpx.Client(timeout=None)
+    try:
+        request = client.build_request("POST", f"{AI_SERVICE_URL}/v1/stream_echo", json=payload, headers=headers)
+        response = client.send(request, stream=True)
+        if response.status_code in BUSY_STATUSES:
+            response.read()
+            response.close()
+            raise AIServiceBusy(response)
+    except Exception:
+        client.close()
+        raise
+    return client, response
+
+
+def reply_events(conv, user_msg, user_text, upstream):
+    """流式回复事件 (类型, 数据)：会话信息、AI文本块、持久化后的AI消息、结束；AI服务异常时返回离线兜底
+
+    upstream 为 open_reply_stream 的结果，打开失败时为对应的异常。
+    """
+    ai_content = ""
+    stream_started = time.perf_counter()
+    first_chunk = True
+    try:
+        # 发送会话开始信息
+        yield 'conversation_id', conv.id
+        yield 'user_message', MessageSerializer(user_msg).data
+        if isinstance(upstream, Exception):
+            raise upstream
+
+        client, response = upstream
+        try:
+            response.raise_for_status()
+            for raw_line in response.iter_lines():
+                if not raw_line:
+                    continue
+                line = raw_line.strip()
+                if line.startswith("data: "):
+                    chunk = line[6:]
+                    if first_chunk:
+                        AI_SERVICE_TTFT.observe(time.perf_counter() - stream_started)
+                        first_chunk = False
+                    ai_content += chunk
+                    yield 'ai_chunk', chunk
+                elif line.startswith("event: end"):
+                    AI_SERVICE_LATENCY.labels(endpoint='stream_echo', outcome='ok').observe(time.perf_counter() - stream_started)
+                    # 完整消息持久化
+                    ai_msg = append_message(conv, 'ai', ai_content)
+                    maybe_schedule_summary(conv)
+                    yield 'ai_message', MessageSerializer(ai_msg).data
+                    yield 'end', None
+                    break
+        finally:
+            response.close()
+            client.close()
+    except Exception as e:
+        # 流式兜底：直接返回简要离线内容并结束
+        AI_FALLBACKS.labels(endpoint='stream_chat').inc()
+        fallback = '1+1等于2。这是一个基本的数学加法运算。（离线兜底）' if ('1+1' in user_text or '加法' in user_text or '等于' in user_text) else f"抱歉，当前AI服务异常（{str(e)}），已返回离线兜底简要答复。"
+        ai_msg = append_message(conv, 'ai', fallback)
+        yield 'ai_message', MessageSerializer(ai_msg).data
+        yield 'end', None
+
+
+def sse_response(request, frames):
+    """SSE 响应；ASGI 部署下逐帧发送（config.streaming），否则 Django 会在发送前读完整个流"""
+    def timed_frames():
+        stream_started = time.perf_counter()
+        try:
+            yield from frames
+        finally:
+            SSE_DURATION.labels(endpoint='stream_chat').observe(time.perf_counter() - stream_started)
+
+    return StreamingHttpResponse(
+        streaming_content(request, timed_frames()),
+        content_type='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        }
+    )
 
 class IsOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
@@ -24,11 +189,27 @@ class ConversationViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated, IsOwner]
 
     def get_queryset(self):
-        return Conversation.objects.filter(user=self.request.user).order_by('-updated_at')
+        queryset = Conversation.objects.filter(user=self.request.user).order_by('-updated_at')
+        if self.action in ('list', 'retrieve') and not settings.FAST_SERIALIZATION:
+            # ConversationSerializer：归档随对话 JOIN 取回，热消息一次预取，避免逐个对话查询
+            queryset = queryset.select_related('archive').prefetch_related('messages')
+        return queryset
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def list(self, request, *args, **kwargs):
+        # 快速序列化：基于 values() 构建响应，消息一次查询取回（未启用分页时）
+        if not settings.FAST_SERIALIZATION or self.paginator is not None:
+            return super().list(request, *args, **kwargs)
+        return Response(serialize_conversations(self.filter_queryset(self.get_queryset())))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not settings.FAST_SERIALIZATION:
+            return super().retrieve(request, *args, **kwargs)
+        conv = self.get_object()
+        return Response(serialize_conversations(Conversation.objects.filter(pk=conv.pk))[0])
+
     @action(detail=True, methods=['post'])
     def add_message(self, request, pk=None):
         conv = self.get_object()
@@ -36,9 +217,8 @@ class ConversationViewSet(viewsets.ModelViewSet):
         content = request.data.get('content', '')
         if role not in ['user','ai']:
             return Response({'detail': 'role must be user|ai'}, status=status.HTTP_400_BAD_REQUEST)
-        msg = Message.objects.create(conversation=conv, role=role, content=content)
-        # 更新会话更新时间，便于按最近活动排序
-        conv.save()  # auto_now=True 的 updated_at 会在保存时更新
+        # 同时更新会话更新时间，便于按最近活动排序
+        msg = append_message(conv, role, content)
         return Response(MessageSerializer(msg).data)
 
     @action(detail=False, methods=['post'])
@@ -55,6 +235,7 @@ class ConversationViewSet(viewsets.ModelViewSet):
             return Response({'detail': 'text is required'}, status=status.HTTP_400_BAD_REQUEST)
         
         # 获取或创建对话
+        created = not conversation_id
         if conversation_id:
             try:
                 conv = Conversation.objects.get(id=conversation_id, user=request.user)
@@ -63,50 +244,58 @@ class ConversationViewSet(viewsets.ModelViewSet):
         else:
             conv = Conversation.objects.create(user=request.user, title='新对话')
         
-        # 保存用户消息
-        user_msg = Message.objects.create(conversation=conv, role='user', content=user_text)
+        # 保存用户消息（锁住对话行，已归档对话先恢复到热表）
+        user_msg = append_message(conv, 'user', user_text)
         
         # 更新对话标题（如果是默认）
         if conv.title in ['新对话', '']:
             conv.title = user_text[:20] if user_text else '新对话'
-            conv.save()
+            conv.save(update_fields=['title', 'updated_at'])
         
         ai_text = ''
         try:
-            # 获取对话历史
-            conversation_history = []
-            recent_msgs = conv.messages.order_by('-created_at')[:10]
-            for msg in reversed(list(recent_msgs)):
-                 conversation_history.append({
-                     'role': 'assistant' if msg.role == 'ai' else msg.role,
-                     'content': msg.content
-                 })
+            # 获取对话历史：滚动摘要 + 摘要之后的最近几条消息（不含当前消息）
+            summary, conversation_history = build_history(conv, exclude_id=user_msg.id)
             
             # 调用AI服务 - 使用新协议
             payload = {
                 "text": user_text,
                 "conversation_history": conversation_history,
+                "summary": summary,
                 "use_rag": use_rag,
                 "temperature": temperature
             }
-            with httpx.Client(timeout=30) as client:
-                response = client.post(f"{AI_SERVICE_URL}/v1/echo", json=payload)
-                response.raise_for_status()
-                ai_data = response.json()
+            ai_started = time.perf_counter()
+            try:
+                with httpx.Client(timeout=30) as client:
+                    response = client.post(f"{AI_SERVICE_URL}/v1/echo", json=payload, headers=ai_service_headers(request))
+                    if response.status_code in BUSY_STATUSES:
+                        raise AIServiceBusy(response)
+                    response.raise_for_status()
+                    ai_data = response.json()
+            except Exception:
+                AI_SERVICE_LATENCY.labels(endpoint='echo', outcome='error').observe(time.perf_counter() - ai_started)
+                raise
+            AI_SERVICE_LATENCY.labels(endpoint='echo', outcome='ok').observe(time.perf_counter() - ai_started)
             
             ai_text = ai_data.get('response') or ai_data.get('reply') or ''
             if not ai_text:
                 ai_text = 'AI服务未返回内容'
+        except AIServiceBusy as e:
+            AI_SERVICE_REJECTED.labels(endpoint='send_message', status=str(e.status_code)).inc()
+            discard_turn(conv, user_msg, created)
+            return busy_response(e)
         except Exception as e:
             # 兜底：当AI服务不可用或报错时，返回离线简要答复，避免前端无响应
+            AI_FALLBACKS.labels(endpoint='send_message').inc()
             if '1+1' in user_text or '加法' in user_text or '等于' in user_text:
                 ai_text = '1+1等于2。这是一个基本的数学加法运算。（离线兜底）'
             else:
                 ai_text = f"抱歉，当前AI服务不可用或异常（{str(e)}），已返回离线兜底回复：您刚才问的是“{user_text}”。"
         
         # 保存AI消息并返回成功响应
-        ai_msg = Message.objects.create(conversation=conv, role='ai', content=ai_text)
-        conv.save()  # 更新时间戳
+        ai_msg = append_message(conv, 'ai', ai_text)
+        maybe_schedule_summary(conv)
         
         return Response({
             'conversation_id': conv.id,
@@ -126,8 +315,30 @@ class ConversationViewSet(viewsets.ModelViewSet):
         
         if not user_text:
             return Response({'detail': 'text is required'}, status=status.HTTP_400_BAD_REQUEST)
-        
+
+        # 后台生成线程与排队名额已满：在保存任何内容前直接拒绝
+        reserved = settings.CHAT_STREAM_RESUMABLE and reserve_producer()
+        if settings.CHAT_STREAM_RESUMABLE and not reserved:
+            STREAM_REJECTED.inc()
+            return Response(
+                {'detail': '当前流式回复过多，请稍后重试'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(settings.CHAT_STREAM_RETRY_AFTER)},
+            )
+        try:
+            response = self._start_stream_chat(request, user_text, conversation_id, use_rag, temperature)
+        except Exception:
+            if reserved:
+                release_producer()
+            raise
+        if reserved and not response.has_header('X-Stream-ID'):
+            # 未交给后台生成（出错、被AI服务拒绝或已退回直接推流）时归还名额
+            release_producer()
+        return response
+
+    def _start_stream_chat(self, request, user_text, conversation_id, use_rag, temperature):
         # 获取或创建对话
+        created = not conversation_id
         if conversation_id:
             try:
                 conv = Conversation.objects.get(id=conversation_id, user=request.user)
@@ -136,67 +347,88 @@ class ConversationViewSet(viewsets.ModelViewSet):
         else:
             conv = Conversation.objects.create(user=request.user, title='新对话')
         
-        # 保存用户消息
-        user_msg = Message.objects.create(conversation=conv, role='user', content=user_text)
+        # 保存用户消息（锁住对话行，已归档对话先恢复到热表）
+        user_msg = append_message(conv, 'user', user_text)
         
         # 更新对话标题（如果是默认）
         if conv.title in ['新对话', '']:
             conv.title = user_text[:20] if user_text else '新对话'
-            conv.save()
-        
-        def stream_generator():
-            ai_content = ""
-            try:
-                # 发送会话开始信息
-                yield f"data: {json.dumps({'type': 'conversation_id', 'data': conv.id})}\n\n"
-                yield f"data: {json.dumps({'type': 'user_message', 'data': MessageSerializer(user_msg).data})}\n\n"
-                
-                # 获取对话历史，构造查询参数
-                conversation_history = []
-                recent_msgs = conv.messages.order_by('-created_at')[:10]  # 最近10条（按时间倒序）
-                for msg in reversed(list(recent_msgs)):  # 再反转为时间正序
-                     conversation_history.append({
-                         'role': 'assistant' if msg.role == 'ai' else msg.role,
-                         'content': msg.content
-                     })
-                
-                with httpx.Client(timeout=None) as client:
-                    params = {
-                        "text": user_text, 
-                        "use_rag": use_rag,
-                        "temperature": temperature
-                    }
-                    # 注意：流式接口目前不支持conversation_history参数，需要AI服务更新
-                    with client.stream("GET", f"{AI_SERVICE_URL}/v1/stream_echo", params=params) as response:
-                        response.raise_for_status()
-                        for raw_line in response.iter_lines():
-                            if not raw_line:
-                                continue
-                            line = raw_line.strip()
-                            if line.startswith("data: "):
-                                chunk = line[6:]
-                                ai_content += chunk
-                                yield f"data: {json.dumps({'type': 'ai_chunk', 'data': chunk})}\n\n"
-                            elif line.startswith("event: end"):
-                                # 完整消息持久化
-                                ai_msg = Message.objects.create(conversation=conv, role='ai', content=ai_content)
-                                conv.save()
-                                yield f"data: {json.dumps({'type': 'ai_message', 'data': MessageSerializer(ai_msg).data})}\n\n"
-                                yield f"event: end\ndata: [DONE]\n\n"
-                                break
-            except Exception as e:
-                # 流式兜底：直接返回简要离线内容并结束
-                fallback = '1+1等于2。这是一个基本的数学加法运算。（离线兜底）' if ('1+1' in user_text or '加法' in user_text or '等于' in user_text) else f"抱歉，当前AI服务异常（{str(e)}），已返回离线兜底简要答复。"
-                ai_msg = Message.objects.create(conversation=conv, role='ai', content=fallback)
-                conv.save()
-                yield f"data: {json.dumps({'type': 'ai_message', 'data': MessageSerializer(ai_msg).data})}\n\n"
-                yield f"event: end\ndata: [DONE]\n\n"
+            conv.save(update_fields=['title', 'updated_at'])
         
-        return StreamingHttpResponse(
-            stream_generator(),
-            content_type='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'X-Accel-Buffering': 'no',
-            }
-        )
\ No newline at end of file
+        payload = reply_payload(conv, user_msg, user_text, use_rag, temperature)
+        try:
+            upstream = open_reply_stream(payload, ai_service_headers(request))
+        except AIServiceBusy as e:
+            AI_SERVICE_REJECTED.labels(endpoint='stream_chat', status=str(e.status_code)).inc()
+            discard_turn(conv, user_msg, created)
+            return busy_response(e)
+        except Exception as e:
+            upstream = e
+        events = reply_events(conv, user_msg, user_text, upstream)
+        # 回复在后台生成并写入回放缓冲，客户端断线后可通过 stream_resume 续传；缓冲不可用时直接推流
+        stream_id = start_stream(request.user.id, conv.id, events) if settings.CHAT_STREAM_RESUMABLE else None
+        if stream_id:
+            response = sse_response(request, iter_stream(stream_id))
+            response['X-Stream-ID'] = stream_id
+            return response
+        return sse_response(request, (format_event(event_type, data) for event_type, data in events))
+
+    @action(detail=False, methods=['get'])
+    def stream_resume(self, request):
+        """
+        续传流式回复：携带 Last-Event-ID 请求头（或 last_event_id 参数，格式 "{stream_id}:{序号}"）
+        回放错过的事件后继续实时推送，不会重新生成回复
+        """
+        last_event_id = request.headers.get('Last-Event-ID') or request.query_params.get('last_event_id', '')
+        stream_id, after = parse_last_event_id(last_event_id)
+        stream_id = stream_id or request.query_params.get('stream_id')
+        if not stream_id:
+            return Response({'detail': 'Last-Event-ID or stream_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            buffer = StreamBuffer(stream_id)
+            meta = buffer.meta()
+        except Exception:
+            return Response({'detail': 'Stream replay unavailable'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        if not meta or meta.get('user_id') != request.user.id:
+            # 已过期（回复已持久化，可直接重新加载对话）或不属于当前用户
+            return Response({'detail': 'Stream not found or expired'}, status=status.HTTP_404_NOT_FOUND)
+        return sse_response(request, iter_stream(stream_id, after, buffer))
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def export_messages(request):
+    """
+    流式导出消息：?output_format=ndjson|csv&gzip=1&since=2024-01-01&until=2024-02-01
+    普通用户只能导出自己的消息，管理员可通过 user_id 指定用户（缺省导出全部）
+    """
+    export_format = request.query_params.get('output_format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return Response({'detail': f'output_format must be one of {"|".join(EXPORT_FORMATS)}'}, status=status.HTTP_400_BAD_REQUEST)
+    compress = request.query_params.get('gzip', '').lower() in ('1', 'true')
+    try:
+        since = parse_bound(request.query_params.get('since'))
+        until = parse_bound(request.query_params.get('until'))
+    except ValueError as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if request.user.is_staff:
+        user_id = request.query_params.get('user_id')
+        if user_id is not None and not user_id.isdigit():
+            return Response({'detail': 'user_id must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        user_id = int(user_id) if user_id is not None else None
+    else:
+        user_id = request.user.id
+
+    filename = f"messages.{export_format}{'.gz' if compress else ''}"
+    # gzip 以文件形式下载，不声明 Content-Encoding，避免客户端自动解压
+    content_type = 'application/gzip' if compress else CONTENT_TYPES[export_format] + '; charset=utf-8'
+    # ASGI 部署下逐块生成并发送（见 config.streaming），内存占用与导出量无关
+    return StreamingHttpResponse(
+        streaming_content(request, iter_export(export_rows(user_id, since, until), export_format, compress)),
+        content_type=content_type,
+        headers={
+            'Content-Disposition': f'attachment; filename="{filename}"',
+            'X-Accel-Buffering': 'no',
+        }
+    )
@@ -0,0 +1,71 @@
+"""Prometheus 指标定义与 /metrics 视图
+
+多进程部署（gunicorn 多 worker）时设置 PROMETHEUS_MULTIPROC_DIR，由 MultiProcessCollector 汇总各进程指标。
+/metrics 不对公网开放：配置了 METRICS_TOKEN 时须携带 Authorization: Bearer 令牌，未配置时只允许
+未经 nginx 转发的内网/本机地址访问。
+"""
+import hmac
+import ipaddress
+import os
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_LATENCY = Histogram(
+    "django_http_request_duration_seconds", "Django HTTP请求耗时", ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+DB_QUERIES = Histogram(
+    "django_db_queries_per_request", "每个请求的数据库查询次数", ["route"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+)
+DB_QUERY_LATENCY = Histogram(
+    "django_db_query_duration_seconds", "单条数据库查询耗时", buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)
+)
+AI_SERVICE_LATENCY = Histogram(
+    "chat_ai_service_duration_seconds", "调用AI服务耗时", ["endpoint", "outcome"], buckets=LATENCY_BUCKETS
+)
+AI_SERVICE_TTFT = Histogram(
+    "chat_ai_service_first_chunk_seconds", "AI服务流式接口首个数据块延迟", buckets=LATENCY_BUCKETS
+)
+SSE_DURATION = Histogram(
+    "chat_sse_stream_duration_seconds", "SSE流持续时长", ["endpoint"], buckets=LATENCY_BUCKETS
+)
+STREAM_REJECTED = Counter("chat_stream_rejected_total", "回复生成线程与排队名额已满被拒绝(503)的流式回复数")
+AI_FALLBACKS = Counter("chat_ai_fallbacks_total", "AI服务不可用时返回离线兜底的次数", ["endpoint"])
+AI_SERVICE_REJECTED = Counter("chat_ai_rejected_total", "AI服务限流/过载(429/503)并原样返回客户端的次数", ["endpoint", "status"])
+
+
+def metrics_allowed(request):
+    """配置了 METRICS_TOKEN 时校验 Bearer 令牌；未配置时只允许直连（无 X-Real-IP / X-Forwarded-For）的内网或本机地址"""
+    if settings.METRICS_TOKEN:
+        auth = request.headers.get("Authorization", "")
+        return auth.startswith("Bearer ") and hmac.compare_digest(auth[len("Bearer "):], settings.METRICS_TOKEN)
+    if "X-Real-IP" in request.headers or "X-Forwarded-For" in request.headers:
+        return False
+    try:
+        return ipaddress.ip_address(request.META.get("REMOTE_ADDR", "")).is_private
+    except ValueError:
+        return False
+
+
+def metrics_view(request):
+    if not metrics_allowed(request):
+        return HttpResponseForbidden("metrics are only available to internal scrapers")
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
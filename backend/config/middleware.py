@@ -0,0 +1,42 @@
+import time
+import uuid
+
+from django.db import connection
+
+from .metrics import DB_QUERIES, DB_QUERY_LATENCY, REQUEST_ID_HEADER, REQUEST_LATENCY
+
+
+class RequestMetricsMiddleware:
+    """请求耗时、数据库查询次数指标，以及关联ID（X-Request-ID）的生成与回写
+
+    关联ID挂在 request.request_id 上，由视图透传给AI服务，便于按阶段拆解一次慢对话。
+    流式响应在生成器中执行的查询不计入本请求的查询次数。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        queries = []
+
+        def count_queries(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                elapsed = time.perf_counter() - started
+                queries.append(elapsed)
+                DB_QUERY_LATENCY.observe(elapsed)
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, "resolver_match", None)
+        route = match.route if match is not None and match.route else "unmatched"
+        REQUEST_LATENCY.labels(method=request.method, route=route, status=str(response.status_code)).observe(elapsed)
+        DB_QUERIES.labels(route=route).observe(len(queries))
+        response[REQUEST_ID_HEADER] = request.request_id
+        return response
@@ -0,0 +1,366 @@
+"""按需请求剖析（PROFILING_ENABLED=true 时安装中间件，关闭时没有任何开销）
+
+被选中的请求（X-Profile 请求头携带 PROFILING_TOKEN，或按 PROFILING_SAMPLE_RATE 抽样）记录：
+- 调用树：后台线程按 PROFILING_INTERVAL_MS 采样处理请求的线程调用栈，样本数按比例折算为墙钟耗时
+- SQL：每条查询的语句与耗时（connection.execute_wrapper）
+- 外部 HTTP：经 httpx 发出的请求（方法、URL、状态码、收到响应头的耗时）
+流式响应在响应体迭代完毕后结束剖析。剖析结果以 JSON 写入 PROFILING_DIR（保留最近 PROFILING_MAX_FILES 个），
+响应头 X-Profile-ID 返回剖析ID，管理员通过 /api/profiles/ 查看。
+"""
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from functools import lru_cache
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-ID"
+PROFILE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+current_profile = ContextVar("current_profile", default=None)
+
+
+@lru_cache(maxsize=4096)
+def _short_path(filename):
+    """去掉 sys.path 前缀，调用树中只显示模块相对路径"""
+    for prefix in sorted((p for p in sys.path if p), key=len, reverse=True):
+        if filename.startswith(prefix.rstrip(os.sep) + os.sep):
+            return filename[len(prefix.rstrip(os.sep)) + 1:]
+    return filename
+
+
+class StackSampler:
+    """后台线程按固定间隔抓取目标线程的调用栈，按函数汇总为调用树"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self._root = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{getattr(code, 'co_qualname', code.co_name)} ({_short_path(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if not stack:
+                continue
+            self.samples += 1
+            node = self._root
+            for name in reversed(stack):
+                entry = node.setdefault(name, [0, {}])
+                entry[0] += 1
+                node = entry[1]
+
+    def call_tree(self, wall_ms):
+        """调用树：[{name, samples, ms, children}]，ms 为样本占比 × 请求墙钟耗时"""
+        ms_per_sample = wall_ms / self.samples if self.samples else 0.0
+
+        def build(nodes):
+            return [
+                {"name": name, "samples": count, "ms": round(count * ms_per_sample, 2), "children": build(children)}
+                for name, (count, children) in sorted(nodes.items(), key=lambda item: -item[1][0])
+            ]
+
+        return build(self._root)
+
+
+class RequestProfile:
+    def __init__(self, trigger):
+        self.id = uuid.uuid4().hex
+        self.trigger = trigger
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.sql = []
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.http = []
+        self.sampler = StackSampler(threading.get_ident(), settings.PROFILING_INTERVAL_MS / 1000.0).start()
+
+    def sql_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        error = None
+        try:
+            return execute(sql, params, many, context)
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.sql_count += 1
+            self.sql_seconds += elapsed
+            if len(self.sql) < settings.PROFILING_MAX_QUERIES:
+                self.sql.append({"sql": sql, "many": many, "ms": round(elapsed * 1000, 3), "error": error})
+
+    def record_http(self, method, url, status, seconds, error=None):
+        self.http.append({"method": method, "url": url, "status": status, "ms": round(seconds * 1000, 3), "error": error})
+
+    def finish(self, request, status):
+        self.sampler.stop()
+        wall_ms = (time.perf_counter() - self._started) * 1000
+        return {
+            "id": self.id,
+            "service": "django",
+            "trigger": self.trigger,
+            "request_id": getattr(request, "request_id", None),
+            "method": request.method,
+            "path": request.get_full_path(),
+            "status": status,
+            "started_at": self.started_at,
+            "wall_ms": round(wall_ms, 3),
+            "sample_interval_ms": settings.PROFILING_INTERVAL_MS,
+            "samples": self.sampler.samples,
+            "sql_count": self.sql_count,
+            "sql_ms": round(self.sql_seconds * 1000, 3),
+            "http_count": len(self.http),
+            "http_ms": round(sum(call["ms"] for call in self.http), 3),
+            "sql": self.sql,
+            "http": self.http,
+            "call_tree": self.sampler.call_tree(wall_ms),
+        }
+
+
+SUMMARY_FIELDS = (
+    "id", "service", "trigger", "request_id", "method", "path", "status", "started_at", "wall_ms",
+    "samples", "sql_count", "sql_ms", "http_count", "http_ms",
+)
+
+
+class ProfileStore:
+    """剖析结果目录：每个请求一个 JSON 文件（文件名以毫秒时间戳开头），超出上限时删除最旧的"""
+
+    def __init__(self, directory, max_files):
+        self.directory = Path(directory)
+        self.max_files = max_files
+
+    def _files(self):
+        return sorted(self.directory.glob("*.json"), reverse=True) if self.directory.exists() else []
+
+    def save(self, profile):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{int(profile['started_at'] * 1000)}-{profile['id']}.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(profile, ensure_ascii=False, default=str), encoding="utf-8")
+        os.replace(tmp, path)
+        for old in self._files()[self.max_files:]:
+            old.unlink(missing_ok=True)
+        return path
+
+    def list(self, limit=50):
+        """最近的剖析摘要（新的在前）"""
+        summaries = []
+        for path in self._files()[:limit]:
+            try:
+                profile = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            summaries.append({field: profile.get(field) for field in SUMMARY_FIELDS})
+        return summaries
+
+    def get(self, profile_id):
+        if not PROFILE_ID_PATTERN.match(profile_id or ""):
+            return None
+        for path in self.directory.glob(f"*-{profile_id}.json"):
+            return json.loads(path.read_text(encoding="utf-8"))
+        return None
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = ProfileStore(settings.PROFILING_DIR, settings.PROFILING_MAX_FILES)
+    return _store
+
+
+def install_httpx_hook():
+    """包装 httpx.Client/AsyncClient.send：当前上下文有进行中的剖析时记录外部 HTTP 调用，否则直接透传"""
+    try:
+        import httpx
+    except ImportError:
+        return
+    if getattr(httpx.Client.send, "_profiled", False):
+        return
+    sync_send = httpx.Client.send
+    async_send = httpx.AsyncClient.send
+
+    def send(self, request, *args, **kwargs):
+        profile = current_profile.get()
+        if profile is None:
+            return sync_send(self, request, *args, **kwargs)
+        started = time.perf_counter()
+        status, error = None, None
+        try:
+            response = sync_send(self, request, *args, **kwargs)
+            status = response.status_code
+            return response
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            profile.record_http(request.method, str(request.url), status, time.perf_counter() - started, error)
+
+    async def send_async(self, request, *args, **kwargs):
+        profile = current_profile.get()
+        if profile is None:
+            return await async_send(self, request, *args, **kwargs)
+        started = time.perf_counter()
+        status, error = None, None
+        try:
+            response = await async_send(self, request, *args, **kwargs)
+            status = response.status_code
+            return response
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            profile.record_http(request.method, str(request.url), status, time.perf_counter() - started, error)
+
+    send._profiled = True
+    httpx.Client.send = send
+    httpx.AsyncClient.send = send_async
+
+
+def select_trigger(header_value):
+    """请求是否需要剖析：携带正确令牌的 X-Profile 头（header）或命中抽样（sample），否则返回 None"""
+    token = settings.PROFILING_TOKEN
+    if header_value and token and hmac.compare_digest(header_value, token):
+        return "header"
+    if settings.PROFILING_SAMPLE_RATE > 0 and random.random() < settings.PROFILING_SAMPLE_RATE:
+        return "sample"
+    return None
+
+
+class ProfilingMiddleware:
+    """对被选中的请求记录调用树、SQL 与外部 HTTP 调用；未选中的请求只多一次请求头读取与随机数判断"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install_httpx_hook()
+
+    def __call__(self, request):
+        trigger = select_trigger(request.headers.get(PROFILE_HEADER))
+        if trigger is None:
+            return self.get_response(request)
+
+        profile = RequestProfile(trigger)
+        token = current_profile.set(profile)
+        try:
+            with connection.execute_wrapper(profile.sql_wrapper):
+                response = self.get_response(request)
+        except Exception:
+            self._save(profile, request, 500)
+            raise
+        finally:
+            current_profile.reset(token)
+
+        response[PROFILE_ID_HEADER] = profile.id
+        if response.streaming and response.is_async:
+            response.streaming_content = self._profiled_async_stream(profile, request, response, response.streaming_content)
+        elif response.streaming:
+            response.streaming_content = self._profiled_stream(profile, request, response, response.streaming_content)
+        else:
+            self._save(profile, request, response.status_code)
+        return response
+
+    def _profiled_stream(self, profile, request, response, content):
+        """逐块迭代原响应体：每块都在剖析上下文中生成（可能换线程，采样目标随之切换），迭代结束后保存"""
+        iterator = iter(content)
+        try:
+            while True:
+                profile.sampler.thread_id = threading.get_ident()
+                token = current_profile.set(profile)
+                try:
+                    with connection.execute_wrapper(profile.sql_wrapper):
+                        chunk = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    current_profile.reset(token)
+                yield chunk
+        finally:
+            if hasattr(content, "close"):
+                content.close()
+            self._save(profile, request, response.status_code)
+
+    async def _profiled_async_stream(self, profile, request, response, content):
+        """ASGI 异步响应体：各块在请求线程中生成（config.streaming），在该线程的数据库连接上记录 SQL，迭代结束后保存"""
+        def attach():
+            profile.sampler.thread_id = threading.get_ident()
+            connection.execute_wrappers.append(profile.sql_wrapper)
+
+        def detach():
+            if profile.sql_wrapper in connection.execute_wrappers:
+                connection.execute_wrappers.remove(profile.sql_wrapper)
+            self._save(profile, request, response.status_code)
+
+        token = current_profile.set(profile)
+        await sync_to_async(attach)()
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            current_profile.reset(token)
+            await sync_to_async(detach)()
+
+    def _save(self, profile, request, status):
+        try:
+            result = profile.finish(request, status)
+            get_store().save(result)
+            logger.info(f"Request profiled: {result['method']} {result['path']} {result['wall_ms']:.1f}ms "
+                        f"sql={result['sql_count']} http={result['http_count']} id={result['id']}")
+        except Exception as e:
+            logger.error(f"Failed to save request profile {profile.id}: {e}")
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def profile_list(request):
+    """最近的请求剖析摘要（?limit=，默认50）"""
+    try:
+        limit = max(1, min(int(request.query_params.get("limit", 50)), settings.PROFILING_MAX_FILES))
+    except ValueError:
+        return Response({"detail": "limit 必须为整数"}, status=400)
+    return Response({"profiles": get_store().list(limit)})
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def profile_detail(request, profile_id):
+    """单个请求剖析的完整内容（调用树、SQL、外部 HTTP 调用）"""
+    profile = get_store().get(profile_id)
+    if profile is None:
+        return Response({"detail": "剖析不存在"}, status=404)
+    return Response(profile)
@@ -0,0 +1,62 @@
+"""基于 orjson 的快速 JSON 渲染/解析（FAST_SERIALIZATION=true 时启用）
+
+orjson 为可选依赖：未安装时渲染器、解析器与 dumps() 均回退到标准库 json，行为与 DRF 默认一致。
+datetime 等 orjson 原生类型交给 DRF 的 JSONEncoder 处理，输出格式与 JSONRenderer 相同。
+"""
+import json
+import logging
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # 可选依赖：未安装时使用标准库 json
+    orjson = None
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    _default = JSONEncoder().default
+
+
+def fast_enabled():
+    return orjson is not None and settings.FAST_SERIALIZATION
+
+
+def dumps(data):
+    """序列化为 JSON 字符串：启用快速序列化时使用 orjson（紧凑、非 ASCII 字符原样输出），否则与 json.dumps 相同"""
+    if fast_enabled():
+        return orjson.dumps(data, default=_default, option=_OPTIONS).decode('utf-8')
+    return json.dumps(data)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """orjson 渲染器：请求缩进输出（如 ?indent / Accept 参数）或未安装 orjson 时交给 JSONRenderer"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        return orjson.dumps(data, default=_default, option=_OPTIONS)
+
+
+class ORJSONParser(JSONParser):
+    """orjson 解析器：未安装 orjson 时交给 JSONParser"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+if settings.FAST_SERIALIZATION and orjson is None:
+    logger.warning("FAST_SERIALIZATION is enabled but orjson is not installed, falling back to stdlib json")
@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 from datetime import timedelta
+from celery.schedules import crontab
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -38,6 +39,26 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Prometheus 指标与请求关联ID
+PROMETHEUS_ENABLED = os.getenv("PROMETHEUS_ENABLED", "true").lower() == "true"
+if PROMETHEUS_ENABLED:
+    MIDDLEWARE.insert(0, "config.middleware.RequestMetricsMiddleware")
+# /metrics 的访问令牌（Prometheus bearer_token）；未设置时只允许未经 nginx 转发的内网/本机地址抓取
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# 按需请求剖析（默认关闭，关闭时不安装中间件）：X-Profile 请求头携带 PROFILING_TOKEN 或按 PROFILING_SAMPLE_RATE 抽样，
+# 记录调用树（栈采样）、SQL 与外部 HTTP 调用到 PROFILING_DIR，管理员通过 /api/profiles/ 查看
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0))
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", 5))
+PROFILING_DIR = os.getenv("PROFILING_DIR", str(BASE_DIR / "profiles"))
+PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", 200))
+PROFILING_MAX_QUERIES = int(os.getenv("PROFILING_MAX_QUERIES", 1000))
+if PROFILING_ENABLED:
+    # 位于指标中间件之后，剖析结果可关联 X-Request-ID
+    MIDDLEWARE.insert(1 if PROMETHEUS_ENABLED else 0, "config.profiling.ProfilingMiddleware")
+
 ROOT_URLCONF = "config.urls"
 
 TEMPLATES = [
@@ -90,13 +111,27 @@ CORS_ALLOW_CREDENTIALS = True
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "users.authentication.CachedJWTAuthentication",
     ),
     "DEFAULT_FILTER_BACKENDS": (
         "django_filters.rest_framework.DjangoFilterBackend",
     ),
 }
 
+# 快速序列化（可选，需安装 orjson）：DRF 使用 orjson 渲染/解析 JSON，SSE 事件使用 orjson 编码，
+# 对话列表/详情使用基于 values() 的只读序列化（输出与 ConversationSerializer 一致）
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "false").lower() == "true"
+if FAST_SERIALIZATION:
+    REST_FRAMEWORK["DEFAULT_RENDERER_CLASSES"] = (
+        "config.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    )
+    REST_FRAMEWORK["DEFAULT_PARSER_CLASSES"] = (
+        "config.renderers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    )
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=int(os.getenv("JWT_EXPIRE_MINUTES", 30))),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=int(os.getenv("JWT_REFRESH_EXPIRE_DAYS", 7))),
@@ -104,6 +139,11 @@ SIMPLE_JWT = {
     "ALGORITHM": os.getenv("JWT_ALGORITHM", "HS256"),
 }
 
+# JWT 认证用户缓存（秒）：Redis 缓存与进程内缓存，用户变更/停用时主动失效；
+# 批量更新（queryset.update）不触发信号，需执行 invalidate_user_cache，否则最长在 JWT_USER_CACHE_TTL 后生效
+JWT_USER_CACHE_TTL = int(os.getenv("JWT_USER_CACHE_TTL", 60))
+JWT_USER_LOCAL_CACHE_TTL = float(os.getenv("JWT_USER_LOCAL_CACHE_TTL", 5))
+
 # Redis + Cache
 CACHES = {
     "default": {
@@ -128,6 +168,52 @@ CHANNEL_LAYERS = {
 # Celery
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/1")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/2")
+CELERY_TIMEZONE = TIME_ZONE
+
+# 对话历史与滚动摘要：请求只携带摘要 + 最近 N 条消息；摘要之后累计 EVERY 条新消息时后台更新摘要
+CONVERSATION_HISTORY_TAIL = int(os.getenv("CONVERSATION_HISTORY_TAIL", 4))
+CONVERSATION_HISTORY_MAX_CHARS = int(os.getenv("CONVERSATION_HISTORY_MAX_CHARS", 4000))
+CONVERSATION_SUMMARY_ENABLED = os.getenv("CONVERSATION_SUMMARY_ENABLED", "true").lower() == "true"
+CONVERSATION_SUMMARY_EVERY = int(os.getenv("CONVERSATION_SUMMARY_EVERY", 10))
+CONVERSATION_SUMMARY_MAX_CHARS = int(os.getenv("CONVERSATION_SUMMARY_MAX_CHARS", 800))
+CONVERSATION_SUMMARY_TIMEOUT = float(os.getenv("CONVERSATION_SUMMARY_TIMEOUT", 60))
+CONVERSATION_SUMMARY_LOCK_SECONDS = int(os.getenv("CONVERSATION_SUMMARY_LOCK_SECONDS", 300))
+# celery：投递到 Celery worker；thread：在当前进程后台线程中执行（未部署 worker 时使用）
+CONVERSATION_SUMMARY_ASYNC = os.getenv("CONVERSATION_SUMMARY_ASYNC", "celery")
+
+# 消息流式导出：每批从数据库读取的行数（PostgreSQL 服务端游标的 fetch 大小）与输出块大小
+CHAT_EXPORT_CHUNK_SIZE = int(os.getenv("CHAT_EXPORT_CHUNK_SIZE", 2000))
+CHAT_EXPORT_FLUSH_BYTES = int(os.getenv("CHAT_EXPORT_FLUSH_BYTES", 64 * 1024))
+CHAT_EXPORT_ARCHIVE_CHUNK_SIZE = int(os.getenv("CHAT_EXPORT_ARCHIVE_CHUNK_SIZE", 20))
+
+# 可恢复流式回复：回复在后台线程生成并写入 Redis 回放缓冲（条数上限 + TTL），断线后凭 Last-Event-ID 续传
+CHAT_STREAM_RESUMABLE = os.getenv("CHAT_STREAM_RESUMABLE", "true").lower() == "true"
+CHAT_STREAM_TTL = int(os.getenv("CHAT_STREAM_TTL", 600))
+CHAT_STREAM_MAX_EVENTS = int(os.getenv("CHAT_STREAM_MAX_EVENTS", 5000))
+CHAT_STREAM_WORKERS = int(os.getenv("CHAT_STREAM_WORKERS", 32))
+# 生成线程全忙时最多排队的回复数；超出后 stream_chat 直接返回 503 + Retry-After，避免排队中的流因空闲超时被断开
+CHAT_STREAM_MAX_QUEUE = int(os.getenv("CHAT_STREAM_MAX_QUEUE", 8))
+CHAT_STREAM_RETRY_AFTER = int(os.getenv("CHAT_STREAM_RETRY_AFTER", 5))
+CHAT_STREAM_KEEPALIVE_SECONDS = float(os.getenv("CHAT_STREAM_KEEPALIVE_SECONDS", 15))
+CHAT_STREAM_IDLE_SECONDS = float(os.getenv("CHAT_STREAM_IDLE_SECONDS", 120))
+
+# 冷数据归档：最近活动早于 N 天的对话压缩归档（CODEC=zstd 需安装 zstandard，未安装时回退 zlib）
+CHAT_ARCHIVE_INACTIVE_DAYS = int(os.getenv("CHAT_ARCHIVE_INACTIVE_DAYS", 180))
+CHAT_ARCHIVE_BATCH_SIZE = int(os.getenv("CHAT_ARCHIVE_BATCH_SIZE", 100))
+CHAT_ARCHIVE_CODEC = os.getenv("CHAT_ARCHIVE_CODEC", "zlib")
+CHAT_ARCHIVE_ZSTD_LEVEL = int(os.getenv("CHAT_ARCHIVE_ZSTD_LEVEL", 10))
+CHAT_ARCHIVE_ZLIB_LEVEL = int(os.getenv("CHAT_ARCHIVE_ZLIB_LEVEL", 9))
+# 每个进程缓存的已解压归档对话数（列表接口不必每次解压），0 为不缓存
+CHAT_ARCHIVE_CACHE_SIZE = int(os.getenv("CHAT_ARCHIVE_CACHE_SIZE", 256))
+# 每天定时归档的时间（Celery beat，按 TIME_ZONE）
+CHAT_ARCHIVE_SCHEDULE_HOUR = int(os.getenv("CHAT_ARCHIVE_SCHEDULE_HOUR", 3))
+
+CELERY_BEAT_SCHEDULE = {
+    "archive-inactive-conversations": {
+        "task": "chat.tasks.archive_inactive_conversations",
+        "schedule": crontab(hour=CHAT_ARCHIVE_SCHEDULE_HOUR, minute=0),
+    },
+}
 
 # Swagger
 SWAGGER_SETTINGS = {
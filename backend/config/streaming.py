@@ -0,0 +1,36 @@
+"""ASGI 下逐块发送的流式响应内容
+
+Django 4.2 在 ASGI 下遇到同步迭代器会先 sync_to_async(list) 全部读完再发送，流式导出与 SSE 因此退化为
+整体缓冲。ASGI 请求改用异步迭代器：每块在请求专属的同步线程中生成（thread_sensitive，数据库连接与
+服务端游标始终在同一线程），生成后立即发送；WSGI（runserver）下仍直接使用同步迭代器。
+"""
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+_DONE = object()
+
+
+def is_asgi(request):
+    """DRF Request 与 Django HttpRequest 均可"""
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+async def iterate_in_thread(iterable):
+    """把同步迭代器包装为异步迭代器：每次在请求线程中取下一块；提前结束时在同一线程关闭原迭代器"""
+    iterator = iter(iterable)
+    step = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            chunk = await step(iterator, _DONE)
+            if chunk is _DONE:
+                return
+            yield chunk
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close, thread_sensitive=True)()
+
+
+def streaming_content(request, iterable):
+    """StreamingHttpResponse 的内容：ASGI 下为逐块生成的异步迭代器，WSGI 下原样返回"""
+    return iterate_in_thread(iterable) if is_asgi(request) else iterable
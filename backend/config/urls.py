@@ -4,6 +4,8 @@ from django.http import JsonResponse
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework.permissions import AllowAny
+from django.conf import settings
+from .metrics import metrics_view
 
 
 def healthz(request):
@@ -28,4 +30,15 @@ urlpatterns = [
     path("api/chat/", include("chat.urls")),
     re_path(r"^swagger(?P<format>\.json|\.yaml)$", schema_view.without_ui(cache_timeout=0), name="schema-json"),
     path("swagger/", schema_view.with_ui("swagger", cache_timeout=0), name="schema-swagger-ui"),
-]
\ No newline at end of file
+]
+
+if settings.PROMETHEUS_ENABLED:
+    urlpatterns.append(path("metrics", metrics_view))
+
+if settings.PROFILING_ENABLED:
+    from .profiling import profile_detail, profile_list
+
+    urlpatterns += [
+        path("api/profiles/", profile_list, name="profile-list"),
+        path("api/profiles/<str:profile_id>/", profile_detail, name="profile-detail"),
+    ]
\ No newline at end of file
@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_KEY = "auth:user:{}"
+# 单个用户的版本号：失效时递增而不是删除，未命中期间并发回写的旧数据带旧版本号，读取时被丢弃
+USER_VERSION_KEY = "auth:user:{}:version"
+# 全体用户的代数：queryset.update() 等不触发信号的批量变更后调用 invalidate_all_users() 递增
+USER_GENERATION_KEY = "auth:user:generation"
+# 只缓存认证与权限判断用到的字段（不含密码哈希等），命中时重建其余字段延迟加载的 User
+CACHED_FIELDS = ("is_active", "is_staff", "is_superuser")
+
+_local_cache = {}
+_local_lock = threading.Lock()
+
+
+def _cache_key(user_id):
+    return USER_CACHE_KEY.format(user_id)
+
+
+def _version_key(user_id):
+    return USER_VERSION_KEY.format(user_id)
+
+
+def _revoke_claim(user):
+    return get_md5_hash_password(user.password) if api_settings.CHECK_REVOKE_TOKEN else None
+
+
+def _build_user(user_id, entry):
+    """按数据库实例的方式重建 User：未缓存的字段（用户名、密码等）为延迟字段，访问时才从数据库加载；
+    save() 只会写入已加载的字段，不会用空值覆盖数据库中的用户行"""
+    loaded = {"id": user_id, **{field: entry[field] for field in CACHED_FIELDS}}
+    field_names = [f.attname for f in User._meta.concrete_fields if f.attname in loaded]
+    user = User.from_db("default", field_names, [loaded[name] for name in field_names])
+    user._revoke_claim = entry["revoke"]
+    return user
+
+
+def get_cached_user(user_id):
+    """先查进程内缓存，再查 Redis（数据与版本号一次读取）；均未命中或版本不符时返回 (None, 版本号)"""
+    now = time.monotonic()
+    with _local_lock:
+        entry = _local_cache.get(user_id)
+    if entry is not None and entry[0] > now:
+        return _build_user(user_id, entry[1]), None
+
+    try:
+        keys = [_cache_key(user_id), USER_GENERATION_KEY, _version_key(user_id)]
+        values = cache.get_many(keys)
+    except Exception as e:
+        # Redis 不可用时退回数据库查询
+        logger.warning(f"User cache unavailable: {e}")
+        return None, None
+    version = [values.get(USER_GENERATION_KEY, 0), values.get(_version_key(user_id), 0)]
+    cached = values.get(_cache_key(user_id))
+    if cached is not None and cached["version"] == version:
+        _set_local(user_id, cached)
+        return _build_user(user_id, cached), version
+    return None, version
+
+
+def cache_user(user, version):
+    """version 为查询数据库之前读到的版本号；期间发生失效时写入的数据不会再被读取"""
+    entry = {field: getattr(user, field) for field in CACHED_FIELDS}
+    entry["revoke"] = _revoke_claim(user)
+    entry["version"] = list(version)
+    _set_local(user.pk, entry)
+    try:
+        cache.set(_cache_key(user.pk), entry, settings.JWT_USER_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"User cache unavailable: {e}")
+
+
+def _set_local(user_id, entry):
+    with _local_lock:
+        _local_cache[user_id] = (time.monotonic() + settings.JWT_USER_LOCAL_CACHE_TTL, entry)
+
+
+def _bump(key):
+    cache.add(key, 0, timeout=None)
+    cache.incr(key)
+
+
+def invalidate_user(user_id):
+    """用户变更/停用/删除时使缓存失效（其他进程的本地缓存在 JWT_USER_LOCAL_CACHE_TTL 内过期）"""
+    with _local_lock:
+        _local_cache.pop(user_id, None)
+    try:
+        _bump(_version_key(user_id))
+    except Exception as e:
+        logger.warning(f"User cache unavailable: {e}")
+
+
+def invalidate_all_users():
+    """批量变更用户（queryset.update() 不触发 post_save）后使全部用户缓存失效"""
+    with _local_lock:
+        _local_cache.clear()
+    try:
+        _bump(USER_GENERATION_KEY)
+    except Exception as e:
+        logger.warning(f"User cache unavailable: {e}")
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWT 认证：本地校验签名，用户的认证字段从进程内缓存 + Redis 读取，常见情况下不产生 SQL 查询"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user, version = get_cached_user(user_id)
+        if user is None:
+            # 未命中时走数据库，校验通过后按查询前的版本号写入缓存（缓存不可用时不写）
+            user = super().get_user(validated_token)
+            if version is not None:
+                cache_user(user, version)
+            return user
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != user._revoke_claim:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from users.authentication import invalidate_all_users, invalidate_user
+
+
+class Command(BaseCommand):
+    help = "使认证用户缓存失效：批量 SQL/queryset.update() 修改用户（如批量停用）后执行，缺省使全部用户失效"
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', type=int, help='只使这些用户ID失效')
+
+    def handle(self, *args, **options):
+        if options['user_ids']:
+            for user_id in options['user_ids']:
+                invalidate_user(user_id)
+            self.stdout.write(f"invalidated {len(options['user_ids'])} cached users")
+        else:
+            invalidate_all_users()
+            self.stdout.write("invalidated all cached users")
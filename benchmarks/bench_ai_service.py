@@ -0,0 +1,164 @@
+"""AI服务基准测试：/v1/echo、/v1/stream_echo、不同语料规模下的 /v1/search 与 /v1/search/batch
+
+建议以离线模拟提供商启动服务，保证结果可复现：
+    MOCK_LLM_ENABLED=true MOCK_LLM_SEED=42 RATE_LIMIT_PER_MINUTE=0 uvicorn main:app --port 8002
+    python benchmarks/bench_ai_service.py --url http://127.0.0.1:8002 --out benchmarks/results/ai.json
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+
+from common import client_max_rss_bytes, environment_info, parse_int_list, run_load, scrape_rss_bytes, write_results
+
+VOCABULARY = (
+    "项目 进度 会议 纪要 报销 流程 请假 审批 采购 合同 客户 需求 版本 发布 测试 上线 "
+    "故障 复盘 值班 安全 权限 账号 培训 入职 绩效 预算 季度 目标 文档 规范"
+).split()
+
+
+def synthetic_text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words))
+
+
+async def bench_echo(client, url, model, concurrency, requests):
+    async def task(i):
+        payload = {"text": f"基准测试问题 {i}", "use_rag": False}
+        if model:
+            payload["model"] = model
+        response = await client.post(f"{url}/v1/echo", json=payload)
+        response.raise_for_status()
+
+    return await run_load(task, concurrency, requests)
+
+
+async def bench_stream_echo(client, url, model, concurrency, requests):
+    async def task(i):
+        params = {"text": f"基准测试问题 {i}", "use_rag": False}
+        if model:
+            params["model"] = model
+        started = time.perf_counter()
+        ttft = None
+        chunks = 0
+        async with client.stream("GET", f"{url}/v1/stream_echo", params=params) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.startswith("data: ") and line != "data: [DONE]":
+                    chunks += 1
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+        return {"ttft": ttft or 0.0}
+
+    return await run_load(task, concurrency, requests)
+
+
+async def seed_corpus(client, url, collection, size, seed):
+    """重建指定规模的合成语料集合"""
+    await client.delete(f"{url}/v1/collections/{collection}")
+    rng = random.Random(seed)
+    docs = [(f"文档{i}", synthetic_text(rng, 80)) for i in range(size)]
+
+    async def task(i):
+        title, content = docs[i]
+        response = await client.post(
+            f"{url}/v1/documents", json={"title": title, "content": content, "collection": collection}
+        )
+        response.raise_for_status()
+
+    started = time.perf_counter()
+    result = await run_load(task, 16, size)
+    return {"documents": result["ok"], "seconds": round(time.perf_counter() - started, 3)}
+
+
+async def bench_search(client, url, collection, concurrency, requests, seed):
+    rng = random.Random(seed)
+    queries = [synthetic_text(rng, 6) for _ in range(requests)]
+
+    async def task(i):
+        response = await client.post(
+            f"{url}/v1/search", json={"query": queries[i], "top_k": 5, "collection": collection}
+        )
+        response.raise_for_status()
+
+    return await run_load(task, concurrency, requests)
+
+
+async def bench_search_batch(client, url, collection, concurrency, requests, batch_size, seed):
+    """同样数量的查询以每请求 batch_size 个的方式发送，对比逐条 /v1/search 的吞吐量"""
+    rng = random.Random(seed)
+    queries = [synthetic_text(rng, 6) for _ in range(requests)]
+    batches = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+
+    async def task(i):
+        response = await client.post(
+            f"{url}/v1/search/batch", json={"queries": batches[i], "top_k": 5, "collection": collection}
+        )
+        response.raise_for_status()
+
+    result = await run_load(task, concurrency, len(batches))
+    result["batch_size"] = batch_size
+    result["queries_per_second"] = round(result["ok"] * batch_size / result["elapsed_s"], 3) if result["elapsed_s"] else 0.0
+    return result
+
+
+async def main(args):
+    results = {"suite": "ai-service", "env": environment_info(), "args": vars(args), "scenarios": []}
+    concurrency_levels = parse_int_list(args.concurrency)
+    limits = httpx.Limits(max_connections=max(concurrency_levels) + 16)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        results["server_rss_bytes_start"] = await scrape_rss_bytes(client, args.url)
+        # 预热
+        await client.post(f"{args.url}/v1/echo", json={"text": "warmup", "use_rag": False})
+
+        for concurrency in concurrency_levels:
+            if "echo" in args.scenarios:
+                result = await bench_echo(client, args.url, args.model, concurrency, args.requests)
+                results["scenarios"].append({"name": "echo", **result})
+                print(f"echo c={concurrency}: {result['throughput_rps']} rps p95={result['latency']['p95_ms']}ms")
+            if "stream_echo" in args.scenarios:
+                result = await bench_stream_echo(client, args.url, args.model, concurrency, args.requests)
+                results["scenarios"].append({"name": "stream_echo", **result})
+                print(f"stream_echo c={concurrency}: {result['throughput_rps']} rps ttft_p95={result['ttft']['p95_ms'] if 'ttft' in result else '-'}ms")
+
+        if "search" in args.scenarios:
+            for size in parse_int_list(args.corpus_sizes):
+                collection = f"bench_{size}"
+                seeded = await seed_corpus(client, args.url, collection, size, args.seed)
+                print(f"seeded {collection}: {seeded}")
+                for concurrency in concurrency_levels:
+                    result = await bench_search(client, args.url, collection, concurrency, args.requests, args.seed)
+                    results["scenarios"].append({"name": "search", "corpus_size": size, "seed": seeded, **result})
+                    print(f"search n={size} c={concurrency}: {result['throughput_rps']} rps p95={result['latency']['p95_ms']}ms")
+                    if "search_batch" in args.scenarios:
+                        result = await bench_search_batch(
+                            client, args.url, collection, concurrency, args.requests, args.search_batch_size, args.seed
+                        )
+                        results["scenarios"].append({"name": "search_batch", "corpus_size": size, **result})
+                        print(f"search_batch n={size} c={concurrency} b={args.search_batch_size}: "
+                              f"{result['queries_per_second']} queries/s p95={result['latency']['p95_ms']}ms")
+                if not args.keep_corpus:
+                    await client.delete(f"{args.url}/v1/collections/{collection}")
+
+        results["server_rss_bytes_end"] = await scrape_rss_bytes(client, args.url)
+    results["client_max_rss_bytes"] = client_max_rss_bytes()
+    write_results(args.out, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8002")
+    parser.add_argument("--model", default=None, help="模型参数，如 mock；默认使用服务端默认模型")
+    parser.add_argument("--scenarios", default="echo,stream_echo,search,search_batch")
+    parser.add_argument("--concurrency", default="1,8,32", help="逗号分隔的并发级别")
+    parser.add_argument("--requests", type=int, default=200, help="每个场景/并发级别的请求数")
+    parser.add_argument("--corpus-sizes", default="100,1000,10000")
+    parser.add_argument("--search-batch-size", type=int, default=100, help="search_batch 场景每个请求的查询数")
+    parser.add_argument("--keep-corpus", action="store_true", help="测试结束后保留合成语料集合")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--out", default=None, help="结果JSON路径，缺省输出到标准输出")
+    args = parser.parse_args()
+    args.scenarios = args.scenarios.split(",")
+    asyncio.run(main(args))
@@ -0,0 +1,71 @@
+"""JWT认证开销基准：对比 simplejwt 默认认证（每次查库）与 CachedJWTAuthentication 的单次认证耗时与SQL查询数
+
+在独立的内存 SQLite 测试库中运行，不影响开发数据库；缓存默认使用进程内 locmem，
+传入 --redis 则使用 settings 中配置的 Redis 缓存：
+    cd backend && python ../benchmarks/bench_auth.py --iterations 5000 --out ../benchmarks/results/auth.json
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+
+def main(args):
+    import django
+    from django.conf import settings
+
+    if not args.redis:
+        settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    settings.DATABASES["default"] = {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}
+    django.setup()
+
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.test import APIRequestFactory
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    from common import environment_info, latency_summary, write_results
+    from users.authentication import CachedJWTAuthentication
+
+    call_command("migrate", verbosity=0)
+    user = User.objects.create_user(username="bench", password="bench-password")
+    access = str(RefreshToken.for_user(user).access_token)
+    request = APIRequestFactory().get("/api/chat/conversations/", HTTP_AUTHORIZATION=f"Bearer {access}")
+
+    results = {"suite": "auth", "env": environment_info(), "args": vars(args), "scenarios": []}
+    for name, authenticator in (("simplejwt", JWTAuthentication()), ("cached", CachedJWTAuthentication())):
+        authenticator.authenticate(request)  # 预热（缓存命中路径）
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(args.iterations):
+                started = time.perf_counter()
+                authenticated_user, _token = authenticator.authenticate(request)
+                timings.append(time.perf_counter() - started)
+        assert authenticated_user.pk == user.pk
+        scenario = {
+            "name": name,
+            "iterations": args.iterations,
+            "queries_per_request": len(queries) / args.iterations,
+            "latency": latency_summary(timings),
+        }
+        results["scenarios"].append(scenario)
+        print(f"{name}: {scenario['queries_per_request']:.2f} queries/req, "
+              f"p50={scenario['latency']['p50_ms'] * 1000:.1f}us p99={scenario['latency']['p99_ms'] * 1000:.1f}us")
+    write_results(args.out, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--redis", action="store_true", help="使用 settings 中的 Redis 缓存（默认 locmem）")
+    parser.add_argument("--out", default=None, help="结果JSON路径，缺省输出到标准输出")
+    main(parser.parse_args())
@@ -0,0 +1,90 @@
+"""Django 对话接口基准测试：send_message 与 stream_chat 的并发表现
+
+AI服务建议以离线模拟提供商启动（MOCK_LLM_ENABLED=true），避免外部提供商抖动影响结果：
+    python benchmarks/bench_django.py --url http://127.0.0.1:8001 --out benchmarks/results/django.json
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import httpx
+
+from common import client_max_rss_bytes, environment_info, parse_int_list, run_load, scrape_rss_bytes, write_results
+
+
+async def login(client, url) -> str:
+    username = f"bench_{uuid.uuid4().hex[:8]}"
+    password = uuid.uuid4().hex
+    response = await client.post(f"{url}/api/auth/register/", json={"username": username, "password": password})
+    response.raise_for_status()
+    response = await client.post(f"{url}/api/auth/login/", json={"username": username, "password": password})
+    response.raise_for_status()
+    return response.json()["access"]
+
+
+async def bench_send_message(client, url, headers, concurrency, requests):
+    async def task(i):
+        response = await client.post(
+            f"{url}/api/chat/conversations/send_message/",
+            json={"text": f"基准测试问题 {i}", "use_rag": False},
+            headers=headers,
+        )
+        response.raise_for_status()
+
+    return await run_load(task, concurrency, requests)
+
+
+async def bench_stream_chat(client, url, headers, concurrency, requests):
+    async def task(i):
+        started = time.perf_counter()
+        ttft = None
+        async with client.stream(
+            "POST",
+            f"{url}/api/chat/conversations/stream_chat/",
+            json={"text": f"基准测试问题 {i}", "use_rag": False},
+            headers=headers,
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if ttft is None and line.startswith("data: {"):
+                    if json.loads(line[6:]).get("type") == "ai_chunk":
+                        ttft = time.perf_counter() - started
+        return {"ttft": ttft or 0.0}
+
+    return await run_load(task, concurrency, requests)
+
+
+async def main(args):
+    results = {"suite": "django", "env": environment_info(), "args": vars(args), "scenarios": []}
+    concurrency_levels = parse_int_list(args.concurrency)
+    limits = httpx.Limits(max_connections=max(concurrency_levels) + 16)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        headers = {"Authorization": f"Bearer {await login(client, args.url)}"}
+        results["server_rss_bytes_start"] = await scrape_rss_bytes(client, args.url)
+        for concurrency in concurrency_levels:
+            if "send_message" in args.scenarios:
+                result = await bench_send_message(client, args.url, headers, concurrency, args.requests)
+                results["scenarios"].append({"name": "send_message", **result})
+                print(f"send_message c={concurrency}: {result['throughput_rps']} rps p95={result['latency']['p95_ms']}ms")
+            if "stream_chat" in args.scenarios:
+                result = await bench_stream_chat(client, args.url, headers, concurrency, args.requests)
+                results["scenarios"].append({"name": "stream_chat", **result})
+                print(f"stream_chat c={concurrency}: {result['throughput_rps']} rps p95={result['latency']['p95_ms']}ms")
+        results["server_rss_bytes_end"] = await scrape_rss_bytes(client, args.url)
+    results["client_max_rss_bytes"] = client_max_rss_bytes()
+    write_results(args.out, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8001")
+    parser.add_argument("--scenarios", default="send_message,stream_chat")
+    parser.add_argument("--concurrency", default="1,8,32", help="逗号分隔的并发级别")
+    parser.add_argument("--requests", type=int, default=100, help="每个场景/并发级别的请求数")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--out", default=None, help="结果JSON路径，缺省输出到标准输出")
+    args = parser.parse_args()
+    args.scenarios = args.scenarios.split(",")
+    asyncio.run(main(args))
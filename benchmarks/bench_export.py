@@ -0,0 +1,72 @@
+"""消息流式导出基准：不同数据量、格式下的导出吞吐量（rows/sec）与 Python 堆内存峰值
+
+峰值内存应与数据量无关（逐批读取 + 按块输出）；在独立的内存 SQLite 测试库中运行：
+    cd backend && python ../benchmarks/bench_export.py --rows 10000,100000 --out ../benchmarks/results/export.json
+"""
+import argparse
+import os
+import sys
+import tracemalloc
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+
+def main(args):
+    import django
+    from django.conf import settings
+
+    settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    settings.DATABASES["default"] = {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}
+    django.setup()
+
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+
+    from chat.export import ExportStats, export_rows, iter_export
+    from chat.models import Conversation, Message
+    from common import environment_info, parse_int_list, write_results
+
+    call_command("migrate", verbosity=0)
+    user = User.objects.create_user(username="bench", password="bench-password")
+    conv = Conversation.objects.create(user=user, title="导出基准")
+    content = "基准测试消息内容 " * (args.message_chars // 9 + 1)
+
+    results = {"suite": "export", "env": environment_info(), "args": vars(args), "scenarios": []}
+    seeded = 0
+    for rows in parse_int_list(args.rows):
+        while seeded < rows:
+            batch = min(10000, rows - seeded)
+            Message.objects.bulk_create(
+                [Message(conversation=conv, role="user", content=content[: args.message_chars]) for _ in range(batch)]
+            )
+            seeded += batch
+        for export_format, compress in (("ndjson", False), ("csv", False), ("ndjson", True)):
+            stats = ExportStats()
+            tracemalloc.start()
+            for _chunk in iter_export(export_rows(user.id, chunk_size=args.chunk_size), export_format, compress, stats=stats):
+                pass
+            _current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            scenario = {
+                "name": f"{export_format}{'+gzip' if compress else ''}",
+                "rows": rows,
+                **stats.as_dict(),
+                "peak_heap_bytes": peak,
+            }
+            results["scenarios"].append(scenario)
+            print(f"{scenario['name']:<12} rows={rows:<8} {scenario['rows_per_sec']:>10.0f} rows/sec "
+                  f"bytes={scenario['bytes']:<10} peak_heap={peak / 1024:.0f}KiB")
+    write_results(args.out, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10000,100000", help="逗号分隔的数据量（递增）")
+    parser.add_argument("--message-chars", type=int, default=200)
+    parser.add_argument("--chunk-size", type=int, default=None, help="缺省取 CHAT_EXPORT_CHUNK_SIZE")
+    parser.add_argument("--out", default=None, help="结果JSON路径，缺省输出到标准输出")
+    main(parser.parse_args())
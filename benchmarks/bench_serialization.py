@@ -0,0 +1,107 @@
+"""序列化基准：对话列表每 1k 条消息的序列化耗时，对比默认路径与快速路径（FAST_SERIALIZATION）
+
+- baseline：ConversationSerializer（ModelSerializer，逐条消息实例化）+ DRF JSONRenderer
+- fast：serialize_conversations（values() 构建字典）+ ORJSONRenderer（需安装 orjson）
+- sse：流式回复每个文本块的 SSE 帧编码（json.dumps 与 orjson）
+两条路径的输出逐字节比较，确保快速路径不改变响应内容。在独立的内存 SQLite 测试库中运行：
+    cd backend && python ../benchmarks/bench_serialization.py --messages 1000,10000 --out ../benchmarks/results/serialization.json
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = func()
+        timings.append(time.perf_counter() - started)
+    return output, timings
+
+
+def main(args):
+    import django
+    from django.conf import settings
+
+    settings.CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    settings.DATABASES["default"] = {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}
+    django.setup()
+
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from rest_framework.renderers import JSONRenderer
+
+    from chat import streams
+    from chat.models import Conversation, Message
+    from chat.serializers import ConversationSerializer, serialize_conversations
+    from common import environment_info, latency_summary, parse_int_list, write_results
+    from config.renderers import ORJSONRenderer, orjson
+
+    if orjson is None:
+        print("orjson 未安装，fast 路径将回退到标准库 json")
+
+    call_command("migrate", verbosity=0)
+    user = User.objects.create_user(username="bench", password="bench-password")
+    content = "基准测试消息内容 " * (args.message_chars // 9 + 1)
+    queryset = Conversation.objects.filter(user=user).order_by("-updated_at")
+
+    paths = {
+        "baseline": lambda: JSONRenderer().render(ConversationSerializer(queryset.all(), many=True).data),
+        "fast": lambda: ORJSONRenderer().render(serialize_conversations(queryset.all())),
+    }
+
+    results = {"suite": "serialization", "env": environment_info(), "args": vars(args), "scenarios": []}
+    seeded = 0
+    for messages in parse_int_list(args.messages):
+        while seeded < messages:
+            conv = Conversation.objects.create(user=user, title=f"对话{seeded // args.per_conversation}")
+            batch = min(args.per_conversation, messages - seeded)
+            Message.objects.bulk_create([
+                Message(conversation=conv, role="user" if i % 2 == 0 else "ai", content=content[: args.message_chars])
+                for i in range(batch)
+            ])
+            seeded += batch
+        outputs = {}
+        for name, render in paths.items():
+            outputs[name], timings = timed(render, args.repeat)
+            per_1k_ms = min(timings) * 1000 * 1000 / messages
+            scenario = {
+                "name": name,
+                "messages": messages,
+                "bytes": len(outputs[name]),
+                "per_1k_messages_ms": round(per_1k_ms, 3),
+                "latency": latency_summary(timings),
+            }
+            results["scenarios"].append(scenario)
+            print(f"{name:<9} messages={messages:<7} {per_1k_ms:>8.2f} ms/1k messages  bytes={scenario['bytes']}")
+        assert outputs["baseline"] == outputs["fast"], "快速路径的输出与默认路径不一致"
+
+    # SSE 帧编码：流式回复的每个文本块都要编码一次
+    chunk = content[:8]
+    for fast in (False, True):
+        settings.FAST_SERIALIZATION = fast
+        _, timings = timed(lambda: [streams.format_event("ai_chunk", chunk, "s:1") for _ in range(args.chunks)], args.repeat)
+        per_chunk_us = min(timings) * 1e6 / args.chunks
+        name = "sse_orjson" if fast and orjson is not None else "sse_json"
+        results["scenarios"].append({"name": name, "chunks": args.chunks, "per_chunk_us": round(per_chunk_us, 3)})
+        print(f"{name:<11} {per_chunk_us:>8.3f} us/chunk")
+    write_results(args.out, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", default="1000,10000", help="逗号分隔的消息总数（递增）")
+    parser.add_argument("--per-conversation", type=int, default=50, help="每个对话的消息数")
+    parser.add_argument("--message-chars", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5, help="每个场景重复次数，取最快一次")
+    parser.add_argument("--chunks", type=int, default=10000, help="SSE 编码场景的文本块数")
+    parser.add_argument("--out", default=None, help="结果JSON路径，缺省输出到标准输出")
+    main(parser.parse_args())
@@ -0,0 +1,107 @@
+"""分片并行检索基准：分片数 × 并发数下的检索吞吐（QPS）与单查询延迟
+
+在进程内直接构建 KnowledgeBase（随机单位向量，不加载嵌入模型），每个分片数构建一次语料：
+- concurrency=1 反映单查询延迟（分片在线程池中并行搜索）
+- concurrency>1 由多个线程同时调用 search，模拟并发请求
+各分片数的检索结果与单分片逐条比较，确保合并后的 top-k 一致。
+    cd ai-service && python ../benchmarks/bench_vector_search.py --vectors 200000 --shards 1,2,4,8 \\
+        --concurrency 1,4,16 --search-threads 8 --omp-threads 1 --out ../benchmarks/results/vector_search.json
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+AI_SERVICE_DIR = Path(__file__).resolve().parent.parent / "ai-service"
+sys.path.insert(0, str(AI_SERVICE_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+
+def run_threads(search, concurrency, requests):
+    """以固定线程并发执行 requests 次 search(i)，返回吞吐与延迟分位数"""
+    from common import latency_summary
+
+    latencies = []
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+
+    def worker():
+        while True:
+            with counter_lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            started = time.perf_counter()
+            search(i)
+            latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_qps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "latency": latency_summary(latencies),
+    }
+
+
+def main(args):
+    import faiss
+    import numpy as np
+
+    from common import environment_info, parse_int_list, write_results
+    from knowledge_base import KnowledgeBase, configure_search_threads
+
+    configure_search_threads(args.search_threads or None, args.omp_threads or None)
+    rng = np.random.default_rng(args.seed)
+    vectors = rng.standard_normal((args.vectors, args.dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    env = environment_info()
+    env["faiss_omp_threads"] = faiss.omp_get_max_threads()
+    results = {"suite": "vector_search", "env": env, "args": vars(args), "scenarios": []}
+    reference = None
+    for shards in parse_int_list(args.shards):
+        kb = KnowledgeBase(dim=args.dim, shards=shards)
+        for i, vector in enumerate(vectors):
+            kb.add(f"doc-{i}", "", {}, vector)
+
+        hits = [[doc["id"] for _, doc in row] for row in kb.search(queries, args.top_k)]
+        if reference is None:
+            reference = hits
+        assert hits == reference, f"shards={shards} 的检索结果与 shards=1 不一致"
+
+        for concurrency in parse_int_list(args.concurrency):
+            requests = max(args.requests, concurrency)
+            scenario = run_threads(lambda i: kb.search(queries[i % len(queries)][None, :], args.top_k), concurrency, requests)
+            scenario = {"name": "search", "shards": shards, "vectors": args.vectors, **scenario}
+            results["scenarios"].append(scenario)
+            print(f"shards={shards:<3} concurrency={concurrency:<4} {scenario['throughput_qps']:>10.1f} qps  "
+                  f"p50={scenario['latency']['p50_ms']:.3f}ms p99={scenario['latency']['p99_ms']:.3f}ms")
+    write_results(args.out, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=200000, help="语料向量数")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--shards", default="1,2,4,8", help="逗号分隔的分片数（首个作为结果一致性基准）")
+    parser.add_argument("--concurrency", default="1,4,16", help="逗号分隔的并发线程数")
+    parser.add_argument("--requests", type=int, default=500, help="每个场景的检索次数")
+    parser.add_argument("--queries", type=int, default=256, help="轮流使用的查询向量数")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--search-threads", type=int, default=0, help="分片检索线程池大小，0 为 CPU 核数")
+    parser.add_argument("--omp-threads", type=int, default=1, help="每次 FAISS 调用的 OpenMP 线程数，0 为不修改")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default=None, help="结果JSON路径，缺省输出到标准输出")
+    main(parser.parse_args())
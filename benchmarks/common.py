@@ -0,0 +1,121 @@
+"""基准测试公共工具：并发压测驱动、延迟分位数统计、环境信息与结果输出"""
+import asyncio
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def latency_summary(values: List[float]) -> Dict[str, float]:
+    """秒 -> 毫秒的分位数汇总"""
+    values = sorted(values)
+    if not values:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "mean_ms": 0.0, "max_ms": 0.0}
+    return {
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3),
+    }
+
+
+async def run_load(
+    task: Callable[[int], Awaitable[Optional[Dict[str, float]]]],
+    concurrency: int,
+    requests: int,
+) -> Dict:
+    """以固定并发执行 requests 次 task(i)；task 可返回额外的耗时指标（如 ttft）"""
+    latencies: List[float] = []
+    extras: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                extra = await task(i)
+            except Exception as e:
+                key = type(e).__name__
+                errors[key] = errors.get(key, 0) + 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            for name, value in (extra or {}).items():
+                extras.setdefault(name, []).append(value)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "concurrency": concurrency,
+        "requests": requests,
+        "ok": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "latency": latency_summary(latencies),
+    }
+    for name, values in extras.items():
+        result[name] = latency_summary(values)
+    return result
+
+
+async def scrape_rss_bytes(client: httpx.AsyncClient, base_url: str) -> Optional[int]:
+    """从服务的 /metrics 读取 process_resident_memory_bytes（Linux 下由 prometheus_client 自动导出）"""
+    try:
+        response = await client.get(f"{base_url}/metrics")
+        match = re.search(r"^process_resident_memory_bytes ([0-9.e+]+)$", response.text, re.MULTILINE)
+        return int(float(match.group(1))) if match else None
+    except Exception:
+        return None
+
+
+def environment_info() -> Dict:
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "mock_llm": {k: v for k, v in os.environ.items() if k.startswith("MOCK_LLM_")},
+    }
+
+
+def client_max_rss_bytes() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def write_results(path: Optional[str], results: Dict):
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if path:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(text, encoding="utf-8")
+        print(f"results written to {path}")
+    else:
+        print(text)
+
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
@@ -0,0 +1,47 @@
+"""对比两次基准测试结果（如两个提交之间）：
+    python benchmarks/compare.py benchmarks/results/base.json benchmarks/results/head.json
+"""
+import json
+import sys
+
+
+def scenario_key(scenario):
+    key = f"{scenario['name']} c={scenario['concurrency']}"
+    if "corpus_size" in scenario:
+        key += f" n={scenario['corpus_size']}"
+    return key
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return data, {scenario_key(s): s for s in data["scenarios"]}
+
+
+def delta(old, new):
+    if not old:
+        return "   n/a"
+    return f"{(new - old) / old * 100:+6.1f}%"
+
+
+def main(base_path, head_path):
+    base, base_scenarios = load(base_path)
+    head, head_scenarios = load(head_path)
+    print(f"base: {base['env'].get('commit')}  head: {head['env'].get('commit')}")
+    print(f"{'scenario':<32}{'rps':>20}{'p50 ms':>22}{'p95 ms':>22}{'p99 ms':>22}")
+    for key, new in head_scenarios.items():
+        old = base_scenarios.get(key)
+        if old is None:
+            continue
+        row = f"{key:<32}"
+        row += f"{new['throughput_rps']:>11.1f} {delta(old['throughput_rps'], new['throughput_rps'])}"
+        for p in ("p50_ms", "p95_ms", "p99_ms"):
+            row += f"{new['latency'][p]:>13.1f} {delta(old['latency'][p], new['latency'][p])}"
+        print(row)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(1)
+    main(sys.argv[1], sys.argv[2])